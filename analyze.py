@@ -1,64 +1,124 @@
 import os
-import json
-from pathlib import Path
+from pathlib import Path, PurePath
+from json_validator import validate_file, validate_files, correctness
+
+EXTRACTED_PREFIX = "extracted_files_"
+RELATED_SUBDIRS = {"math_files": "formulas", "images": "images"}
+
+class ExtractedFilesIndex:
+    """
+    Индекс извлечённых формул и изображений, построенный за один обход base_dir.
+
+    Для каждого документа (папка + имя без расширения) хранится число
+    файлов формул и изображений в extracted_files_<имя>/math_files и
+    .../images, а также множество хвостов путей
+    extracted_files_<имя>/<подпапка>/<файл> для проверки ссылок.
+    Заодно собирается список JSON файлов, так что дерево читается один раз.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = Path(base_dir)
+        self.json_files = []
+        self.counts = {}
+        self.related_paths = set()
+        self._scan()
+
+    def _scan(self):
+        for root, dirs, files in os.walk(self.base_dir):
+            root_path = Path(root)
+            kind = RELATED_SUBDIRS.get(root_path.name)
+            extracted_dir = root_path.parent
+            if kind and extracted_dir.name.startswith(EXTRACTED_PREFIX):
+                stem = extracted_dir.name[len(EXTRACTED_PREFIX):]
+                counts = self.counts.setdefault(
+                    (str(extracted_dir.parent), stem), {"formulas": 0, "images": 0}
+                )
+                for name in files:
+                    self.related_paths.add((extracted_dir.name, root_path.name, name))
+                    # Как и раньше, учитываются только файлы с именем документа в начале
+                    if name.startswith(stem):
+                        counts[kind] += 1
+                continue
+            for name in files:
+                if name.endswith(".json"):
+                    self.json_files.append(root_path / name)
+
+    def related_counts(self, json_file):
+        """Число формул и изображений документа или None, если папки extracted_files нет"""
+        return self.counts.get((str(json_file.parent), json_file.stem))
+
+    def reference_exists(self, path):
+        """
+        Проверяет ссылку [Формула заменена: ...]/[Изображение заменено: ...]
+        по хвосту пути, поэтому ссылки остаются верными после переноса дерева.
+        """
+        return tuple(PurePath(path.strip()).parts[-3:]) in self.related_paths
 
 class FileAnalyzer:
-    def __init__(self, base_dir, output_dir):
+    def __init__(self, base_dir, output_dir, workers=None):
         self.base_dir = Path(base_dir)
         self.output_dir = Path(output_dir)
+        self.workers = workers
         # Создаем output_dir, если она не существует
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._index = None
+        self._validation = {}
 
-    def _find_extracted_dir(self, json_file):
-        """Находит директорию extracted_files для конкретного JSON файла"""
-        # Получаем базовое имя JSON файла без расширения
-        base_name = json_file.stem  # например 'W-9-001-T-kg'
-        
-        # Ищем папку extracted_files с соответствующим суффиксом
-        expected_dir_name = f"extracted_files_{base_name}"
-        extracted_dir = json_file.parent / expected_dir_name
-        
-        if extracted_dir.exists() and extracted_dir.is_dir():
-            return {
-                'extracted_dir': extracted_dir,
-                'math_files_dir': extracted_dir / "math_files",
-                'images_dir': extracted_dir / "images"
-            }
-        return None
+    @property
+    def index(self):
+        """Индекс извлечённых файлов; строится при первом обращении"""
+        if self._index is None:
+            self._index = ExtractedFilesIndex(self.base_dir)
+        return self._index
 
     def check_has_related_files(self, json_file):
         """Проверяет наличие связанных файлов формул и изображений"""
-        dirs = self._find_extracted_dir(json_file)
-        if not dirs:
+        counts = self.index.related_counts(json_file)
+        if not counts:
             return False
             
         has_related_files = False
-        base_name = json_file.stem
         
-        # Проверяем наличие файлов в папке math_files
-        math_files_dir = dirs['math_files_dir']
-        if math_files_dir.exists():
-            formula_files = list(math_files_dir.glob(f"{base_name}*"))
-            if formula_files:
-                has_related_files = True
-                print(f"Найдены файлы формул для {json_file.name}")
+        # Файлы формул из папки math_files
+        if counts["formulas"]:
+            has_related_files = True
+            print(f"Найдены файлы формул для {json_file.name}")
         
-        # Проверяем наличие файлов в папке images
-        images_dir = dirs['images_dir']
-        if images_dir.exists():
-            image_files = list(images_dir.glob(f"{base_name}*"))
-            if image_files:
-                has_related_files = True
-                print(f"Найдены файлы изображений для {json_file.name}")
+        # Файлы изображений из папки images
+        if counts["images"]:
+            has_related_files = True
+            print(f"Найдены файлы изображений для {json_file.name}")
         
         return has_related_files
 
+    def validate_all(self):
+        """Разбирает и проверяет все JSON файлы один раз (json_validator)"""
+        results = validate_files(self.index.json_files, workers=self.workers)
+        self._validation = {r["path"]: r for r in results}
+        return results
+
+    def _validation_result(self, json_file):
+        result = self._validation.get(str(json_file))
+        return result if result is not None else validate_file(json_file)
+
+    def find_missing_references(self, json_files):
+        """
+        Находит ссылки на формулы и изображения в JSON файлах, которые
+        не указывают на существующий файл
+        """
+        missing = []
+        for json_file in json_files:
+            for kind, path in self._validation_result(json_file)["references"]:
+                if not self.index.reference_exists(path):
+                    missing.append(f"{Path(json_file).absolute()}\t{kind}\t{path}")
+        return missing
+
     def find_files_with_images_and_formulas(self):
         """Находит все JSON файлы с изображениями или формулами"""
         files_with_related = []
         remaining_files = []
         
-        json_files = list(self.base_dir.rglob("*.json"))
+        json_files = self.index.json_files
         print(f"\nНайдено JSON файлов: {len(json_files)}")
         
         for json_file in json_files:
@@ -80,26 +140,7 @@ class FileAnalyzer:
 
     def check_json_correctness(self, json_file):
         """Проверяет корректность JSON файла"""
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-                if not isinstance(data, dict):
-                    return False, "Неверная структура документа"
-                    
-                if "questions" not in data:
-                    return False, "Отсутствует секция questions"
-                
-                for idx, question in enumerate(data["questions"], 1):
-                    if "answer" not in question or not question["answer"].strip():
-                        return False, f"Вопрос {idx}: пустой ответ"
-                
-                return True, None
-                    
-        except json.JSONDecodeError as e:
-            return False, f"Невалидный JSON файл: {str(e)}"
-        except Exception as e:
-            return False, f"Ошибка при обработке: {str(e)}"
+        return correctness(self._validation_result(json_file))
                 
     def analyze_remaining_files(self, remaining_files):
         """Анализирует оставшиеся файлы на корректность"""
@@ -145,13 +186,22 @@ class FileAnalyzer:
             f.write(f"Некорректно обработанных файлов: {len(results['incorrectly_parsed'])}\n")
     
     def generate_report(self):
-        """Генерирует отчет анализа"""
+        """Генерирует отчет анализа; возвращает результаты проверки всех JSON файлов"""
         print("\nПоиск файлов с изображениями и формулами...")
         remaining_files = self.find_files_with_images_and_formulas()
         
+        print("\nПроверка JSON файлов...")
+        validation = self.validate_all()
+        
         print("\nАнализ оставшихся файлов...")
         results = self.analyze_remaining_files(remaining_files)
         
+        print("\nПроверка ссылок на формулы и изображения...")
+        missing_references = self.find_missing_references(self.index.json_files)
+        with open(self.output_dir / "missing_references.txt", 'w', encoding='utf-8') as f:
+            for line in missing_references:
+                f.write(f"{line}\n")
+        
         # Подсчет статистики
         files_with_related = len(list(Path(self.output_dir / 'images.txt').read_text().splitlines()))
         total_files = len(remaining_files) + files_with_related
@@ -161,10 +211,12 @@ class FileAnalyzer:
         print(f"Файлов с изображениями/формулами: {files_with_related}")
         print(f"Корректно обработанных файлов: {len(results['correctly_parsed'])}")
         print(f"Некорректно обработанных файлов: {len(results['incorrectly_parsed'])}")
+        print(f"Ссылок на несуществующие файлы: {len(missing_references)}")
         
         self.save_results_to_txt(results, total_files, files_with_related)
         
         print(f"\nРезультаты сохранены в директории: {self.output_dir}")
+        return validation
 
 def main():
     base_dir = "/mnt/ks/Works/3nd_tests/ready(last)"
@@ -2,7 +2,8 @@
 import os
 import logging
 from pathlib import Path
-from docx import Document
+from docx_text import extract_text_from_docx as stream_text_from_docx
+from run_manifest import RunManifest, STATUS_OK, STATUS_EMPTY, STATUS_FAILED
 
 # Настройка логирования: вывод в консоль и запись в файл
 logging.basicConfig(
@@ -16,36 +17,22 @@ logging.basicConfig(
 
 def extract_text_from_docx(file_path):
     """
-    Извлекает текст из документа Word, включая текст из параграфов и таблиц.
+    Извлекает текст из документа Word, включая текст из параграфов и таблиц,
+    в порядке их следования в документе.
     
     Args:
         file_path (str): Путь к файлу DOCX.
         
     Returns:
         str: Извлечённый текст.
+
+    Raises:
+        Exception: если файл не удалось открыть или разобрать; вызывающий
+        код отмечает файл в манифесте как STATUS_FAILED, а не STATUS_EMPTY.
     """
-    try:
-        doc = Document(file_path)
-    except Exception as e:
-        logging.error(f"Ошибка открытия файла {file_path}: {e}")
-        return ""
-        
-    full_text = []
-    
-    # Извлечение текста из параграфов
-    for paragraph in doc.paragraphs:
-        if paragraph.text.strip():  # Пропускаем пустые строки
-            full_text.append(paragraph.text)
-    
-    # Извлечение текста из таблиц
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    if paragraph.text.strip():
-                        full_text.append(paragraph.text)
-    
-    return "\n".join(full_text)
+    # Потоковое чтение word/document.xml: параграфы и ячейки таблиц
+    # выдаются в порядке документа без построения модели python-docx
+    return stream_text_from_docx(file_path)
 
 def extract_text_from_directory(source_dir, output_dir):
     """
@@ -53,7 +40,8 @@ def extract_text_from_directory(source_dir, output_dir):
     и сохраняет результаты в output_dir, создавая аналогичную структуру директорий.
     
     Для каждого файла DOCX создаётся текстовый файл с расширением .txt,
-    содержащий извлечённый текст.
+    содержащий извлечённый текст. Файлы, не изменившиеся с прошлого
+    успешного запуска (по манифесту этапа "docx_to_txt"), пропускаются.
     
     Args:
         source_dir (str): Путь к исходной директории с файлами DOCX.
@@ -66,24 +54,35 @@ def extract_text_from_directory(source_dir, output_dir):
     docx_files = list(source_dir.rglob("*.docx"))
     logging.info(f"Найдено {len(docx_files)} файлов DOCX")
     
+    manifest = RunManifest.from_env("docx_to_txt")
+    up_to_date = 0
+    
     for docx_file in docx_files:
+        # Вычисляем относительный путь относительно исходной директории
+        relative_path = docx_file.relative_to(source_dir)
+        # Формируем путь для текстового файла (заменяем расширение .docx на .txt)
+        output_file = output_dir / relative_path.with_suffix(".txt")
+        
+        process, reason = manifest.check(str(docx_file), str(output_file))
+        if not process:
+            up_to_date += 1
+            continue
+        
         try:
             text = extract_text_from_docx(docx_file)
-            
-            # Вычисляем относительный путь относительно исходной директории
-            relative_path = docx_file.relative_to(source_dir)
-            # Формируем путь для текстового файла (заменяем расширение .docx на .txt)
-            output_file = output_dir / relative_path.with_suffix(".txt")
             output_file.parent.mkdir(parents=True, exist_ok=True)
             
             with open(output_file, "w", encoding="utf-8") as f:
                 f.write(text)
             
-            logging.info(f"Извлечён текст из {docx_file} -> {output_file}")
+            status = STATUS_OK if text.strip() else STATUS_EMPTY
+            manifest.record(str(docx_file), status, str(output_file))
+            logging.info(f"Извлечён текст из {docx_file} -> {output_file} ({reason})")
         except Exception as e:
+            manifest.record(str(docx_file), STATUS_FAILED, str(output_file))
             logging.error(f"Ошибка при обработке файла {docx_file}: {e}")
     
-    logging.info("Извлечение текста завершено.")
+    logging.info(f"Извлечение текста завершено. Без изменений: {up_to_date}")
 
 if __name__ == "__main__":
     # Укажите исходную директорию с DOCX файлами
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+import os
+import re
+import json
+import logging
+import argparse
+from datetime import datetime
+from pathlib import PurePath
+
+from extract_answers import ANSWER_KEY_SUFFIX
+from json_validator import validate_file, correctness
+from results_store import parse_test_path
+
+logger = logging.getLogger(__name__)
+
+# Идентификатор теста в имени файла или папки: W-8-032, S-10-026
+TEST_ID_RE = re.compile(r"\b([A-Za-z]+-\d+-\d+)")
+# Латинские буквы, похожие на кириллические варианты ответа
+LOOKALIKES = str.maketrans("aeopcx", "аеорсх")
+# Вариант теста в названии или имени файла: "2-вариант", "Вариант II", "1-нуска", "вар. 3"
+VARIANT_RE = re.compile(
+    r"(?:(?<![-\w])(\d+|[IVX]+)\s*[-–]?\s*(?:вар(?:иант)?|нуска)|(?:вар(?:иант)?|нуска)\.?\s*№?\s*(\d+|[IVX]+)\b)",
+    re.IGNORECASE,
+)
+ROMAN = {"I": 1, "V": 5, "X": 10, "L": 50}
+
+
+def find_test_id(path):
+    """Идентификатор теста из имени файла, иначе из ближайшей папки"""
+    path = PurePath(path)
+    for name in (path.stem, *reversed(path.parent.parts)):
+        match = TEST_ID_RE.search(name)
+        if match:
+            return match.group(1).upper()
+    return None
+
+
+def variant_number(value):
+    """ "2" / "II" / "ii" -> "2"; вариант ключа и теста сравниваются в таком виде """
+    value = str(value).strip().upper()
+    if value.isdigit():
+        return str(int(value))
+    if value and all(c in ROMAN for c in value):
+        total = 0
+        for c, nxt in zip(value, value[1:] + " "):
+            total += -ROMAN[c] if ROMAN.get(nxt, 0) > ROMAN[c] else ROMAN[c]
+        return str(total)
+    return value
+
+
+def find_variant(title, path):
+    """Вариант теста из названия, иначе из имени файла; None, если не указан"""
+    for text in (title, PurePath(path).stem):
+        match = VARIANT_RE.search(text) if isinstance(text, str) else None
+        if match:
+            return variant_number(match.group(1) or match.group(2))
+    return None
+
+
+def normalize_answer(value):
+    """
+    "А)" / "a." / " б " -> "а" / "а" / "б". Только для сравнения:
+    в JSON записывается ответ ключа как есть.
+    """
+    if not isinstance(value, str):
+        return ""
+    return value.strip().lower().strip(" ).;,").translate(LOOKALIKES)
+
+
+def key_language(path):
+    """Язык теста ("kg"/"ru") по имени файла или папкам; для ключа - без суффикса .answers.json"""
+    path = str(path)
+    if path.endswith(ANSWER_KEY_SUFFIX):
+        path = path[:-len(ANSWER_KEY_SUFFIX)] + ".json"
+    return parse_test_path(path)["language"]
+
+
+def select_key(entries, json_path):
+    """
+    Ключ для теста из нескольких с тем же идентификатором (kg/ru версии,
+    копии таблиц): сначала того же языка, затем из папки с тем же именем.
+    Оставшиеся ключи с одинаковыми вариантами взаимозаменяемы.
+
+    Returns:
+        tuple: ((путь, ключ) или None, причина, если ключ не выбран)
+    """
+    candidates = entries
+    if json_path is not None:
+        language = key_language(json_path)
+        same_language = [entry for entry in candidates if key_language(entry[0]) == language]
+        if language and same_language:
+            candidates = same_language
+        folder = PurePath(json_path).parent.name
+        same_folder = [entry for entry in candidates if PurePath(entry[0]).parent.name == folder]
+        if same_folder:
+            candidates = same_folder
+    def normalized(key):
+        return {variant_number(name): [normalize_answer(a) for a in answers] for name, answers in key["variants"].items()}
+
+    if all(normalized(key) == normalized(candidates[0][1]) for _, key in candidates[1:]):
+        return candidates[0], None
+    return None, f"several answer keys: {', '.join(path for path, _ in candidates)}"
+
+
+def option_letters(options):
+    letters = set()
+    if isinstance(options, list):
+        for option in options:
+            if isinstance(option, str) and option.strip():
+                letters.add(normalize_answer(re.split(r"[).]", option.strip(), 1)[0]))
+    return letters
+
+
+class AnswerKeyIndex:
+    """
+    Ключи ответов (*.answers.json из extract_answers.py), собранные по
+    идентификатору теста. lookup() выбирает вариант и возвращает ответы
+    ключа (исходный текст) по номерам вопросов.
+    """
+
+    def __init__(self, keys_dir):
+        self.keys = {}
+        for root, _, files in os.walk(keys_dir):
+            for name in files:
+                if not name.endswith(ANSWER_KEY_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                test_id = find_test_id(path)
+                if test_id is None:
+                    logger.warning(f"No test ID in answer key path: {path}")
+                    continue
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        key = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Cannot read answer key {path}: {e}")
+                    continue
+                if key.get("variants"):
+                    self.keys.setdefault(test_id, []).append((path, key))
+        logger.info(f"Answer keys indexed for {len(self.keys)} tests")
+
+    def lookup(self, test_id, variant=None, json_path=None):
+        """
+        json_path - путь JSON теста, по которому выбирается ключ, если их
+        несколько (см. select_key).
+
+        Returns:
+            tuple: ({номер вопроса: ответ}, путь ключа, None) или
+            (None, путь ключа или None, причина, по которой ключ не выбран)
+        """
+        entries = self.keys.get(test_id)
+        if not entries:
+            return None, None, None
+        entry, error = select_key(entries, json_path)
+        if entry is None:
+            return None, None, error
+        path, key = entry
+        variants = key["variants"]
+        if variant is not None:
+            matching = [name for name in variants if variant_number(name) == variant_number(variant)]
+            if not matching:
+                return None, path, f"variant {variant} not in answer key"
+            variant = matching[0]
+        elif len(variants) == 1:
+            variant = next(iter(variants))
+        else:
+            return None, path, f"test has no variant, key has {len(variants)}: {sorted(variants)}"
+
+        answers = variants[variant]
+        numbers = key.get("questions") or range(1, len(answers) + 1)
+        return {number: str(answer).strip() for number, answer in zip(numbers, answers)}, path, None
+
+
+def join_file(json_path, index, overwrite=True):
+    """
+    Заполняет пустые ответы теста по ключу и сверяет заполненные.
+
+    overwrite=True - расходящийся с ключом ответ заменяется ключом
+    (таблица ответов - первоисточник); иначе он только попадает в
+    список конфликтов. Ответ ключа, которого нет среди букв вариантов
+    вопроса, не подставляется.
+
+    Returns:
+        tuple: (статус "no_key"/"key_conflict"/"updated"/"unchanged"/"failed",
+        число заполненных, число заменённых, список конфликтов)
+    """
+    test_id = find_test_id(json_path)
+    try:
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        return "failed", 0, 0, [f"cannot read JSON: {e}"]
+    if not isinstance(data, dict) or not isinstance(data.get("questions"), list):
+        return "failed", 0, 0, ["no questions section"]
+
+    answers, key_path, error = index.lookup(test_id, find_variant(data.get("title"), json_path), json_path)
+    if answers is None:
+        return ("key_conflict", 0, 0, [error]) if error else ("no_key", 0, 0, [])
+
+    filled = replaced = 0
+    conflicts = []
+    for idx, question in enumerate(data["questions"], 1):
+        if not isinstance(question, dict):
+            continue
+        number = question.get("number", idx)
+        key_answer = answers.get(number) if isinstance(number, int) else answers.get(idx)
+        expected = normalize_answer(key_answer)
+        if not expected:
+            if not normalize_answer(question.get("answer")):
+                conflicts.append(f"question {number}: empty answer and no answer in key")
+            continue
+        letters = option_letters(question.get("options"))
+        if letters and expected not in letters:
+            conflicts.append(f"question {number}: key answer {expected!r} is not among options {sorted(letters)}")
+            continue
+
+        current = normalize_answer(question.get("answer"))
+        if not current:
+            question["answer"] = key_answer
+            filled += 1
+        elif current != expected:
+            conflicts.append(f"question {number}: answer {question.get('answer')!r}, key {key_answer!r}")
+            if overwrite:
+                question["answer"] = key_answer
+                replaced += 1
+
+    if len(answers) != len(data["questions"]):
+        conflicts.append(f"key has {len(answers)} answers, test has {len(data['questions'])} questions")
+
+    if not (filled or replaced):
+        return "unchanged", 0, 0, conflicts
+
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, json_path)
+    logger.info(f"{json_path}: filled {filled}, replaced {replaced} answers from {key_path}")
+    return "updated", filled, replaced, conflicts
+
+
+def join_directory(json_dir, keys_dir, overwrite=True, report_file=None):
+    """
+    Проходит по всем JSON тестам json_dir и заполняет ответы по ключам
+    из keys_dir. В отчёт пишутся конфликты и тесты, которые после
+    заполнения всё ещё некорректны (их нужно отправлять в модель заново).
+    """
+    index = AnswerKeyIndex(keys_dir)
+    counts = {"no_key": 0, "key_conflict": 0, "updated": 0, "unchanged": 0, "failed": 0}
+    filled_total = replaced_total = 0
+    conflicts = {}
+    still_incorrect = []
+    fixed = 0
+
+    for root, _, files in os.walk(json_dir):
+        for name in sorted(files):
+            if not name.endswith(".json") or name.endswith(ANSWER_KEY_SUFFIX):
+                continue
+            json_path = os.path.join(root, name)
+            before = correctness(validate_file(json_path))
+            status, filled, replaced, file_conflicts = join_file(json_path, index, overwrite)
+            counts[status] += 1
+            filled_total += filled
+            replaced_total += replaced
+            if file_conflicts:
+                conflicts[json_path] = file_conflicts
+
+            after = correctness(validate_file(json_path)) if status == "updated" else before
+            if not after[0]:
+                still_incorrect.append((json_path, after[1]))
+            elif not before[0]:
+                fixed += 1
+
+    print("\nAnswer key join")
+    print("=" * 50)
+    print(f"Tests updated: {counts['updated']} (answers filled: {filled_total}, replaced: {replaced_total})")
+    print(f"Tests unchanged: {counts['unchanged']}, without answer key: {counts['no_key']}, "
+          f"ambiguous key: {counts['key_conflict']}, failed: {counts['failed']}")
+    print(f"Incorrect tests fixed without API: {fixed}")
+    print(f"Tests still needing regeneration: {len(still_incorrect)}")
+    print(f"Tests with conflicts: {len(conflicts)}")
+
+    if report_file is None:
+        report_file = f'answer_join_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.txt'
+    with open(report_file, "w", encoding="utf-8") as f:
+        f.write("Answer Key Join Report\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"Tests updated: {counts['updated']}\n")
+        f.write(f"Answers filled: {filled_total}\n")
+        f.write(f"Answers replaced: {replaced_total}\n")
+        f.write(f"Incorrect tests fixed without API: {fixed}\n\n")
+        f.write("Conflicts:\n")
+        for json_path, items in sorted(conflicts.items()):
+            f.write(f"{json_path}\n")
+            for item in items:
+                f.write(f"  - {item}\n")
+        f.write("\nStill needing regeneration:\n")
+        for json_path, reason in still_incorrect:
+            f.write(f"{json_path}\t{reason}\n")
+    print(f"\nReport saved to {report_file}")
+    return counts, conflicts, still_incorrect
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Заполнение ответов в JSON тестах по таблицам ответов")
+    parser.add_argument("json_dir", nargs="?", default="/mnt/ks/Works/3nd_tests/json_output")
+    parser.add_argument("keys_dir", nargs="?", default="/mnt/ks/Works/3nd_tests/tables")
+    parser.add_argument("--keep-existing", action="store_true",
+                        help="не заменять ответы, расходящиеся с ключом (только отчёт)")
+    parser.add_argument("--report", default=None, help="файл отчёта")
+    args = parser.parse_args()
+
+    join_directory(args.json_dir, args.keys_dir, overwrite=not args.keep_existing, report_file=args.report)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import time
+import argparse
+from pathlib import Path
+from docx import Document
+
+from docx_text import extract_text_from_docx
+
+
+def extract_text_python_docx(file_path):
+    """
+    Прежний способ извлечения текста через python-docx: сначала все
+    параграфы, затем все ячейки таблиц. Оставлен только для сравнения.
+    """
+    doc = Document(file_path)
+    full_text = []
+
+    for paragraph in doc.paragraphs:
+        if paragraph.text.strip():
+            full_text.append(paragraph.text)
+
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for paragraph in cell.paragraphs:
+                    if paragraph.text.strip():
+                        full_text.append(paragraph.text)
+
+    return "\n".join(full_text)
+
+
+def time_extractor(extractor, files, repeat):
+    """Возвращает лучшее из repeat прогонов время обработки всех файлов и результаты"""
+    best = None
+    texts = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for file_path in files:
+            try:
+                texts[file_path] = extractor(file_path)
+            except Exception as e:
+                print(f"Ошибка при обработке файла {file_path}: {e}")
+                texts[file_path] = None
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, texts
+
+
+def run_benchmark(corpus_dir, limit=None, repeat=3):
+    """
+    Сравнивает потоковый извлекатель текста с python-docx на файлах DOCX
+    из corpus_dir и печатает время, ускорение и совпадение результатов.
+
+    Тексты считаются совпадающими, если совпадают множества непустых
+    строк: порядок у потокового извлекателя отличается намеренно.
+    """
+    files = sorted(Path(corpus_dir).rglob("*.docx"))
+    files = [f for f in files if not f.name.startswith(".~lock")]
+    if limit:
+        files = files[:limit]
+    if not files:
+        print(f"В {corpus_dir} не найдено файлов DOCX")
+        return
+
+    total_bytes = sum(f.stat().st_size for f in files)
+    print(f"Файлов: {len(files)}, объём: {total_bytes / 1024 / 1024:.2f} MB, прогонов: {repeat}")
+
+    old_time, old_texts = time_extractor(extract_text_python_docx, files, repeat)
+    new_time, new_texts = time_extractor(extract_text_from_docx, files, repeat)
+
+    same_lines = sum(
+        1 for f in files
+        if old_texts[f] is not None and new_texts[f] is not None
+        and set(old_texts[f].splitlines()) == set(new_texts[f].splitlines())
+    )
+
+    print("=" * 50)
+    print(f"python-docx:  {old_time:.3f} s ({old_time / len(files) * 1000:.2f} ms/файл)")
+    print(f"iterparse:    {new_time:.3f} s ({new_time / len(files) * 1000:.2f} ms/файл)")
+    if new_time > 0:
+        print(f"Ускорение:    x{old_time / new_time:.1f}")
+    print(f"Совпадает набор строк: {same_lines} из {len(files)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение скорости извлечения текста из DOCX")
+    parser.add_argument("corpus_dir", nargs="?", default="/mnt/ks/Works/3nd_tests/errors_folder")
+    parser.add_argument("--limit", type=int, default=None, help="максимальное число файлов")
+    parser.add_argument("--repeat", type=int, default=3, help="число прогонов, берётся лучший")
+    args = parser.parse_args()
+
+    run_benchmark(args.corpus_dir, limit=args.limit, repeat=args.repeat)
@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 
 import os
+import time
 import shutil
+import threading
 import json
+import argparse
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 8
+# Допуск при сравнении mtime: у сетевых и FAT-разделов время хранится грубее
+MTIME_TOLERANCE = 1.0
+COPY_CHUNK = 64 * 1024 * 1024
 
 def load_json(json_file):
     """
@@ -18,16 +27,186 @@ def load_json(json_file):
         print(f"Ошибка загрузки JSON: {e}")
         return None
 
-def copy_directories_from_json(json_file, source_base, target_base):
+def is_up_to_date(src_stat, dst_path):
+    """Файл назначения совпадает с исходным по размеру и mtime"""
+    try:
+        dst_stat = os.stat(dst_path)
+    except FileNotFoundError:
+        return False
+    return (dst_stat.st_size == src_stat.st_size
+            and abs(dst_stat.st_mtime - src_stat.st_mtime) <= MTIME_TOLERANCE)
+
+
+def _copy_data(src, dst):
+    """
+    Копирует содержимое через os.copy_file_range: ядро копирует без
+    передачи данных в пользовательское пространство, а на btrfs/XFS в
+    пределах одного раздела делает reflink. Иначе - shutil.copyfile.
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_CHUNK):
+                    pass
+            return
+        except OSError:
+            pass  # например, разные типы ФС на старом ядре
+    shutil.copyfile(src, dst)
+
+
+def replicate_file(src, dst, hardlink=False):
+    """
+    Копирует src в dst, если dst отсутствует или отличается по размеру/mtime.
+
+    hardlink=True - на том же разделе создаётся жёсткая ссылка вместо
+    копии (изменение копии изменит и исходный файл).
+
+    Returns:
+        tuple: (действие "copied"/"linked"/"skipped", размер в байтах)
+    """
+    src_stat = os.stat(src)
+    if is_up_to_date(src_stat, dst):
+        return "skipped", src_stat.st_size
+
+    if hardlink and os.stat(os.path.dirname(dst)).st_dev == src_stat.st_dev:
+        if os.path.lexists(dst):
+            os.remove(dst)
+        os.link(src, dst)
+        return "linked", src_stat.st_size
+
+    # Копия пишется во временный файл и заменяет dst целиком: dst может
+    # быть жёсткой ссылкой (--hardlink, группы ссылок), и запись в него
+    # на месте испортила бы файл, с которым он делит inode
+    tmp_path = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        _copy_data(src, tmp_path)
+        shutil.copystat(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return "copied", src_stat.st_size
+
+
+def list_tree(src_dir, target_dir):
+    """Создаёт структуру директорий в target_dir и возвращает пары (исходный файл, файл назначения)"""
+    pairs = []
+    for root, _, files in os.walk(src_dir):
+        dst_root = os.path.join(target_dir, os.path.relpath(root, src_dir))
+        os.makedirs(dst_root, exist_ok=True)
+        for name in files:
+            pairs.append((os.path.join(root, name), os.path.join(dst_root, name)))
+    return pairs
+
+
+def split_link_groups(pairs):
+    """
+    Делит пары на основные и повторные: файлы-жёсткие ссылки на один
+    inode (например, изображения из хранилища extract.py) копируются
+    один раз, а остальные файлы группы становятся ссылками на копию.
+
+    Returns:
+        tuple: ([(src, dst)], [(src, dst, dst основной пары)])
+    """
+    primaries = []
+    followers = []
+    seen = {}
+    for src, dst in pairs:
+        try:
+            stat = os.stat(src)
+        except OSError:
+            primaries.append((src, dst))
+            continue
+        if stat.st_nlink < 2:
+            primaries.append((src, dst))
+            continue
+        inode = (stat.st_dev, stat.st_ino)
+        if inode in seen:
+            followers.append((src, dst, seen[inode]))
+        else:
+            seen[inode] = dst
+            primaries.append((src, dst))
+    return primaries, followers
+
+def replicate_link(src, dst, primary_dst):
+    """Повторный файл группы: жёсткая ссылка на уже скопированный primary_dst"""
+    src_stat = os.stat(src)
+    if is_up_to_date(src_stat, dst):
+        return "skipped", src_stat.st_size
+    try:
+        if os.path.lexists(dst):
+            os.remove(dst)
+        os.link(primary_dst, dst)
+        return "linked", src_stat.st_size
+    except OSError:
+        return replicate_file(src, dst)
+
+def replicate_files(pairs, workers=DEFAULT_WORKERS, hardlink=False):
+    """
+    Копирует пары файлов в пуле потоков и печатает отчёт.
+    Группы жёстких ссылок в источнике сохраняются (split_link_groups).
+
+    Returns:
+        dict: число файлов и байт по действиям, ошибки
+    """
+    report = {"copied": 0, "linked": 0, "skipped": 0, "errors": 0,
+              "bytes_copied": 0, "bytes_linked": 0, "bytes_skipped": 0}
+    started = time.perf_counter()
+
+    def task(pair):
+        try:
+            return pair, replicate_file(pair[0], pair[1], hardlink), None
+        except Exception as e:
+            return pair, None, e
+
+    def link_task(item):
+        src, dst, primary_dst = item
+        try:
+            return (src, dst), replicate_link(src, dst, primary_dst), None
+        except Exception as e:
+            return (src, dst), None, e
+
+    primaries, followers = split_link_groups(pairs)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Ссылки создаются после того, как скопированы основные файлы групп
+        outcomes = list(executor.map(task, primaries))
+        outcomes.extend(executor.map(link_task, followers))
+
+    for (src, dst), outcome, error in outcomes:
+        if error is not None:
+            report["errors"] += 1
+            print(f"Ошибка при копировании {src} в {dst}: {error}")
+            continue
+        action, size = outcome
+        report[action] += 1
+        report[f"bytes_{action}"] += size
+
+    elapsed = time.perf_counter() - started
+    mb = 1024 * 1024
+    print(
+        f"Скопировано файлов: {report['copied']} ({report['bytes_copied'] / mb:.1f} МБ), "
+        f"жёстких ссылок: {report['linked']} ({report['bytes_linked'] / mb:.1f} МБ), "
+        f"пропущено без изменений: {report['skipped']} ({report['bytes_skipped'] / mb:.1f} МБ), "
+        f"ошибок: {report['errors']}, время: {elapsed:.1f} с"
+    )
+    return report
+
+def copy_directories_from_json(json_file, source_base, target_base, workers=DEFAULT_WORKERS, hardlink=False):
     """
     Из JSON-файла выбирает пути к файлам и копирует всю директорию, в которой они находятся,
     в новую целевую директорию, сохраняя относительный путь.
     
+    Копирование инкрементальное: файлы, совпадающие по размеру и mtime,
+    пропускаются, остальные копируются параллельно (replicate_files).
+    
     Аргументы:
       json_file    - путь к JSON-файлу, содержащему список сообщений вида:
                      "Skipped empty JSON file: /mnt/ks/Works/3nd_tests/ready(last)/.../S-10-026/..."
       source_base  - базовая директория исходных данных, например, "/mnt/ks/Works/3nd_tests/ready(last)"
       target_base  - базовая директория для копирования, например, "/mnt/ks/Works/3nd_tests/copied_dirs"
+      workers      - число потоков копирования
+      hardlink     - создавать жёсткие ссылки вместо копий на том же разделе
     """
     data = load_json(json_file)
     if data is None:
@@ -51,7 +230,8 @@ def copy_directories_from_json(json_file, source_base, target_base):
         parent_dir = os.path.dirname(file_path)
         dirs_to_copy.add(parent_dir)
 
-    # Копирование найденных директорий
+    # Сбор файлов из найденных директорий
+    pairs = []
     for src_dir in dirs_to_copy:
         try:
             # Вычисляем относительный путь от source_base
@@ -64,14 +244,19 @@ def copy_directories_from_json(json_file, source_base, target_base):
         print(f"Копирование директории:\n  Источник: {src_dir}\n  Назначение: {target_dir}")
         
         try:
-            # Создаём промежуточные директории, если необходимо
-            os.makedirs(os.path.dirname(target_dir), exist_ok=True)
-            # Копируем всю директорию (с версии Python 3.8 можно использовать dirs_exist_ok=True)
-            shutil.copytree(src_dir, target_dir, dirs_exist_ok=True)
+            pairs.extend(list_tree(src_dir, target_dir))
         except Exception as e:
             print(f"Ошибка при копировании {src_dir} в {target_dir}: {e}")
 
+    return replicate_files(pairs, workers=workers, hardlink=hardlink)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Инкрементальное копирование директорий с ошибками")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="число потоков копирования")
+    parser.add_argument("--hardlink", action="store_true",
+                        help="жёсткие ссылки вместо копий на том же разделе")
+    args = parser.parse_args()
+
     # Задайте пути:
     # JSON-файл с данными (обязательно должен быть корректный JSON-объект, например:
     # { "errors": [ "Skipped empty JSON file: /mnt/ks/Works/3nd_tests/ready(last)/Геометрия 10 класс/Кырг версия/S-10-026/S-10-026-T-kg.json", ... ] }
@@ -83,6 +268,6 @@ if __name__ == "__main__":
     target_base = "/mnt/ks/Works/3nd_tests/errors_folder"
     os.makedirs(target_base, exist_ok=True)
     
-    copy_directories_from_json(json_file, source_base, target_base)
+    copy_directories_from_json(json_file, source_base, target_base, workers=args.workers, hardlink=args.hardlink)
     print("Обработка завершена")
 
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+import os
+import time
+import sqlite3
+import zipfile
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+
+from docx_text import W_NS, W_BODY, W_P, W_T, W_TBL, MC_FALLBACK
+
+M_NS = "http://schemas.openxmlformats.org/officeDocument/2006/math"
+WP_NS = "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+
+M_OMATH = f"{{{M_NS}}}oMath"
+W_DRAWING = f"{{{W_NS}}}drawing"
+WP_INLINE = f"{{{WP_NS}}}inline"
+
+DEFAULT_INDEX_PATH = "docx_probe.sqlite"
+# Меняется при изменении набора признаков - старые записи пересчитываются
+PROBE_VERSION = 1
+
+FEATURES = ("tables", "math", "drawings", "inline_shapes", "paragraphs", "characters")
+
+
+def probe_docx(file_path):
+    """
+    Потоково читает word/document.xml и считает признаки документа без
+    построения полного дерева python-docx.
+
+    Формула (m:oMath) внутри другой формулы не считается отдельно, как и
+    содержимое mc:Fallback, дублирующее основной вариант разметки.
+
+    Returns:
+        dict: tables, math, drawings, inline_shapes, paragraphs, characters
+    """
+    counts = dict.fromkeys(FEATURES, 0)
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open("word/document.xml") as xml_file:
+            stack = []
+            skip_depth = 0
+            math_depth = 0
+            for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+                tag = elem.tag
+                if event == "start":
+                    stack.append(elem)
+                    if tag == MC_FALLBACK or skip_depth:
+                        skip_depth += 1
+                    elif tag == M_OMATH:
+                        if not math_depth:
+                            counts["math"] += 1
+                        math_depth += 1
+                    elif tag == W_TBL:
+                        counts["tables"] += 1
+                    elif tag == W_DRAWING:
+                        counts["drawings"] += 1
+                    elif tag == WP_INLINE:
+                        counts["inline_shapes"] += 1
+                    elif tag == W_P:
+                        counts["paragraphs"] += 1
+                    continue
+
+                stack.pop()
+                if skip_depth:
+                    skip_depth -= 1
+                elif tag == M_OMATH:
+                    math_depth -= 1
+                elif tag == W_T and elem.text:
+                    counts["characters"] += len(elem.text)
+
+                # Обработанные дочерние элементы body отцепляются, чтобы
+                # расход памяти не зависел от размера документа
+                if stack and stack[-1].tag == W_BODY:
+                    stack[-1].remove(elem)
+    return counts
+
+
+class DocxProbeIndex:
+    """
+    Индекс признаков DOCX рядом с корпусом (SQLite), ключ - путь файла.
+
+    Запись действительна, пока у файла те же размер и mtime, поэтому
+    повторные решения сортировки и извлечения по корпусу сводятся к
+    stat() и чтению из базы. Ошибка разбора тоже запоминается.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # timeout: воркеры extract.py пишут в индекс одновременно
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime REAL NOT NULL,"
+            " version INTEGER NOT NULL,"
+            " tables INTEGER,"
+            " math INTEGER,"
+            " drawings INTEGER,"
+            " inline_shapes INTEGER,"
+            " paragraphs INTEGER,"
+            " characters INTEGER,"
+            " error TEXT,"
+            " probed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        """Создаёт индекс по переменной окружения DOCX_PROBE_INDEX_PATH"""
+        return cls(os.environ.get("DOCX_PROBE_INDEX_PATH", DEFAULT_INDEX_PATH))
+
+    def get(self, file_path):
+        """
+        Признаки документа из индекса или новым разбором.
+
+        Returns:
+            dict: признаки FEATURES и error (None или текст ошибки)
+        """
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT size, mtime, version, {', '.join(FEATURES)}, error FROM probes WHERE path = ?",
+                (file_path,),
+            ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime and row[2] == PROBE_VERSION:
+            features = dict(zip(FEATURES, row[3:3 + len(FEATURES)]))
+            features["error"] = row[-1]
+            return features
+
+        try:
+            features = probe_docx(file_path)
+            features["error"] = None
+        except Exception as e:
+            features = dict.fromkeys(FEATURES, 0)
+            features["error"] = str(e)
+
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO probes(path, size, mtime, version, {', '.join(FEATURES)}, error, probed_at) "
+                f"VALUES ({', '.join('?' * (len(FEATURES) + 6))})",
+                (file_path, stat.st_size, stat.st_mtime, PROBE_VERSION,
+                 *(features[name] for name in FEATURES), features["error"], time.time()),
+            )
+            self._conn.commit()
+        return features
+
+    def close(self):
+        self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Признаки DOCX файлов из индекса (таблицы, формулы, рисунки)")
+    parser.add_argument("source_dir")
+    parser.add_argument("--index", default=os.environ.get("DOCX_PROBE_INDEX_PATH", DEFAULT_INDEX_PATH))
+    args = parser.parse_args()
+
+    index = DocxProbeIndex(args.index)
+    for root, _, files in os.walk(args.source_dir):
+        for file in sorted(files):
+            if file.endswith(".docx"):
+                features = index.get(os.path.join(root, file))
+                summary = " ".join(f"{name}={features[name]}" for name in FEATURES)
+                error = f" error={features['error']}" if features["error"] else ""
+                print(f"{os.path.join(root, file)}\t{summary}{error}")
+    index.close()
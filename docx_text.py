@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+import zipfile
+import xml.etree.ElementTree as ET
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+MC_NS = "http://schemas.openxmlformats.org/markup-compatibility/2006"
+
+W_BODY = f"{{{W_NS}}}body"
+W_P = f"{{{W_NS}}}p"
+W_T = f"{{{W_NS}}}t"
+W_TBL = f"{{{W_NS}}}tbl"
+W_TAB = f"{{{W_NS}}}tab"
+W_BR = f"{{{W_NS}}}br"
+W_CR = f"{{{W_NS}}}cr"
+W_TR = f"{{{W_NS}}}tr"
+W_TC = f"{{{W_NS}}}tc"
+W_TRPR = f"{{{W_NS}}}trPr"
+W_TCPR = f"{{{W_NS}}}tcPr"
+W_GRID_BEFORE = f"{{{W_NS}}}gridBefore"
+W_GRID_SPAN = f"{{{W_NS}}}gridSpan"
+W_VMERGE = f"{{{W_NS}}}vMerge"
+W_VAL = f"{{{W_NS}}}val"
+MC_FALLBACK = f"{{{MC_NS}}}Fallback"
+
+
+def iter_docx_paragraphs(file_path):
+    """
+    Потоково читает word/document.xml прямо из архива DOCX и возвращает
+    текст параграфов в порядке их следования в документе.
+
+    Параграфы внутри ячеек таблиц выдаются там, где стоит таблица, а не
+    после всего текста. Каждая ячейка читается один раз, поэтому
+    объединённые (gridSpan/vMerge) ячейки не дублируются. Обработанные
+    элементы сразу очищаются, так что расход памяти не зависит от
+    размера документа.
+
+    Args:
+        file_path (str или Path): Путь к файлу DOCX.
+
+    Yields:
+        str: Текст очередного параграфа (может быть пустым).
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open("word/document.xml") as xml_file:
+            stack = []           # открытые элементы от корня до текущего
+            paragraphs = []      # части текста открытых параграфов (вложенные - надписи)
+            skip_depth = 0       # >0 внутри mc:Fallback, где текст дублируется
+
+            for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+                tag = elem.tag
+                if event == "start":
+                    stack.append(elem)
+                    if tag == MC_FALLBACK or skip_depth:
+                        skip_depth += 1
+                    elif tag == W_P:
+                        paragraphs.append([])
+                    continue
+
+                stack.pop()
+                if skip_depth:
+                    skip_depth -= 1
+                    if skip_depth == 0:
+                        elem.clear()
+                    continue
+
+                if tag == W_T:
+                    if paragraphs and elem.text:
+                        paragraphs[-1].append(elem.text)
+                elif tag == W_TAB:
+                    if paragraphs:
+                        paragraphs[-1].append("\t")
+                elif tag in (W_BR, W_CR):
+                    if paragraphs:
+                        paragraphs[-1].append("\n")
+                elif tag == W_P:
+                    yield "".join(paragraphs.pop())
+                    elem.clear()
+                elif tag == W_TBL:
+                    elem.clear()
+
+                # Дочерние элементы body больше не нужны - отцепляем их
+                if stack and stack[-1].tag == W_BODY:
+                    stack[-1].remove(elem)
+
+
+def extract_text_from_docx(file_path):
+    """
+    Извлекает текст из документа Word (параграфы и ячейки таблиц) в порядке
+    следования в документе, пропуская пустые строки.
+
+    Args:
+        file_path (str или Path): Путь к файлу DOCX.
+
+    Returns:
+        str: Извлечённый текст.
+    """
+    return "\n".join(text for text in iter_docx_paragraphs(file_path) if text.strip())
+
+
+def _iter_cell_text(elem):
+    """Текстовые части элемента без mc:Fallback"""
+    for child in elem:
+        tag = child.tag
+        if tag == MC_FALLBACK:
+            continue
+        if tag == W_T:
+            if child.text:
+                yield child.text
+        elif tag == W_TAB:
+            yield "\t"
+        elif tag in (W_BR, W_CR):
+            yield "\n"
+        else:
+            yield from _iter_cell_text(child)
+
+
+def _cell_text(tc):
+    return "\n".join(
+        "".join(_iter_cell_text(p)) for p in tc.iter(W_P)
+    ).strip()
+
+
+def _int_val(parent, tag, default):
+    elem = parent.find(tag) if parent is not None else None
+    if elem is None:
+        return default
+    try:
+        return int(elem.get(W_VAL))
+    except (TypeError, ValueError):
+        return default
+
+
+def read_table_grid(tbl):
+    """
+    Читает элемент w:tbl по сетке столбцов.
+
+    Ячейка, объединённая по горизонтали (gridSpan), выдаётся один раз, а
+    не по разу на каждый столбец, как row.cells в python-docx.
+    Продолжение вертикального объединения (vMerge без "restart")
+    получает текст верхней ячейки. Пропущенные в начале строки столбцы
+    (gridBefore) учитываются в номерах столбцов.
+
+    Returns:
+        list: строки таблицы, каждая - список (номер столбца сетки, текст)
+    """
+    rows = []
+    merged_above = {}  # столбец сетки -> текст ячейки, начавшей vMerge
+    for tr in tbl.iterfind(W_TR):
+        row = []
+        col = _int_val(tr.find(W_TRPR), W_GRID_BEFORE, 0)
+        for tc in tr.iterfind(W_TC):
+            tc_pr = tc.find(W_TCPR)
+            span = max(1, _int_val(tc_pr, W_GRID_SPAN, 1))
+            vmerge = tc_pr.find(W_VMERGE) if tc_pr is not None else None
+            if vmerge is not None and vmerge.get(W_VAL) != "restart":
+                text = merged_above.get(col, "")
+            else:
+                text = _cell_text(tc)
+                if vmerge is not None:
+                    merged_above[col] = text
+                else:
+                    merged_above.pop(col, None)
+            row.append((col, text))
+            col += span
+        rows.append(row)
+    return rows
+
+
+def iter_docx_tables(file_path):
+    """
+    Потоково читает word/document.xml и выдаёт таблицы верхнего уровня
+    в порядке документа, каждую - как результат read_table_grid.
+    Вложенные таблицы входят в текст своей ячейки.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open("word/document.xml") as xml_file:
+            stack = []
+            for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+                if event == "start":
+                    stack.append(elem)
+                    continue
+
+                stack.pop()
+                if elem.tag == W_TBL and not any(parent.tag == W_TBL for parent in stack):
+                    yield read_table_grid(elem)
+                    elem.clear()
+
+                if stack and stack[-1].tag == W_BODY:
+                    stack[-1].remove(elem)
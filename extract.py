@@ -1,25 +1,126 @@
 import os
+import io
 import re
+import sys
+import time
 import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
 import xml.etree.ElementTree as ET
 from docx import Document
 from lxml import etree
 from urllib.parse import unquote
+from docx_probe import DocxProbeIndex
+from omml_latex import FormulaCache
+from image_store import ImageStore, sniff_extension, print_report
 
-def check_docx_content(source_path):
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+M_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/math'
+WP_NS = 'http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing'
+A_NS = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+R_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PIC_URI = 'http://schemas.openxmlformats.org/drawingml/2006/picture'
+
+W_P = f"{{{W_NS}}}p"
+WP_INLINE = f"{{{WP_NS}}}inline"
+MATH_TAGS = {f"{{{M_NS}}}oMath", f"{{{M_NS}}}oMathPara"}
+M_OMATH_PARA = f"{{{M_NS}}}oMathPara"
+
+# "xml" (default) - every formula goes to an XML file and is referenced by a
+# [Формула заменена: ...] marker, which analyze.py and json_validator.py
+# count; "latex" - formulas are inlined as $...$ (XML file only for formulas
+# the converter cannot handle), and those counts no longer see them
+FORMULA_MODES = ("xml", "latex")
+
+# Translations keyed by formula XML hash, one cache per worker process
+formula_cache = FormulaCache()
+
+# Content-addressed image blobs live next to the output, so per-document
+# image files can be hard links to them
+IMAGE_STORE_DIRNAME = ".image_store"
+
+def build_content_index(root):
+    # One pre-order traversal of the tree. Every inline shape and every
+    # outermost formula is recorded together with its enclosing paragraph,
+    # so replacements never have to search the document again
+    shapes = []
+    formulas = []
+    stack = [(root, None)]
+    while stack:
+        element, paragraph = stack.pop()
+        tag = element.tag
+        if tag == W_P:
+            paragraph = element
+        elif tag in MATH_TAGS:
+            formulas.append((element, paragraph))
+            continue
+        elif tag == WP_INLINE:
+            shapes.append((element, paragraph))
+            continue
+        stack.extend((child, paragraph) for child in reversed(element))
+    return shapes, formulas
+
+# DOCX probe index of the current process, opened on first use
+_probe_index = {}
+
+def get_probe_index():
+    # One DocxProbeIndex per process: a worker opens its own connection
+    # instead of using the parent's one inherited over fork
+    index = _probe_index.get(os.getpid())
+    if index is None:
+        _probe_index.clear()
+        index = _probe_index[os.getpid()] = DocxProbeIndex.from_env()
+    return index
+
+def probe_document(source_path):
+    # Feature flags from the shared probe index; on a re-run they are read
+    # from the index without opening the document. None if it cannot be read
     try:
-        doc = Document(source_path)
-        doc_xml = doc._element.xml
-        has_images = len(doc.inline_shapes) > 0
-        has_math = '<m:oMath' in doc_xml
-        return has_math, has_images
+        return get_probe_index().get(source_path)
+    except OSError as e:
+        print(f"Error probing {source_path}: {str(e)}")
+        return None
+
+def check_docx_content(source_path, probe_index=None):
+    # Flags come from the shared DOCX probe index (docx_probe), so the
+    # document is not parsed with python-docx just to answer this
+    try:
+        probe_index = probe_index or get_probe_index()
+        features = probe_index.get(source_path)
     except Exception as e:
         print(f"Error checking document content: {str(e)}")
         return False, False
+    if features["error"]:
+        print(f"Error checking document content: {features['error']}")
+        return False, False
+    return features["math"] > 0, features["inline_shapes"] > 0
+
+def make_text_run(text):
+    new_r = etree.Element(f"{{{W_NS}}}r")
+    new_t = etree.SubElement(new_r, f"{{{W_NS}}}t")
+    new_t.text = text
+    return new_r
 
-def replace_content_with_paths(source_path, dest_path):
+def formula_marker(math_formula, math_xml, formula_mode):
+    # Returns the inline LaTeX text for the formula or None when it has to
+    # be written to an XML file
+    if formula_mode != "latex":
+        return None
+    latex = formula_cache.convert(math_formula, math_xml)
+    if latex is None:
+        return None
+    return f"$${latex}$$" if math_formula.tag == M_OMATH_PARA else f"${latex}$"
+
+def replace_content_with_paths(source_path, dest_path, doc=None, index=None, formula_mode="xml",
+                               image_store=None):
     try:
-        doc = Document(source_path)
+        if doc is None:
+            doc = Document(source_path)
+        if index is None:
+            index = build_content_index(doc.element.body)
+        shapes, formulas = index
+
         doc_name = os.path.splitext(os.path.basename(source_path))[0]
         base_dir = os.path.dirname(dest_path)
         extracted_base_dir = os.path.join(base_dir, f"extracted_files_{doc_name}")
@@ -27,66 +128,75 @@ def replace_content_with_paths(source_path, dest_path):
         math_dir = os.path.join(extracted_base_dir, "math_files")
         images_dir = os.path.join(extracted_base_dir, "images")
 
-        os.makedirs(math_dir, exist_ok=True)
-        os.makedirs(images_dir, exist_ok=True)
 
         modified = False
+        related_parts = doc.part.related_parts
 
-        ns = {
-            'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
-            'm': 'http://schemas.openxmlformats.org/officeDocument/2006/math'
-        }
-
-        # Process images
-        for i, shape in enumerate(doc.inline_shapes, 1):
+        # Process images: the drawing is swapped for a text marker inside
+        # its own run, the rest of the paragraph is kept as is
+        for i, (inline, paragraph) in enumerate(shapes, 1):
             try:
-                if shape.type == 3:  # Picture
-                    image_filename = f"{doc_name}_image_{i}.png"
-                    image_path = os.path.join(images_dir, image_filename)
+                graphic_data = inline.find(f"{{{A_NS}}}graphic/{{{A_NS}}}graphicData")
+                if graphic_data is None or graphic_data.get('uri') != PIC_URI:
+                    continue
+                blip = next(graphic_data.iter(f"{{{A_NS}}}blip"), None)
+                if blip is None:
+                    continue
 
-                    image_part = shape._inline.graphic.graphicData.pic.blipFill.blip
-                    image_rId = image_part.attrib['{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed']
-                    image_part = doc.part.related_parts[image_rId]
+                image_part = related_parts[blip.get(f"{{{R_NS}}}embed")]
+                blob = image_part.blob
+                extension = sniff_extension(blob, image_part.partname)
+                image_filename = f"{doc_name}_image_{i}{extension}"
+                image_path = os.path.join(images_dir, image_filename)
 
+                if image_store is not None:
+                    image_store.add(blob, image_path, extension)
+                else:
+                    os.makedirs(images_dir, exist_ok=True)
                     with open(image_path, 'wb') as f:
-                        f.write(image_part.blob)
+                        f.write(blob)
 
-                    for paragraph in doc.paragraphs:
-                        if shape._inline in paragraph._element.iter():
-                            paragraph.text = f"[Изображение заменено: {image_path}]"
+                marker = f"[Изображение заменено: {image_path}]"
+                drawing = inline.getparent()
+                run = drawing.getparent() if drawing is not None else None
+                if run is not None:
+                    new_t = etree.Element(f"{{{W_NS}}}t")
+                    new_t.text = marker
+                    run.replace(drawing, new_t)
+                elif paragraph is not None:
+                    paragraph.append(make_text_run(marker))
 
-                    print(f"Replaced image {i} with path: {image_path}")
-                    modified = True
+                print(f"Replaced image {i} with path: {image_path}")
+                modified = True
             except Exception as e:
                 print(f"Error processing image {i}: {str(e)}")
 
-        # Process math formulas
-        math_formulas = doc._element.xpath('.//*[local-name()="oMath" or local-name()="oMathPara"]')
-        for i, math_formula in enumerate(math_formulas, 1):
+        # Process math formulas: each outermost oMath/oMathPara is replaced
+        # in place by a run with its LaTeX or with the path to its XML file.
+        # Identical formulas share one XML file within the document
+        math_paths = {}
+        for i, (math_formula, paragraph) in enumerate(formulas, 1):
             try:
-                math_filename = f"{doc_name}_math_{i}.xml"
-                math_path = os.path.join(math_dir, math_filename)
-
-                with open(math_path, 'w', encoding='utf-8') as f:
-                    f.write(etree.tostring(math_formula, encoding='unicode', pretty_print=True))
+                math_xml = etree.tostring(math_formula)
+                marker = formula_marker(math_formula, math_xml, formula_mode)
+                if marker is None:
+                    key = FormulaCache.make_key(math_xml)
+                    math_path = math_paths.get(key)
+                    if math_path is None:
+                        math_path = os.path.join(math_dir, f"{doc_name}_math_{i}.xml")
+                        os.makedirs(math_dir, exist_ok=True)
+                        with open(math_path, 'w', encoding='utf-8') as f:
+                            f.write(etree.tostring(math_formula, encoding='unicode', pretty_print=True))
+                        math_paths[key] = math_path
+                    marker = f"[Формула заменена: {math_path}]"
+                    print(f"Replaced math formula {i} with path: {math_path}")
+                else:
+                    print(f"Replaced math formula {i} with LaTeX: {marker}")
 
                 parent = math_formula.getparent()
-                while parent is not None and etree.QName(parent).localname != 'p':
-                    parent = parent.getparent()
-
-                if parent is not None:
-                    try:
-                        parent.remove(math_formula)
-                    except Exception as inner_e:
-                        print(f"Warning: couldn't remove math formula node: {inner_e}")
-
-                    new_r = etree.Element(f"{{{ns['w']}}}r")
-                    new_t = etree.Element(f"{{{ns['w']}}}t")
-                    new_t.text = f"[Формула заменена: {math_path}]"
-                    new_r.append(new_t)
-                    parent.append(new_r)
-
-                print(f"Replaced math formula {i} with path: {math_path}")
+                if parent is not None and paragraph is not None:
+                    parent.replace(math_formula, make_text_run(marker))
+
                 modified = True
             except Exception as e:
                 print(f"Error processing math formula {i}: {str(e)}")
@@ -98,26 +208,61 @@ def replace_content_with_paths(source_path, dest_path):
             shutil.copy2(source_path, dest_path)
             print(f"No modifications needed, copied original file to: {dest_path}")
 
+        return modified
+
     except Exception as e:
         raise Exception(f"Error processing document: {str(e)}")
 
-def process_docx(source_path, destination_path):
-    has_math, has_images = check_docx_content(source_path)
+def copy_unchanged(source_path, destination_path):
+    print(f"No math formulas or images found in {source_path}")
+    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    shutil.copy2(source_path, destination_path)
+    print(f"Copied file to {destination_path}")
+    return False
+
+def process_docx(source_path, destination_path, features=None, formula_mode="xml", image_store_dir=None):
+    # features - probe result from docx_probe; a document it reports as
+    # having no formulas or images is copied without parsing it at all
+    if features is not None and not features["error"] and not (features["math"] or features["inline_shapes"]):
+        return copy_unchanged(source_path, destination_path)
+
+    # The document is parsed and indexed once; the same tree is used both
+    # for the content check and for the rewrite
+    doc = Document(source_path)
+    index = build_content_index(doc.element.body)
+    shapes, formulas = index
+    has_math, has_images = bool(formulas), bool(shapes)
 
     if not (has_math or has_images):
-        print(f"No math formulas or images found in {source_path}")
-        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-        shutil.copy2(source_path, destination_path)
-        print(f"Copied file to {destination_path}")
-        return
+        return copy_unchanged(source_path, destination_path)
 
     print(f"Found content to process in {source_path}:")
     if has_math: print("- Math formulas")
     if has_images: print("- Images")
 
-    replace_content_with_paths(source_path, destination_path)
+    image_store = ImageStore(image_store_dir) if image_store_dir else None
+    return replace_content_with_paths(source_path, destination_path, doc=doc, index=index,
+                                      formula_mode=formula_mode, image_store=image_store)
+
+def process_file_task(source_path, destination_path, formula_mode="xml", image_store_dir=None):
+    # Runs in a worker process: stdout is buffered so that the output of
+    # one file is printed as a single block instead of being interleaved.
+    # The document is probed here too, so probing runs in parallel
+    buffer = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(buffer):
+        try:
+            print(f"\nProcessing: {source_path}")
+            features = probe_document(source_path)
+            status = "processed" if process_docx(source_path, destination_path, features, formula_mode,
+                                                 image_store_dir) else "copied"
+        except Exception as e:
+            print(f"Error processing {source_path}: {str(e)}")
+            status = "failed"
+    return source_path, status, time.perf_counter() - start, buffer.getvalue()
 
-def process_directory(source_dir, destination_dir):
+def collect_docx_tasks(source_dir, destination_dir):
+    tasks = []
     for root, _, files in os.walk(source_dir):
         for file in files:
             if file.endswith('.docx'):
@@ -125,16 +270,74 @@ def process_directory(source_dir, destination_dir):
                 rel_path = os.path.relpath(root, source_dir)
                 dest_dir = os.path.join(destination_dir, rel_path)
                 os.makedirs(dest_dir, exist_ok=True)
-                destination_path = os.path.join(dest_dir, file)
-                
-                try:
-                    print(f"\nProcessing: {source_path}")
-                    process_docx(source_path, destination_path)
-                except Exception as e:
-                    print(f"Error processing {source_path}: {str(e)}")
-
-source_dir = "/mnt/ks/Works/3nd_tests/ToBeResized/Геометрия 10 класс/Русская версия/S-10-003"
-destination_dir = "/mnt/ks/Works/3nd_tests/new"
-
-process_directory(source_dir, destination_dir)
-print("\nBatch processing completed")
\ No newline at end of file
+                tasks.append((source_path, os.path.join(dest_dir, file)))
+    return tasks
+
+def print_summary(results, wall_time, workers):
+    counts = {"processed": 0, "copied": 0, "failed": 0}
+    for _, status, _, _ in results:
+        counts[status] += 1
+    cpu_time = sum(elapsed for _, _, elapsed, _ in results)
+
+    print("\n" + "=" * 50)
+    print(f"Files total: {len(results)} (workers: {workers})")
+    print(f"Processed (formulas/images replaced): {counts['processed']}")
+    print(f"Copied unchanged: {counts['copied']}")
+    print(f"Failed: {counts['failed']}")
+    print(f"Wall time: {wall_time:.2f} s, summed per-file time: {cpu_time:.2f} s")
+    if results:
+        print(f"Average per file: {cpu_time / len(results):.3f} s")
+        print("Slowest files:")
+        for source_path, status, elapsed, _ in sorted(results, key=lambda r: r[2], reverse=True)[:5]:
+            print(f"  {elapsed:.2f} s [{status}] {source_path}")
+    failed = [r[0] for r in results if r[1] == "failed"]
+    if failed:
+        print("Failed files:")
+        for source_path in failed:
+            print(f"  {source_path}")
+    return counts
+
+def process_directory(source_dir, destination_dir, workers=1, formula_mode="xml", dedupe_images=True):
+    tasks = collect_docx_tasks(source_dir, destination_dir)
+    image_store_dir = os.path.join(destination_dir, IMAGE_STORE_DIRNAME) if dedupe_images else None
+    results = []
+    start = time.perf_counter()
+
+    if workers <= 1:
+        for source_path, destination_path in tasks:
+            result = process_file_task(source_path, destination_path, formula_mode, image_store_dir)
+            print(result[3], end="")
+            results.append(result)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_file_task, src, dst, formula_mode, image_store_dir)
+                       for src, dst in tasks]
+            for future in as_completed(futures):
+                result = future.result()
+                print(result[3], end="")
+                sys.stdout.flush()
+                results.append(result)
+
+    counts = print_summary(results, time.perf_counter() - start, workers)
+    if image_store_dir and os.path.isdir(image_store_dir):
+        print_report(ImageStore(image_store_dir).report())
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replace math formulas and images in .docx files with paths")
+    parser.add_argument("source_dir", nargs="?",
+                        default="/mnt/ks/Works/3nd_tests/ToBeResized/Геометрия 10 класс/Русская версия/S-10-003")
+    parser.add_argument("destination_dir", nargs="?", default="/mnt/ks/Works/3nd_tests/new")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes (default: 1, serial)")
+    parser.add_argument("--formula-mode", choices=FORMULA_MODES, default="xml",
+                        help="xml: write each formula to an XML file (default); latex: inline formulas as "
+                             "LaTeX (not counted as formulas by analyze.py and json_validator.py)")
+    parser.add_argument("--no-image-store", action="store_true",
+                        help="write every image as a separate file instead of hard links into "
+                             f"{IMAGE_STORE_DIRNAME}")
+    args = parser.parse_args()
+
+    process_directory(args.source_dir, args.destination_dir, workers=args.workers,
+                      formula_mode=args.formula_mode, dedupe_images=not args.no_image_store)
+    print("\nBatch processing completed")
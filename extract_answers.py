@@ -1,114 +1,156 @@
 import os
-from docx import Document
-from shutil import copy2
-
-def convert_tables_to_text(file_path):
-    print(f"Начинаем обработку файла: {file_path}")
-    doc = Document(file_path)
-    new_doc = Document()
-    
-    for paragraph in doc.paragraphs:
-        if paragraph.text.strip():
-            new_doc.add_paragraph(paragraph.text)
-    
-    table_count = len(doc.tables)
-    print(f"Найдено таблиц в документе: {table_count}")
-    
-    for i, table in enumerate(doc.tables, 1):
-        print(f"Обработка таблицы {i} из {table_count}")
-        variants = {}
-        
-        for row in table.rows:
-            cells = [cell.text.strip().lower() for cell in row.cells]
-            if not cells or not any(cells):
+import re
+import io
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from docx_text import iter_docx_tables
+
+ANSWER_KEY_SUFFIX = ".answers.json"
+# Версия формата ключа: 2 - ответы записываются как в таблице, без
+# приведения к нижнему регистру; ключи прежней версии пересоздаются
+KEY_VERSION = 2
+# Резервные копии, оставшиеся от прежней версии скрипта, и временные файлы Word
+SKIP_FILE_RE = re.compile(r"( \(Old\)\.docx$|^~\$)")
+# "1-вар.", "Вар. 2", "Вариант III" -> номер варианта
+VARIANT_RE = re.compile(r"^\s*(?:вар(?:иант)?\.?\s*)?(\d+|[IVXLivxl]+)\s*[-–]?\s*(?:вар(?:иант)?\.?)?\s*$", re.IGNORECASE)
+
+def answer_key_path(file_path):
+    return os.path.splitext(file_path)[0] + ANSWER_KEY_SUFFIX
+
+def parse_variant(text):
+    match = VARIANT_RE.match(text)
+    return match.group(1).upper() if match else None
+
+def read_answer_key(file_path):
+    """
+    Читает таблицы ответов документа и возвращает ключ ответов.
+
+    Первый столбец строки - вариант, остальные - ответы по порядку
+    вопросов. Строка, где вместо варианта нет номера, а ответы - номера
+    вопросов подряд, считается заголовком и задаёт номера вопросов.
+    Если вариант встречается в нескольких строках или таблицах (таблица
+    продолжается), его ответы дописываются.
+
+    Returns:
+        dict: version, source, questions (номера из заголовка или None),
+        variants (вариант -> список ответов по порядку)
+    """
+    variants = {}
+    questions = None
+    tables = 0
+    for rows in iter_docx_tables(file_path):
+        tables += 1
+        for row in rows:
+            cells = [text for _, text in row]
+            if len(cells) < 2 or not any(cells):
                 continue
-            
-            variant = cells[0].replace('вар.', '').strip()
+            variant = parse_variant(cells[0])
             answers = cells[1:]
-            
-            if variant and answers:
-                variants[variant] = answers
-        
-        new_doc.add_paragraph()
-        
-        for var_num, answers in sorted(variants.items()):
-            var_paragraph = new_doc.add_paragraph(f"{var_num}-вар.")
-            formatted_answers = [f"{i+1}){ans};" for i, ans in enumerate(answers) if ans]
-            answers_text = " ".join(formatted_answers)
-            new_doc.add_paragraph(answers_text)
-            new_doc.add_paragraph()
-    
-    return new_doc
-
-def process_file(file_path):
+            if variant is None:
+                if all(cell.isdigit() for cell in answers if cell):
+                    numbers = [int(cell) for cell in answers if cell]
+                    if numbers and numbers == list(range(numbers[0], numbers[0] + len(numbers))):
+                        questions = (questions or []) + numbers
+                continue
+            variants.setdefault(variant, []).extend(answers)
+
+    return {
+        "version": KEY_VERSION,
+        "source": os.path.basename(file_path),
+        "tables": tables,
+        "questions": questions,
+        "variants": variants,
+    }
+
+def is_up_to_date(file_path):
+    key_path = answer_key_path(file_path)
+    if not os.path.exists(key_path) or os.path.getmtime(key_path) < os.path.getmtime(file_path):
+        return False
+    try:
+        with open(key_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("version") == KEY_VERSION
+    except (OSError, ValueError):
+        return False
+
+def process_file(file_path, force=False):
+    """
+    Пишет ключ ответов рядом с документом (<имя>.answers.json).
+    Документ не изменяется; готовый ключ новее документа не пересоздаётся.
+
+    Returns:
+        str: "written", "unchanged" или "failed"
+    """
     try:
         print(f"\nОбработка файла: {file_path}")
-        
-        # Проверяем размер файла
-        file_size = os.path.getsize(file_path)
-        print(f"Размер файла: {file_size} байт")
-        
-        # Создаем имя для старого файла
-        file_dir = os.path.dirname(file_path)
-        file_name = os.path.basename(file_path)
-        file_base = os.path.splitext(file_name)[0]
-        old_file_path = os.path.join(file_dir, f"{file_base} (Old).docx")
-        
-        # Копируем оригинальный файл
-        print(f"Создаем резервную копию: {os.path.basename(old_file_path)}")
-        copy2(file_path, old_file_path)
-        
-        # Конвертируем таблицы в текст
-        print("Конвертируем таблицы в текст...")
-        new_doc = convert_tables_to_text(file_path)
-        
-        # Сохраняем новый документ
-        print(f"Сохраняем изменения в: {file_name}")
-        new_doc.save(file_path)
-        
-        print(f"Успешно обработан файл: {file_name}")
-        return True
-        
+        if not force and is_up_to_date(file_path):
+            print("Ключ ответов актуален, пропускаем")
+            return "unchanged"
+
+        key = read_answer_key(file_path)
+        print(f"Найдено таблиц: {key['tables']}, вариантов: {len(key['variants'])}")
+
+        key_path = answer_key_path(file_path)
+        tmp_path = key_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(key, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, key_path)
+        print(f"Ключ ответов сохранён: {os.path.basename(key_path)}")
+        return "written"
+
     except Exception as e:
         print(f"Ошибка при обработке файла {file_path}: {str(e)}")
-        return False
+        return "failed"
 
-def process_directory_recursive(root_dir):
+def process_file_task(file_path, force=False):
+    # Вывод одного файла собирается целиком, чтобы не перемешивался между процессами
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        status = process_file(file_path, force)
+    return status, buffer.getvalue()
+
+def collect_docx_files(root_dir):
+    docx_files = []
+    for current_dir, _, files in os.walk(root_dir):
+        for file_name in sorted(files):
+            if file_name.endswith('.docx') and not SKIP_FILE_RE.search(file_name):
+                docx_files.append(os.path.join(current_dir, file_name))
+    return docx_files
+
+def process_directory_recursive(root_dir, workers=None, force=False):
     print(f"Начинаем обработку директории: {root_dir}")
-    processed_files = 0
-    failed_files = 0
-    
-    for current_dir, dirs, files in os.walk(root_dir):
-        print(f"\nПросматриваем папку: {current_dir}")
-        docx_files = [f for f in files if f.endswith('.docx')]
-        
-        if docx_files:
-            print(f"Найдено DOCX файлов в текущей папке: {len(docx_files)}")
-            for file_name in docx_files:
-                file_path = os.path.join(current_dir, file_name)
-                if process_file(file_path):
-                    processed_files += 1
-                else:
-                    failed_files += 1
-    
-    return processed_files, failed_files
+    docx_files = collect_docx_files(root_dir)
+    print(f"Найдено DOCX файлов: {len(docx_files)}")
+    counts = {"written": 0, "unchanged": 0, "failed": 0}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for status, output in executor.map(process_file_task, docx_files, [force] * len(docx_files),
+                                           chunksize=8):
+            print(output, end="")
+            counts[status] += 1
+
+    return counts
 
 if __name__ == "__main__":
-    folder_path = "/mnt/ks/Works/3nd_tests/tables/Геометрия 11 класс"
-    
+    parser = argparse.ArgumentParser(description="Извлечение ключей ответов из таблиц DOCX в JSON")
+    parser.add_argument("folder_path", nargs="?", default="/mnt/ks/Works/3nd_tests/tables/Геометрия 11 класс")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="пересоздать все ключи ответов")
+    args = parser.parse_args()
+    folder_path = args.folder_path
+
     if not folder_path:
         folder_path = os.getcwd()
         print(f"Используем текущую папку: {folder_path}")
-    
+
     if os.path.exists(folder_path):
-        processed, failed = process_directory_recursive(folder_path)
+        counts = process_directory_recursive(folder_path, workers=args.workers, force=args.force)
         print("\nОбработка завершена!")
-        print(f"Успешно обработано файлов: {processed}")
-        if failed > 0:
-            print(f"Не удалось обработать файлов: {failed}")
+        print(f"Записано ключей ответов: {counts['written']}")
+        print(f"Без изменений: {counts['unchanged']}")
+        if counts["failed"] > 0:
+            print(f"Не удалось обработать файлов: {counts['failed']}")
     else:
         print(f"Указанная папка не существует: {folder_path}")
-
-
-
-
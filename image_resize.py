@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+import io
+import os
+import re
+import time
+import sqlite3
+import zipfile
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+from image_store import ImageStore, sniff_extension
+
+DEFAULT_MAX_DIMENSION = 1600
+DEFAULT_JPEG_QUALITY = 85
+DEFAULT_CACHE_PATH = "image_resize_cache.sqlite"
+# Результат принимается, только если он заметно меньше исходника
+MIN_SAVING = 0.05
+
+RASTER_EXTENSIONS = {".png", ".jpeg", ".jpg", ".gif", ".bmp", ".tiff", ".tif"}
+FORMATS = {".png": "PNG", ".jpeg": "JPEG", ".jpg": "JPEG", ".gif": "GIF", ".bmp": "BMP",
+           ".tiff": "TIFF", ".tif": "TIFF"}
+EXTENSIONS = {"PNG": ".png", "JPEG": ".jpeg", "GIF": ".gif", "BMP": ".bmp", "TIFF": ".tiff"}
+CONTENT_TYPES = {".png": "image/png", ".jpeg": "image/jpeg", ".gif": "image/gif",
+                 ".bmp": "image/bmp", ".tiff": "image/tiff"}
+MEDIA_PREFIX = "word/media/"
+# Хранилище изображений extract.py (IMAGE_STORE_DIRNAME в корне результата)
+IMAGE_STORE_DIRNAME = ".image_store"
+# Хранилище extract.py и блобы кэша не обрабатываются как папки с изображениями
+SKIP_DIRS = {IMAGE_STORE_DIRNAME, ".image_resize_blobs"}
+# 16- и 32-битные целочисленные изображения (сканы, медицинские снимки)
+# сводятся к 8-битным оттенкам серого: JPEG и подсчёт цветов их не принимают
+WIDE_MODES = {"I", "I;16", "I;16B", "I;16L", "I;16N"}
+
+
+def settings_key(max_dimension, quality):
+    return f"{max_dimension}:{quality}"
+
+
+def choose_format(image, source_format, keep_format):
+    """
+    Формат результата: исходный при keep_format; иначе JPEG остаётся JPEG,
+    рисунки с прозрачностью или небольшим числом цветов (чертежи, схемы)
+    сохраняются в PNG, фотографии - в JPEG.
+    """
+    if keep_format:
+        return source_format
+    if source_format == "JPEG":
+        return "JPEG"
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        return "PNG"
+    if image.mode in ("1", "P") or image.getcolors(maxcolors=256) is not None:
+        return "PNG"
+    return "JPEG"
+
+
+def normalize_blob(blob, max_dimension=DEFAULT_MAX_DIMENSION, quality=DEFAULT_JPEG_QUALITY, keep_format=True):
+    """
+    Уменьшает изображение до max_dimension по большей стороне и пережимает.
+
+    Returns:
+        tuple: (новые байты, расширение) или None, если изображение не
+        растровое, анимированное или результат не меньше исходника
+    """
+    source_format = FORMATS.get(sniff_extension(blob))
+    if source_format is None:
+        return None  # EMF/WMF/SVG и неизвестные форматы не трогаем
+
+    with Image.open(io.BytesIO(blob)) as image:
+        if getattr(image, "is_animated", False):
+            return None
+        image.load()
+        if image.mode in WIDE_MODES:
+            image = image.convert("I").point(lambda value: value / 256).convert("L")
+        if max(image.size) > max_dimension:
+            image = image.copy()
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        target = choose_format(image, source_format, keep_format)
+
+        buffer = io.BytesIO()
+        if target == "JPEG":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+        elif target == "PNG":
+            image.save(buffer, "PNG", optimize=True)
+        else:
+            image.save(buffer, target)
+        result = buffer.getvalue()
+
+    if len(result) > len(blob) * (1 - MIN_SAVING):
+        return None
+    return result, EXTENSIONS[target]
+
+
+class ResizeCache:
+    """
+    Кэш нормализации по хэшу содержимого (SQLite): хэш исходника и
+    настройки -> хэш результата или "без изменений". Результаты лежат в
+    хранилище блобов, так что одинаковые изображения в разных документах
+    и повторные запуски не декодируются заново. Результат нормализации
+    тоже записывается как "без изменений".
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.store = ImageStore(os.path.join(directory, ".image_resize_blobs"))
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS resized ("
+            " input_hash TEXT NOT NULL,"
+            " settings TEXT NOT NULL,"
+            " output_hash TEXT,"
+            " extension TEXT,"
+            " input_size INTEGER,"
+            " output_size INTEGER,"
+            " PRIMARY KEY (input_hash, settings))"
+        )
+        self._conn.commit()
+
+    def get(self, input_hash, settings):
+        """(хэш результата или None, расширение) или None, если записи нет"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT output_hash, extension FROM resized WHERE input_hash = ? AND settings = ?",
+                (input_hash, settings),
+            ).fetchone()
+
+    def record(self, entries):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO resized VALUES (?, ?, ?, ?, ?, ?)", entries)
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class Normalizer:
+    """Нормализация с кэшем; новые записи кэша копятся в entries"""
+
+    def __init__(self, cache, max_dimension, quality):
+        self.cache = cache
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.entries = []
+
+    def normalize(self, blob, keep_format):
+        """
+        (байты, расширение) или None, если изображение остаётся как есть.
+        Изображение, которое не удалось декодировать, тоже остаётся как
+        есть и записывается в кэш, чтобы не декодироваться на каждом запуске.
+        """
+        settings = settings_key(self.max_dimension, self.quality) + (":keep" if keep_format else ":convert")
+        digest = hashlib.sha256(blob).hexdigest()
+        hit = self.cache.get(digest, settings)
+        if hit is not None:
+            output_hash, extension = hit
+            if output_hash is None:
+                return None
+            with open(self.cache.store.blob_path(output_hash, extension), "rb") as f:
+                return f.read(), extension
+
+        try:
+            result = normalize_blob(blob, self.max_dimension, self.quality, keep_format)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            print(f"Cannot normalize image {digest[:12]}: {e}")
+            result = None
+        if result is None:
+            self.entries.append((digest, settings, None, None, len(blob), len(blob)))
+            return None
+        data, extension = result
+        output_hash = hashlib.sha256(data).hexdigest()
+        self.cache.store.put(data, extension)
+        self.entries.append((digest, settings, output_hash, extension, len(blob), len(data)))
+        self.entries.append((output_hash, settings, None, None, len(data), len(data)))
+        return result
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def find_image_store(path):
+    """ImageStore extract.py, в котором лежит файл, или None"""
+    directory = os.path.dirname(os.path.abspath(path))
+    while True:
+        candidate = os.path.join(directory, IMAGE_STORE_DIRNAME)
+        if os.path.isdir(candidate):
+            return ImageStore(candidate)
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def process_image_file(path, normalizer):
+    """
+    Нормализует файл изображения на месте. Формат сохраняется: на файл
+    ссылаются по имени маркеры [Изображение заменено: ...].
+
+    Файлы из extract.py - жёсткие ссылки на блобы .image_store; результат
+    тоже записывается через хранилище, так что одинаковые изображения
+    остаются одним блобом, а блоб исходника, на который больше никто не
+    ссылается, удаляется.
+    """
+    with open(path, "rb") as f:
+        blob = f.read()
+    result = normalizer.normalize(blob, keep_format=True)
+    if result is None:
+        return 1, 0, len(blob), len(blob)
+    data, extension = result
+    store = find_image_store(path)
+    if store is None:
+        _write_atomic(path, data)
+        return 1, 1, len(blob), len(data)
+
+    store.add(data, path, extension)
+    old_blob = store.blob_path(hashlib.sha256(blob).hexdigest(), sniff_extension(blob))
+    try:
+        if os.stat(old_blob).st_nlink == 1:
+            os.remove(old_blob)
+    except FileNotFoundError:
+        pass
+    return 1, 1, len(blob), len(data)
+
+
+def _rename_media(name, extension, existing):
+    stem = os.path.splitext(name)[0]
+    new_name = stem + extension
+    counter = 1
+    while new_name in existing:
+        new_name = f"{stem}_{counter}{extension}"
+        counter += 1
+    return new_name
+
+
+def _patch_content_types(xml, renamed, extensions):
+    text = xml.decode("utf-8")
+    for old, new in renamed.items():
+        text = text.replace(f'"/{old}"', f'"/{new}"')
+    for extension in sorted(extensions):
+        ext = extension.lstrip(".")
+        if not re.search(rf'Extension="{ext}"', text, re.IGNORECASE):
+            text = text.replace(
+                "</Types>", f'<Default Extension="{ext}" ContentType="{CONTENT_TYPES[extension]}"/></Types>'
+            )
+    return text.encode("utf-8")
+
+
+def process_docx_media(path, normalizer):
+    """
+    Нормализует изображения в word/media/ документа на месте. Формат может
+    меняться (например, BMP или фото в PNG -> JPEG): часть переименовывается,
+    ссылки в .rels и [Content_Types].xml исправляются.
+    """
+    seen = changed = bytes_before = bytes_after = 0
+    replaced = {}
+    renamed = {}
+    with zipfile.ZipFile(path) as archive:
+        infos = archive.infolist()
+        names = {info.filename for info in infos}
+        for info in infos:
+            if not info.filename.startswith(MEDIA_PREFIX) or info.is_dir():
+                continue
+            blob = archive.read(info)
+            seen += 1
+            bytes_before += len(blob)
+            result = normalizer.normalize(blob, keep_format=False)
+            if result is None:
+                bytes_after += len(blob)
+                continue
+            data, extension = result
+            changed += 1
+            bytes_after += len(data)
+            replaced[info.filename] = data
+            old_extension = os.path.splitext(info.filename)[1].lower()
+            if old_extension != extension and not (old_extension == ".jpg" and extension == ".jpeg"):
+                new_name = _rename_media(info.filename, extension, names)
+                names.add(new_name)
+                renamed[info.filename] = new_name
+
+        if not replaced:
+            return seen, changed, bytes_before, bytes_after
+
+        new_extensions = {os.path.splitext(new)[1] for new in renamed.values()}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with zipfile.ZipFile(tmp_path, "w") as out:
+            for info in infos:
+                data = replaced.get(info.filename)
+                if data is None:
+                    data = archive.read(info)
+                if info.filename.endswith(".rels"):
+                    for old, new in renamed.items():
+                        data = data.replace(
+                            f"media/{os.path.basename(old)}\"".encode(), f"media/{os.path.basename(new)}\"".encode()
+                        )
+                elif info.filename == "[Content_Types].xml":
+                    data = _patch_content_types(data, renamed, new_extensions)
+                new_info = zipfile.ZipInfo(renamed.get(info.filename, info.filename), info.date_time)
+                new_info.compress_type = info.compress_type
+                new_info.external_attr = info.external_attr
+                out.writestr(new_info, data)
+    os.replace(tmp_path, path)
+    return seen, changed, bytes_before, bytes_after
+
+
+_worker = {}
+
+
+def _init_worker(cache_path, max_dimension, quality):
+    _worker["normalizer"] = Normalizer(ResizeCache(cache_path), max_dimension, quality)
+
+
+def _run_task(path):
+    normalizer = _worker["normalizer"]
+    normalizer.entries = []
+    try:
+        if path.endswith(".docx"):
+            stats = process_docx_media(path, normalizer)
+        else:
+            stats = process_image_file(path, normalizer)
+        return path, stats, normalizer.entries, None
+    except Exception as e:
+        return path, (0, 0, 0, 0), normalizer.entries, str(e)
+
+
+def collect_files(root, docx=True, images=True):
+    files = []
+    for current, dirs, names in os.walk(root):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in names:
+            extension = os.path.splitext(name)[1].lower()
+            if docx and extension == ".docx" and not name.startswith("~$"):
+                files.append(os.path.join(current, name))
+            elif images and extension in RASTER_EXTENSIONS:
+                files.append(os.path.join(current, name))
+    return files
+
+
+def normalize_directory(root, max_dimension=DEFAULT_MAX_DIMENSION, quality=DEFAULT_JPEG_QUALITY,
+                        workers=None, cache_path=DEFAULT_CACHE_PATH, docx=True, images=True):
+    """
+    Нормализует изображения под root в пуле процессов: файлы изображений
+    (например extracted_files_*/images) и части word/media/ в .docx.
+    Печатает сэкономленный объём и скорость.
+    """
+    files = collect_files(root, docx=docx, images=images)
+    cache = ResizeCache(cache_path)
+    totals = {"files": len(files), "images": 0, "changed": 0, "bytes_before": 0, "bytes_after": 0, "errors": 0}
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(cache_path, max_dimension, quality)) as executor:
+        for path, (seen, changed, before, after), entries, error in executor.map(_run_task, files, chunksize=4):
+            if entries:
+                cache.record(entries)
+            if error:
+                totals["errors"] += 1
+                print(f"Error processing {path}: {error}")
+                continue
+            totals["images"] += seen
+            totals["changed"] += changed
+            totals["bytes_before"] += before
+            totals["bytes_after"] += after
+            if changed:
+                print(f"{path}: {changed}/{seen} images, {(before - after) / 1024:.1f} KB saved")
+    cache.close()
+
+    elapsed = time.perf_counter() - start
+    mb = 1024 * 1024
+    saved = totals["bytes_before"] - totals["bytes_after"]
+    print("\n" + "=" * 50)
+    print(f"Files: {totals['files']}, images: {totals['images']}, recompressed: {totals['changed']}, "
+          f"errors: {totals['errors']}")
+    print(f"Image bytes: {totals['bytes_before'] / mb:.1f} MB -> {totals['bytes_after'] / mb:.1f} MB "
+          f"({saved / mb:.1f} MB saved)")
+    print(f"Time: {elapsed:.1f} s, {totals['images'] / elapsed if elapsed else 0:.1f} images/s")
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Уменьшение и пережатие изображений в DOCX и папках изображений")
+    parser.add_argument("root", nargs="?", default="/mnt/ks/Works/3nd_tests/ToBeResized")
+    parser.add_argument("--max-dimension", type=int, default=DEFAULT_MAX_DIMENSION,
+                        help="максимальный размер большей стороны в пикселях")
+    parser.add_argument("--quality", type=int, default=DEFAULT_JPEG_QUALITY, help="качество JPEG")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--cache", default=os.environ.get("IMAGE_RESIZE_CACHE_PATH", DEFAULT_CACHE_PATH))
+    parser.add_argument("--docx-only", action="store_true", help="только изображения внутри .docx")
+    parser.add_argument("--images-only", action="store_true", help="только файлы изображений")
+    args = parser.parse_args()
+
+    normalize_directory(args.root, args.max_dimension, args.quality, args.workers, args.cache,
+                        docx=not args.images_only, images=not args.docx_only)
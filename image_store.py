@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import hashlib
+import argparse
+import threading
+
+# Сигнатуры форматов: (смещение, байты, расширение)
+SIGNATURES = (
+    (0, b"\x89PNG\r\n\x1a\n", ".png"),
+    (0, b"\xff\xd8\xff", ".jpeg"),
+    (0, b"GIF87a", ".gif"),
+    (0, b"GIF89a", ".gif"),
+    (0, b"BM", ".bmp"),
+    (0, b"II*\x00", ".tiff"),
+    (0, b"MM\x00*", ".tiff"),
+    (0, b"\xd7\xcd\xc6\x9a", ".wmf"),
+    (0, b"\x01\x00\x09\x00", ".wmf"),
+    (40, b" EMF", ".emf"),
+)
+FALLBACK_EXTENSION = ".bin"
+
+
+def sniff_extension(blob, name=None):
+    """
+    Расширение по содержимому изображения; если сигнатура неизвестна -
+    по имени части документа (name), иначе ".bin".
+    """
+    for offset, magic, extension in SIGNATURES:
+        if blob[offset:offset + len(magic)] == magic:
+            return extension
+    if blob[:4] == b"RIFF" and blob[8:12] == b"WEBP":
+        return ".webp"
+    head = blob[:512].lstrip()
+    if head.startswith(b"<svg") or (head.startswith(b"<?xml") and b"<svg" in head):
+        return ".svg"
+    if name:
+        extension = os.path.splitext(str(name))[1].lower()
+        if extension:
+            return ".jpeg" if extension == ".jpg" else extension
+    return FALLBACK_EXTENSION
+
+
+class ImageStore:
+    """
+    Хранилище изображений, адресуемое по содержимому.
+
+    Каждое изображение хранится один раз: root/<2 символа>/<sha256><ext>.
+    Файл документа (например images/S-10-003_image_1.png) - жёсткая
+    ссылка на блоб, поэтому одинаковые логотипы и чертежи в kg/ru версиях
+    занимают место один раз. Если ссылку создать нельзя (другой раздел),
+    блоб копируется.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def blob_path(self, digest, extension):
+        return os.path.join(self.root, digest[:2], digest + extension)
+
+    def put(self, blob, extension):
+        """Сохраняет блоб, если его ещё нет; возвращает путь блоба"""
+        digest = hashlib.sha256(blob).hexdigest()
+        path = self.blob_path(digest, extension)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Запись через временный файл: параллельные процессы не увидят
+            # недописанный блоб
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(blob)
+            os.replace(tmp_path, path)
+        return path
+
+    def add(self, blob, dest_path, extension):
+        """
+        Кладёт изображение в хранилище и создаёт dest_path - ссылку на блоб.
+
+        Returns:
+            bool: True, если создана жёсткая ссылка, False - копия
+        """
+        path = self.put(blob, extension)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(path, dest_path)
+            return True
+        except OSError:
+            shutil.copyfile(path, dest_path)
+            return False
+
+    def report(self):
+        """
+        Статистика по блобам: число ссылок на каждый блоб показывает,
+        сколько копий изображения не пришлось хранить.
+
+        Returns:
+            dict: blobs, stored_bytes, references, saved_bytes
+        """
+        stats = {"blobs": 0, "stored_bytes": 0, "references": 0, "saved_bytes": 0}
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                # Сам блоб - одна из ссылок
+                references = stat.st_nlink - 1
+                stats["blobs"] += 1
+                stats["stored_bytes"] += stat.st_size
+                stats["references"] += references
+                stats["saved_bytes"] += max(references - 1, 0) * stat.st_size
+        return stats
+
+
+def print_report(stats):
+    mb = 1024 * 1024
+    print(f"Image store: {stats['blobs']} unique images, {stats['stored_bytes'] / mb:.1f} MB stored, "
+          f"{stats['references']} references, {stats['saved_bytes'] / mb:.1f} MB saved by deduplication")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Статистика хранилища изображений")
+    parser.add_argument("root")
+    args = parser.parse_args()
+    print_report(ImageStore(args.root).report())
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+import os
+import re
+import json
+import argparse
+from datetime import datetime
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+# Нарушение правила: question - номер вопроса (с 1) или None для документа
+Issue = namedtuple("Issue", "rule question field message")
+
+# Порядок полей в отчёте json_analysis_report (как в delete_old_files)
+FIELD_ORDER = {"question": 0, "options": 1, "answer": 2}
+
+REFERENCE_RE = re.compile(r"\[(Формула заменена|Изображение заменено): ([^\]]+)\]")
+
+
+def iter_strings(data):
+    """Обходит все строковые значения JSON-структуры"""
+    if isinstance(data, str):
+        yield data
+    elif isinstance(data, dict):
+        for value in data.values():
+            yield from iter_strings(value)
+    elif isinstance(data, list):
+        for value in data:
+            yield from iter_strings(value)
+
+
+def _unescape(path):
+    try:
+        return json.loads(f'"{path}"')
+    except ValueError:
+        return path
+
+
+def find_references(content, data):
+    """
+    Ссылки на формулы и изображения. Обычно ищутся прямо в тексте файла;
+    обход разобранной структуры нужен только для JSON, записанного с
+    ensure_ascii=True, где кириллица экранирована.
+    """
+    if "\\u04" not in content:
+        return [(kind, _unescape(path) if "\\" in path else path)
+                for kind, path in REFERENCE_RE.findall(content)]
+    references = []
+    for text in iter_strings(data):
+        references.extend(REFERENCE_RE.findall(text))
+    return references
+
+
+def is_empty(value):
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return not value.strip()
+    return not value
+
+
+def rule_questions_section(data):
+    if "questions" not in data:
+        yield Issue("questions_missing", None, "questions", "Отсутствует секция questions")
+    elif not isinstance(data["questions"], list):
+        yield Issue("questions_missing", None, "questions", "Секция questions не является списком")
+
+
+def rule_title(data):
+    if not data.get("title"):
+        yield Issue("empty_title", None, "title", "Пустое название")
+
+
+# Поля вопроса, проверяемые на пустоту, и сообщения об ошибке
+EMPTY_FIELD_MESSAGES = (
+    ("question", "empty_question", "пустой текст вопроса"),
+    ("options", "empty_options", "нет вариантов ответа"),
+    ("answer", "empty_answer", "пустой ответ"),
+)
+
+
+def rule_empty_fields(data):
+    # Все поля вопроса проверяются за один проход по списку вопросов
+    questions = data.get("questions")
+    if not isinstance(questions, list):
+        return
+    for idx, question in enumerate(questions, 1):
+        if not isinstance(question, dict):
+            question = {}
+        for field, rule, message in EMPTY_FIELD_MESSAGES:
+            if is_empty(question.get(field)):
+                yield Issue(rule, idx, field, f"Вопрос {idx}: {message}")
+
+
+def _mentions(marker, values):
+    for value in values:
+        if isinstance(value, str):
+            if marker in value:
+                return True
+        elif isinstance(value, list):
+            if any(isinstance(item, str) and marker in item for item in value):
+                return True
+    return False
+
+
+# Поля кортежей question_stats (столбцы таблицы questions в results_store)
+QUESTION_FIELDS = (
+    "idx", "number", "num_options", "question_length", "answer_length",
+    "empty_question", "empty_options", "empty_answer", "has_formula", "has_image",
+)
+
+
+def question_stats(data):
+    """
+    Сводка по каждому вопросу для results_store: номер, число вариантов,
+    длины текста и ответа, флаги пустых полей и замен формул/изображений.
+    """
+    questions = data.get("questions")
+    if not isinstance(questions, list):
+        return []
+    stats = []
+    for idx, question in enumerate(questions, 1):
+        if not isinstance(question, dict):
+            question = {}
+        text = question.get("question")
+        options = question.get("options")
+        answer = question.get("answer")
+        values = (text, options, answer)
+        stats.append((
+            idx,
+            question.get("number") if isinstance(question.get("number"), int) else None,
+            len(options) if isinstance(options, (list, dict)) else 0,
+            len(text) if isinstance(text, str) else 0,
+            len(answer.strip()) if isinstance(answer, str) else 0,
+            is_empty(text),
+            is_empty(options),
+            is_empty(answer),
+            _mentions("[Формула заменена", values),
+            _mentions("[Изображение заменено", values),
+        ))
+    return stats
+
+
+# Правила применяются к каждому разобранному документу-словарю. Новое
+# правило - функция уровня модуля (её должно быть можно передать в
+# процесс-обработчик), возвращающая Issue.
+DEFAULT_RULES = (
+    rule_questions_section,
+    rule_title,
+    rule_empty_fields,
+)
+
+# Правила, нарушение которых делает файл некорректным для analyze.py
+CORRECTNESS_RULES = ("structure", "questions_missing", "empty_answer")
+
+
+def validate_file(path, rules=DEFAULT_RULES):
+    """
+    Читает и разбирает JSON файл один раз и применяет к нему все правила.
+
+    Заодно собираются ссылки [Формула заменена: ...]/[Изображение заменено: ...],
+    чтобы проверить их без повторного чтения файла.
+
+    Returns:
+        dict: path, file_name, file_size, structure_valid, error,
+        num_questions, has_title, issues, references, questions
+        (question_stats)
+    """
+    path = str(path)
+    result = {
+        "path": path,
+        "file_name": os.path.basename(path),
+        "file_size": 0,
+        "structure_valid": False,
+        "error": None,
+        "num_questions": 0,
+        "has_title": False,
+        "issues": [],
+        "references": [],
+        "questions": [],
+    }
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+        result["file_size"] = len(content)
+        data = json.loads(content)
+    except json.JSONDecodeError as e:
+        result["file_size"] = os.path.getsize(path)
+        result["error"] = f"Invalid JSON: {str(e)}"
+        return result
+    except Exception as e:
+        result["error"] = f"Error: {str(e)}"
+        return result
+
+    result["structure_valid"] = True
+    result["references"] = find_references(content, data)
+    if not isinstance(data, dict):
+        result["issues"].append(Issue("structure", None, None, "Неверная структура документа"))
+        return result
+
+    questions = data.get("questions")
+    result["num_questions"] = len(questions) if isinstance(questions, list) else 0
+    result["has_title"] = bool(data.get("title"))
+    for rule in rules:
+        result["issues"].extend(rule(data))
+    result["questions"] = question_stats(data)
+    return result
+
+
+def validate_files(paths, rules=DEFAULT_RULES, workers=None):
+    """
+    Проверяет файлы в пуле процессов; результаты идут в порядке paths.
+    workers <= 1 - последовательная проверка в текущем процессе.
+    """
+    paths = [str(path) for path in paths]
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(paths) < 2:
+        return [validate_file(path, rules) for path in paths]
+    chunksize = max(1, len(paths) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(validate_file, paths, [rules] * len(paths), chunksize=chunksize))
+
+
+def correctness(result):
+    """(корректен ли файл, описание первой ошибки) в смысле analyze.check_json_correctness"""
+    if not result["structure_valid"]:
+        error = result["error"] or ""
+        if error.startswith("Invalid JSON: "):
+            return False, f"Невалидный JSON файл: {error[len('Invalid JSON: '):]}"
+        return False, f"Ошибка при обработке: {error}"
+    for issue in result["issues"]:
+        if issue.rule in CORRECTNESS_RULES:
+            return False, issue.message
+    return True, None
+
+
+def json_analysis_entry(result):
+    """Запись в формате delete_old_files.analyze_json_file"""
+    if not result["structure_valid"]:
+        return {
+            "file_name": result["file_name"],
+            "file_size": result["file_size"],
+            "error": result["error"],
+            "structure_valid": False,
+        }
+    empty_fields = [issue.field for issue in result["issues"] if issue.rule == "empty_title"]
+    per_question = sorted(
+        (issue for issue in result["issues"] if issue.question is not None and issue.field in FIELD_ORDER),
+        key=lambda issue: (issue.question, FIELD_ORDER[issue.field]),
+    )
+    return {
+        "file_name": result["file_name"],
+        "file_size": result["file_size"],
+        "num_questions": result["num_questions"],
+        "empty_fields": empty_fields,
+        "empty_questions": [f"{issue.field}_{issue.question}" for issue in per_question],
+        "has_title": result["has_title"],
+        "structure_valid": True,
+    }
+
+
+def write_json_analysis_report(results, report_file=None):
+    """
+    Печатает сводку и пишет json_analysis_report_*.txt по записям
+    json_analysis_entry. Возвращает (results, problems, report_file).
+    """
+    problems = []
+    empty_files = 0
+    invalid_files = 0
+    for analysis in results:
+        file = analysis["file_name"]
+        if not analysis["structure_valid"]:
+            invalid_files += 1
+            problems.append(f"Invalid JSON in {file}: {analysis.get('error', 'Unknown error')}")
+        elif analysis.get("num_questions", 0) == 0:
+            empty_files += 1
+            problems.append(f"Empty questions in {file}")
+        elif analysis.get("empty_fields") or analysis.get("empty_questions"):
+            problems.append(f"Empty fields in {file}: " +
+                            f"fields={analysis.get('empty_fields', [])} " +
+                            f"questions={analysis.get('empty_questions', [])}")
+    total_files = len(results)
+
+    # Сортируем результаты по размеру файла
+    results = sorted(results, key=lambda x: x["file_size"], reverse=True)
+
+    # Выводим общую статистику
+    print("\nJSON Analysis Results")
+    print("=" * 50)
+    print(f"Total JSON files: {total_files}")
+    print(f"Invalid JSON files: {invalid_files}")
+    print(f"Files with empty questions: {empty_files}")
+    print(f"Files with problems: {len(problems)}")
+    print("\nTop 10 largest files:")
+    for r in results[:10]:
+        print(f"{r['file_name']}: {r['file_size']/1024:.2f} KB, Questions: {r.get('num_questions', 'N/A')}")
+
+    print("\nProblems found:")
+    for p in problems:
+        print(f"- {p}")
+
+    # Записываем детальный отчет в файл
+    if report_file is None:
+        report_file = f'json_analysis_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.txt'
+    with open(report_file, "w", encoding="utf-8") as f:
+        f.write("JSON Analysis Detailed Report\n")
+        f.write("=" * 50 + "\n\n")
+
+        f.write("General Statistics:\n")
+        f.write(f"Total JSON files: {total_files}\n")
+        f.write(f"Invalid JSON files: {invalid_files}\n")
+        f.write(f"Files with empty questions: {empty_files}\n")
+        f.write(f"Files with problems: {len(problems)}\n\n")
+
+        f.write("Detailed File Analysis:\n")
+        for r in results:
+            f.write("-" * 50 + "\n")
+            f.write(f"File: {r['file_name']}\n")
+            f.write(f"Size: {r['file_size']/1024:.2f} KB\n")
+            if r["structure_valid"]:
+                f.write(f"Questions: {r.get('num_questions', 'N/A')}\n")
+                f.write(f"Has title: {r.get('has_title', False)}\n")
+                if r.get("empty_fields"):
+                    f.write(f"Empty fields: {r['empty_fields']}\n")
+                if r.get("empty_questions"):
+                    f.write(f"Empty questions: {r['empty_questions']}\n")
+            else:
+                f.write(f"Error: {r.get('error', 'Unknown error')}\n")
+            f.write("\n")
+
+        f.write("\nProblems Found:\n")
+        for p in problems:
+            f.write(f"- {p}\n")
+
+    return results, problems, report_file
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Проверка всех JSON файлов за один проход: отчёты analyze.py и delete_old_files.py"
+    )
+    parser.add_argument("base_dir", nargs="?", default="/mnt/ks/Works/3nd_tests/ready(last)")
+    parser.add_argument("output_dir", nargs="?", default="/mnt/ks/Works/3nd_tests/results")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--store", default=os.environ.get("RESULTS_STORE_PATH", "results_store.sqlite"),
+                        help="SQLite file for per-question results (results_store.py)")
+    args = parser.parse_args()
+
+    # analyze и results_store импортируют этот модуль, поэтому импорт здесь
+    from analyze import FileAnalyzer
+    from results_store import ResultsStore
+
+    analyzer = FileAnalyzer(args.base_dir, args.output_dir, workers=args.workers)
+    results = analyzer.generate_report()
+    store = ResultsStore(args.store)
+    store.write(results)
+    store.close()
+    report_file = os.path.join(args.output_dir, f'json_analysis_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.txt')
+    write_json_analysis_report([json_analysis_entry(r) for r in results], report_file)
+    print(f"\nDetailed report saved to {report_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import os
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+ID_MAP_FILENAME = "custom_ids.json"
+
+# Ограничения Batch API: не больше 50 000 запросов и 200 МБ на файл;
+# размер берём с запасом
+MAX_REQUESTS_PER_SHARD = 50000
+MAX_BYTES_PER_SHARD = 150 * 1024 * 1024
+
+
+def make_custom_id(rel_path):
+    """
+    Стабильный custom_id для файла: зависит только от относительного пути,
+    поэтому повторная подготовка даёт те же идентификаторы.
+    """
+    normalized = rel_path.replace(os.sep, "/")
+    return "txt-" + hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:40]
+
+
+class BatchWriter:
+    """
+    Записывает запросы Batch API в шарды batch_NNNN.jsonl.
+
+    Новый шард начинается при превышении лимита по числу запросов или
+    по размеру. Соответствие custom_id -> относительный путь сохраняется
+    в custom_ids.json рядом с шардами и нужно при разборе результатов.
+    """
+
+    def __init__(self, batch_dir, max_requests=MAX_REQUESTS_PER_SHARD, max_bytes=MAX_BYTES_PER_SHARD):
+        self.batch_dir = batch_dir
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.shards = []
+        self.id_map = {}
+        self._file = None
+        self._count = 0
+        self._size = 0
+        os.makedirs(batch_dir, exist_ok=True)
+
+    def _open_shard(self):
+        if self._file:
+            self._file.close()
+        path = os.path.join(self.batch_dir, f"batch_{len(self.shards):04d}.jsonl")
+        self._file = open(path, "w", encoding="utf-8")
+        self.shards.append(path)
+        self._count = 0
+        self._size = 0
+
+    def add(self, rel_path, model, messages, temperature, max_tokens):
+        custom_id = make_custom_id(rel_path)
+        if custom_id in self.id_map:
+            logger.warning(f"Duplicate request for {rel_path}, skipped")
+            return custom_id
+        line = json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": model,
+                "messages": messages,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+            },
+        }, ensure_ascii=False) + "\n"
+        size = len(line.encode("utf-8"))
+        if (self._file is None or self._count >= self.max_requests
+                or (self._count and self._size + size > self.max_bytes)):
+            self._open_shard()
+        self._file.write(line)
+        self._count += 1
+        self._size += size
+        self.id_map[custom_id] = rel_path.replace(os.sep, "/")
+        return custom_id
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        map_path = os.path.join(self.batch_dir, ID_MAP_FILENAME)
+        existing = load_id_map(self.batch_dir) if os.path.exists(map_path) else {}
+        existing.update(self.id_map)
+        with open(map_path, "w", encoding="utf-8") as f:
+            json.dump(existing, f, ensure_ascii=False, indent=2)
+        return self.shards
+
+
+def load_id_map(batch_dir):
+    with open(os.path.join(batch_dir, ID_MAP_FILENAME), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_batch_results(result_path):
+    """
+    Читает файл результатов Batch API и возвращает пары
+    (custom_id, текст ответа или None, описание ошибки или None).
+    """
+    with open(result_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error(f"{result_path}:{line_number}: invalid JSON line: {e}")
+                continue
+
+            custom_id = record.get("custom_id")
+            if record.get("error"):
+                yield custom_id, None, str(record["error"])
+                continue
+
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                yield custom_id, None, f"status {response.get('status_code')}: {response.get('body')}"
+                continue
+            try:
+                choice = response["body"]["choices"][0]
+                content = choice["message"]["content"]
+            except (KeyError, IndexError, TypeError) as e:
+                yield custom_id, None, f"unexpected response body: {e}"
+                continue
+            if choice.get("finish_reason") == "length":
+                logger.warning(f"Response for {custom_id} was truncated (finish_reason=length)")
+            yield custom_id, content, None
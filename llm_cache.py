@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from stream_json import stream_chat_completion
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = "llm_cache.sqlite"
+
+
+class CacheMissError(Exception):
+    """Ответа нет в кэше, а обращение к API запрещено (режим cache-only)"""
+
+
+class LLMCache:
+    """
+    Постоянный кэш ответов модели в SQLite, адресуемый по содержимому.
+
+    Ключ - SHA-256 от модели, системного и пользовательского промптов,
+    текста теста и temperature, поэтому повторный запуск после сбоя
+    или удаления плохих JSON не обращается к API повторно для того же
+    входа. max_tokens в ключ не входит: в кэше только целые ответы, а
+    они не зависят от лимита, так что перекалибровка token_budget не
+    обесценивает кэш. Поддерживается вытеснение по возрасту и по
+    суммарному размеру (сначала давно не использованные записи),
+    счётчики попаданий/промахов и режим offline, в котором промах
+    приводит к CacheMissError вместо запроса в сеть. Обрезанные и
+    неразборчивые ответы не кэшируются (см. is_complete_response).
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=None, max_age_days=None, offline=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Создаёт кэш по переменным окружения:
+        LLM_CACHE_PATH, LLM_CACHE_MAX_MB, LLM_CACHE_MAX_AGE_DAYS,
+        LLM_CACHE_OFFLINE=1 (только кэш, без запросов к API).
+        """
+        max_mb = os.environ.get("LLM_CACHE_MAX_MB")
+        max_age = os.environ.get("LLM_CACHE_MAX_AGE_DAYS")
+        return cls(
+            path=os.environ.get("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+            max_bytes=int(float(max_mb) * 1024 * 1024) if max_mb else None,
+            max_age_days=float(max_age) if max_age else None,
+            offline=os.environ.get("LLM_CACHE_OFFLINE", "") not in ("", "0"),
+        )
+
+    @staticmethod
+    def make_key(model, system_prompt, user_prompt, content, temperature):
+        """Возвращает ключ кэша для набора параметров запроса"""
+        payload = json.dumps(
+            [model, system_prompt, user_prompt, content, temperature],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _bump(self, name):
+        self._conn.execute(
+            "INSERT INTO counters(name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def get(self, key):
+        """Возвращает сохранённый ответ или None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                self._bump("misses")
+                self._conn.commit()
+                return None
+            self.hits += 1
+            self._bump("hits")
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, response, model=None):
+        """Сохраняет ответ; пустые ответы не кэшируются"""
+        if not response:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses(key, model, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._conn.commit()
+        if self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Удаляет устаревшие записи и давно не использованные сверх лимита размера"""
+        removed = 0
+        with self._lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute(
+                    "DELETE FROM responses WHERE created_at < ?", (cutoff,)
+                ).rowcount
+
+            if self.max_bytes:
+                total = self._conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()[0]
+                if total > self.max_bytes:
+                    stale = []
+                    for key, size in self._conn.execute(
+                        "SELECT key, size FROM responses ORDER BY last_access ASC"
+                    ):
+                        if total <= self.max_bytes:
+                            break
+                        stale.append((key,))
+                        total -= size
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                    removed += len(stale)
+            self._conn.commit()
+
+        if removed:
+            logger.info(f"LLM cache: evicted {removed} entries")
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("DELETE FROM counters")
+            self._conn.commit()
+
+    def stats(self):
+        """Статистика текущего запуска и всего кэша"""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            counters = dict(self._conn.execute("SELECT name, value FROM counters"))
+        return {
+            "entries": entries,
+            "size_bytes": size,
+            "session_hits": self.hits,
+            "session_misses": self.misses,
+            "total_hits": counters.get("hits", 0),
+            "total_misses": counters.get("misses", 0),
+        }
+
+    def log_stats(self):
+        s = self.stats()
+        logger.info(
+            f"LLM cache: hits {s['session_hits']}, misses {s['session_misses']} "
+            f"(all time: {s['total_hits']}/{s['total_misses']}), "
+            f"{s['entries']} entries, {s['size_bytes'] / 1024 / 1024:.2f} MB"
+        )
+
+    def close(self):
+        self._conn.close()
+
+
+def is_complete_response(text, finish_reason=None):
+    """
+    Ответ целый: не обрезан по max_tokens и разбирается как JSON
+    (возможно, в ```json). Только такие ответы пишутся в кэш и
+    читаются из него - иначе повторный запуск получал бы тот же
+    плохой ответ, не обращаясь к API.
+    """
+    if finish_reason == "length":
+        return False
+    stripped = text.strip()
+    if stripped.startswith("```"):
+        stripped = stripped.split("```json")[-1].split("```")[0].strip()
+    try:
+        json.loads(stripped)
+    except ValueError:
+        return False
+    return True
+
+
+def cached_chat_completion(cache, client, model, messages, system_prompt, user_prompt, content,
+                           temperature, max_tokens, refresh=False, parser=None):
+    """
+    Возвращает текст ответа модели, обращаясь к API только при промахе кэша.
+
+    В режиме offline промах приводит к CacheMissError. refresh=True
+    пропускает чтение кэша (например, если прошлый ответ оказался
+    пустым) и перезаписывает запись новым ответом. С parser ответ
+    запрашивается потоком (см. stream_json.stream_chat_completion).
+    Сохранённый раньше неполный ответ считается промахом.
+    """
+    key = cache.make_key(model, system_prompt, user_prompt, content, temperature)
+    cached = None if refresh and not cache.offline else cache.get(key)
+    if cached is not None and is_complete_response(cached):
+        logger.info("LLM cache hit")
+        return cached
+    if cache.offline:
+        raise CacheMissError("Response is not cached and cache-only mode is enabled")
+
+    if parser:
+        result = stream_chat_completion(client, model, messages, temperature, max_tokens, parser)
+        finish_reason = parser.finish_reason
+    else:
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        result = response.choices[0].message.content
+        finish_reason = response.choices[0].finish_reason
+    if result and is_complete_response(result, finish_reason):
+        cache.put(key, result, model)
+    return result
+
+
+async def cached_chat_completion_async(cache, limiter, client, model, messages, system_prompt, user_prompt,
+                                       content, temperature, max_tokens, refresh=False, parser=None):
+    """
+    Асинхронный вариант cached_chat_completion: при промахе запрос идёт
+    через rate_limit.RateLimiter с асинхронным клиентом.
+    """
+    key = cache.make_key(model, system_prompt, user_prompt, content, temperature)
+    cached = None if refresh and not cache.offline else cache.get(key)
+    if cached is not None and is_complete_response(cached):
+        logger.info("LLM cache hit")
+        return cached
+    if cache.offline:
+        raise CacheMissError("Response is not cached and cache-only mode is enabled")
+
+    result = await limiter.chat_completion(client, model, messages, temperature, max_tokens, parser=parser)
+    if result and is_complete_response(result, parser.finish_reason if parser else None):
+        cache.put(key, result, model)
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Обслуживание кэша ответов модели")
+    parser.add_argument("command", choices=["stats", "evict", "clear"])
+    parser.add_argument("--path", default=os.environ.get("LLM_CACHE_PATH", DEFAULT_CACHE_PATH))
+    parser.add_argument("--max-mb", type=float, default=None)
+    parser.add_argument("--max-age-days", type=float, default=None)
+    args = parser.parse_args()
+
+    cache = LLMCache(
+        args.path,
+        max_bytes=int(args.max_mb * 1024 * 1024) if args.max_mb else None,
+        max_age_days=args.max_age_days,
+    )
+    if args.command == "stats":
+        for name, value in cache.stats().items():
+            print(f"{name}: {value}")
+    elif args.command == "evict":
+        print(f"Evicted: {cache.evict()}")
+    else:
+        cache.clear()
+        print("Cache cleared")
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+import re
+import hashlib
+
+M_NS = "http://schemas.openxmlformats.org/officeDocument/2006/math"
+M = f"{{{M_NS}}}"
+M_VAL = f"{M}val"
+
+# Символы Unicode в формулах Word -> команды LaTeX
+SYMBOLS = {
+    "×": r"\times ", "·": r"\cdot ", "⋅": r"\cdot ", "∙": r"\cdot ", "÷": r"\div ",
+    "±": r"\pm ", "∓": r"\mp ", "−": "-", "≤": r"\le ", "≥": r"\ge ", "≠": r"\ne ",
+    "≈": r"\approx ", "≡": r"\equiv ", "∼": r"\sim ", "∞": r"\infty ", "∠": r"\angle ",
+    "∡": r"\measuredangle ", "°": r"^{\circ}", "⊥": r"\perp ", "∥": r"\parallel ",
+    "△": r"\triangle ", "∆": r"\Delta ", "∈": r"\in ", "∉": r"\notin ", "⊂": r"\subset ",
+    "⊆": r"\subseteq ", "∪": r"\cup ", "∩": r"\cap ", "∅": r"\varnothing ", "→": r"\to ",
+    "⇒": r"\Rightarrow ", "⇔": r"\Leftrightarrow ", "∘": r"\circ ", "…": r"\ldots ",
+    "′": "'", "″": "''", "∀": r"\forall ", "∃": r"\exists ", "√": r"\surd ",
+    "α": r"\alpha ", "β": r"\beta ", "γ": r"\gamma ", "δ": r"\delta ", "ε": r"\varepsilon ",
+    "ζ": r"\zeta ", "η": r"\eta ", "θ": r"\theta ", "λ": r"\lambda ", "μ": r"\mu ",
+    "ν": r"\nu ", "ξ": r"\xi ", "π": r"\pi ", "ρ": r"\rho ", "σ": r"\sigma ", "τ": r"\tau ",
+    "φ": r"\varphi ", "ϕ": r"\phi ", "χ": r"\chi ", "ψ": r"\psi ", "ω": r"\omega ",
+    "Γ": r"\Gamma ", "Δ": r"\Delta ", "Θ": r"\Theta ", "Λ": r"\Lambda ", "Π": r"\Pi ",
+    "Σ": r"\Sigma ", "Φ": r"\Phi ", "Ψ": r"\Psi ", "Ω": r"\Omega ",
+    "{": r"\{", "}": r"\}", "%": r"\%", "#": r"\#", "&": r"\&", "_": r"\_", "$": r"\$",
+    "\\": r"\backslash ", " ": " ",
+}
+NARY = {
+    "∑": r"\sum", "∏": r"\prod", "∐": r"\coprod", "∫": r"\int", "∬": r"\iint",
+    "∭": r"\iiint", "∮": r"\oint", "⋃": r"\bigcup", "⋂": r"\bigcap",
+}
+ACCENTS = {
+    "̂": r"\hat", "̄": r"\bar", "̅": r"\overline", "⃗": r"\vec",
+    "̇": r"\dot", "̈": r"\ddot", "̃": r"\tilde", "̌": r"\check",
+}
+DELIMITERS = {"": ".", "{": r"\{", "}": r"\}", "‖": r"\|", "⟨": r"\langle", "⟩": r"\rangle",
+              "⌈": r"\lceil", "⌉": r"\rceil", "⌊": r"\lfloor", "⌋": r"\rfloor"}
+FUNCTIONS = {"sin", "cos", "tan", "cot", "sec", "csc", "log", "ln", "lg", "exp", "lim",
+             "max", "min", "arcsin", "arccos", "arctan", "sinh", "cosh", "tanh", "det"}
+# Свойства и служебные элементы, не влияющие на запись формулы
+IGNORED = {"rPr", "ctrlPr", "argPr"}
+# Элементы-контейнеры аргументов: их содержимое просто склеивается
+CONTAINERS = {"oMath", "e", "num", "den", "sub", "sup", "deg", "fName", "lim", "box", "borderBox"}
+
+
+class UnsupportedFormula(ValueError):
+    """В формуле есть конструкция, которую конвертер не переводит в LaTeX"""
+
+
+def _local(elem):
+    tag = elem.tag
+    if not isinstance(tag, str):  # комментарии и инструкции lxml
+        return None, None
+    if tag.startswith(M):
+        return M, tag[len(M):]
+    return "other", tag
+
+
+def _prop_elem(elem, pr_name, name):
+    pr = elem.find(f"{M}{pr_name}")
+    return pr.find(f"{M}{name}") if pr is not None else None
+
+
+def _prop(elem, pr_name, name, default=None):
+    """Значение m:val свойства <m:{pr_name}><m:{name} m:val=.../></m:{pr_name}>"""
+    child = _prop_elem(elem, pr_name, name)
+    if child is None:
+        return default
+    value = child.get(M_VAL)
+    return default if value is None else value
+
+
+def _flag(elem, pr_name, name):
+    # Флаг без m:val означает "включено"
+    child = _prop_elem(elem, pr_name, name)
+    if child is None:
+        return False
+    return child.get(M_VAL) in (None, "1", "on", "true")
+
+
+def _child(elem, name):
+    child = elem.find(f"{M}{name}")
+    return _convert(child) if child is not None else ""
+
+
+def _text(run):
+    parts = []
+    for child in run.iter():
+        if isinstance(child.tag, str) and child.tag.endswith("}t") and child.text:
+            parts.append("".join(SYMBOLS.get(ch, ch) for ch in child.text))
+    return "".join(parts)
+
+
+def _group(text):
+    return f"{{{text}}}"
+
+
+def _convert(elem):
+    namespace, name = _local(elem)
+    if namespace is None or name in IGNORED or name.endswith("Pr"):
+        return ""
+    if namespace != M:
+        # Разметка Word внутри формулы (закладки, правописание) пропускается
+        return ""
+
+    if name in CONTAINERS:
+        return "".join(_convert(child) for child in elem)
+    if name == "oMathPara":
+        return r" \\ ".join(_convert(child) for child in elem if _local(child)[1] == "oMath")
+    if name == "r":
+        return _text(elem)
+    if name == "t":
+        return "".join(SYMBOLS.get(ch, ch) for ch in (elem.text or ""))
+    if name == "f":
+        return rf"\frac{_group(_child(elem, 'num'))}{_group(_child(elem, 'den'))}"
+    if name == "sSup":
+        return f"{_group(_child(elem, 'e'))}^{_group(_child(elem, 'sup'))}"
+    if name == "sSub":
+        return f"{_group(_child(elem, 'e'))}_{_group(_child(elem, 'sub'))}"
+    if name == "sSubSup":
+        return f"{_group(_child(elem, 'e'))}_{_group(_child(elem, 'sub'))}^{_group(_child(elem, 'sup'))}"
+    if name == "sPre":
+        return f"{{}}_{_group(_child(elem, 'sub'))}^{_group(_child(elem, 'sup'))}{_group(_child(elem, 'e'))}"
+    if name == "rad":
+        degree = "" if _flag(elem, "radPr", "degHide") else _child(elem, "deg")
+        body = _group(_child(elem, "e"))
+        return rf"\sqrt[{degree}]{body}" if degree.strip() else rf"\sqrt{body}"
+    if name == "d":
+        begin = _prop(elem, "dPr", "begChr", "(")
+        end = _prop(elem, "dPr", "endChr", ")")
+        separator = _prop(elem, "dPr", "sepChr", "|")
+        items = [_convert(child) for child in elem if _local(child)[1] == "e"]
+        separator = DELIMITERS.get(separator, separator)
+        return (rf"\left{DELIMITERS.get(begin, begin)}" + f" {separator} ".join(items)
+                + rf"\right{DELIMITERS.get(end, end)}")
+    if name == "nary":
+        symbol = _prop(elem, "naryPr", "chr", "∫")
+        if symbol not in NARY:
+            raise UnsupportedFormula(f"n-ary operator {symbol!r}")
+        result = NARY[symbol]
+        if not _flag(elem, "naryPr", "subHide"):
+            sub = _child(elem, "sub")
+            if sub:
+                result += f"_{_group(sub)}"
+        if not _flag(elem, "naryPr", "supHide"):
+            sup = _child(elem, "sup")
+            if sup:
+                result += f"^{_group(sup)}"
+        return f"{result} {_group(_child(elem, 'e'))}"
+    if name == "func":
+        fname = _child(elem, "fName").strip()
+        if fname in FUNCTIONS:
+            fname = "\\" + fname
+        elif re.fullmatch(r"[A-Za-zА-Яа-я]+", fname):
+            fname = rf"\operatorname{{{fname}}}"
+        return f"{fname}{_group(_child(elem, 'e'))}"
+    if name == "acc":
+        accent = _prop(elem, "accPr", "chr", "̂")
+        if accent not in ACCENTS:
+            raise UnsupportedFormula(f"accent {accent!r}")
+        return f"{ACCENTS[accent]}{_group(_child(elem, 'e'))}"
+    if name == "bar":
+        command = r"\underline" if _prop(elem, "barPr", "pos", "bot") == "bot" else r"\overline"
+        return f"{command}{_group(_child(elem, 'e'))}"
+    if name == "groupChr":
+        below = _prop(elem, "groupChrPr", "pos", "bot") == "bot"
+        command = r"\underbrace" if below else r"\overbrace"
+        return f"{command}{_group(_child(elem, 'e'))}"
+    if name == "limLow":
+        base = _child(elem, "e").strip()
+        if base in (r"\lim", "lim"):
+            return rf"\lim_{_group(_child(elem, 'lim'))}"
+        return rf"\underset{_group(_child(elem, 'lim'))}{_group(base)}"
+    if name == "limUpp":
+        return rf"\overset{_group(_child(elem, 'lim'))}{_group(_child(elem, 'e'))}"
+    if name == "m":
+        rows = []
+        for row in elem.iterfind(f"{M}mr"):
+            rows.append(" & ".join(_convert(cell) for cell in row.iterfind(f"{M}e")))
+        return r"\begin{matrix}" + r" \\ ".join(rows) + r"\end{matrix}"
+    if name == "eqArr":
+        rows = [_convert(child) for child in elem if _local(child)[1] == "e"]
+        return r"\begin{array}{l}" + r" \\ ".join(rows) + r"\end{array}"
+    raise UnsupportedFormula(f"element m:{name}")
+
+
+def omml_to_latex(element):
+    """
+    Переводит формулу Word (m:oMath или m:oMathPara) в компактную запись
+    LaTeX без окружающих $. Конструкция, которую перевести нельзя,
+    вызывает UnsupportedFormula - тогда формулу нужно сохранить как XML.
+    """
+    return re.sub(r"\s+", " ", _convert(element)).strip()
+
+
+class FormulaCache:
+    """
+    Кэш переводов формул в LaTeX по хэшу их XML: одинаковые формулы,
+    которых в корпусе много, переводятся один раз. Неподдерживаемая
+    формула тоже запоминается (значение None).
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(xml_bytes):
+        return hashlib.sha1(xml_bytes).hexdigest()
+
+    def convert(self, element, xml_bytes):
+        """LaTeX формулы element (xml_bytes - её сериализация) или None"""
+        key = self.make_key(xml_bytes)
+        if key in self._entries:
+            self.hits += 1
+            return self._entries[key]
+        self.misses += 1
+        try:
+            latex = omml_to_latex(element)
+        except UnsupportedFormula:
+            latex = None
+        self._entries[key] = latex or None
+        return self._entries[key]
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import re
+import logging
+from json_validator import REFERENCE_RE
+
+logger = logging.getLogger(__name__)
+
+# Метки вместо маркеров extract.py: [Формула заменена: <путь>] -> ⟦F1⟧,
+# [Изображение заменено: <путь>] -> ⟦I1⟧. Скобки ⟦⟧ в тестах не
+# встречаются, а метка занимает несколько токенов вместо десятков
+KINDS = {"Формула заменена": "F", "Изображение заменено": "I"}
+PLACEHOLDER_RE = re.compile(r"⟦\s*([FI])\s*(\d+)\s*⟧")
+
+
+def encode_markers(text):
+    """
+    Заменяет маркеры формул и изображений короткими метками.
+
+    Одинаковые маркеры получают одну метку, номера идут по порядку
+    появления отдельно для формул и изображений, так что кодирование
+    одного и того же текста всегда даёт те же метки.
+
+    Returns:
+        tuple: (текст с метками, {метка: исходный маркер})
+    """
+    mapping = {}
+    tokens = {}
+    counters = {"F": 0, "I": 0}
+
+    def replace(match):
+        marker = match.group(0)
+        token = tokens.get(marker)
+        if token is None:
+            kind = KINDS[match.group(1)]
+            counters[kind] += 1
+            token = f"⟦{kind}{counters[kind]}⟧"
+            tokens[marker] = token
+            mapping[token] = marker
+        return token
+
+    return REFERENCE_RE.sub(replace, text), mapping
+
+
+def decode_markers(data, mapping):
+    """
+    Возвращает исходные маркеры во все строки разобранного JSON.
+
+    Returns:
+        tuple: (данные, метки из mapping, которых нет в ответе,
+        метки в ответе, которых нет в mapping)
+    """
+    seen = set()
+    unknown = set()
+
+    def replace(match):
+        token = f"⟦{match.group(1)}{match.group(2)}⟧"
+        marker = mapping.get(token)
+        if marker is None:
+            unknown.add(match.group(0))
+            return match.group(0)
+        seen.add(token)
+        return marker
+
+    def walk(value):
+        if isinstance(value, str):
+            return PLACEHOLDER_RE.sub(replace, value) if "⟦" in value else value
+        if isinstance(value, dict):
+            return {key: walk(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [walk(item) for item in value]
+        return value
+
+    data = walk(data)
+    return data, [token for token in mapping if token not in seen], sorted(unknown)
+
+
+def restore_markers(data, mapping):
+    """
+    decode_markers с проверкой: потерянные и выдуманные моделью метки
+    записываются в лог.
+
+    Returns:
+        tuple: (данные, True, если все метки прошли туда и обратно)
+    """
+    if not mapping or data is None:
+        return data, True
+    data, missing, unknown = decode_markers(data, mapping)
+    if missing:
+        logger.warning(f"Placeholders missing from GPT response: {', '.join(missing)}")
+    if unknown:
+        logger.warning(f"Unknown placeholders in GPT response: {', '.join(unknown)}")
+    return data, not (missing or unknown)
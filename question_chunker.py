@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+import re
+import logging
+from stream_json import salvage_json
+
+logger = logging.getLogger(__name__)
+
+# Начало вопроса: "1-суроо", "Вопрос 1", "Суроо 1"
+MARKER_RE = re.compile(r"^\s*(?:(\d+)\s*[-–—]?\s*суроо|(?:Вопрос|Суроо)\s*№?\s*(\d+))\b", re.IGNORECASE)
+# Нумерованная строка "1. ..." / "1) ..." - считается началом вопроса только по порядку номеров
+NUMBERED_RE = re.compile(r"^\s*(\d+)\s*([.)])\s+\S")
+# Блок вариантов: внутри него нумерованные строки - это варианты, а не вопросы
+OPTIONS_RE = re.compile(r"^\s*(?:Жооптордун\s+варианттары|Варианты\s+ответ)", re.IGNORECASE)
+ANSWER_RE = re.compile(r"^\s*(?:Туура\s+жоо[пб]|Правильный\s+ответ|Ответ\s*:)", re.IGNORECASE)
+
+DEFAULT_CHUNK_CHARS = 3000
+# Дозапросов оставшихся вопросов после обрезанного ответа на одну часть
+MAX_CONTINUATIONS = 3
+
+
+def split_questions(text):
+    """
+    Делит текст теста на заголовок и блоки вопросов.
+
+    Вопрос начинается с маркера "N-суроо"/"Вопрос N" или с нумерованной
+    строки, номер которой следует за номером предыдущего вопроса.
+    Блоки "Жооптордун варианттары"/"Туура жообу" остаются внутри своего
+    вопроса. Нумерованные варианты без заголовка ("1) 3", "2) 4") тоже:
+    строка "1)" внутри вопроса начинает список вариантов, и строки с тем
+    же разделителем, продолжающие его нумерацию, считаются вариантами.
+
+    Returns:
+        tuple: (заголовок, [(номер вопроса, текст блока), ...])
+    """
+    header = []
+    questions = []
+    current = None
+    in_options = False
+    next_option = 1
+    option_sep = None
+
+    for line in text.splitlines():
+        number = None
+        match = MARKER_RE.match(line)
+        if match:
+            number = int(match.group(1) or match.group(2))
+        elif not in_options:
+            match = NUMBERED_RE.match(line)
+            if match:
+                candidate, sep = int(match.group(1)), match.group(2)
+                expected = questions[-1][0] + 1 if questions else 1
+                if current is not None and candidate == next_option and (candidate == 1 or sep == option_sep):
+                    next_option = candidate + 1
+                    option_sep = sep
+                elif candidate == expected:
+                    number = candidate
+
+        if number is not None:
+            current = []
+            questions.append((number, current))
+            in_options = False
+            next_option = 1
+            option_sep = None
+        elif current is not None and OPTIONS_RE.match(line):
+            in_options = True
+        elif current is not None and ANSWER_RE.match(line):
+            in_options = False
+
+        (current if current is not None else header).append(line)
+
+    return "\n".join(header).strip(), [(number, "\n".join(lines).strip()) for number, lines in questions]
+
+
+def make_chunks(text, max_chars=DEFAULT_CHUNK_CHARS):
+    """
+    Группирует вопросы в части не длиннее max_chars символов (без учёта
+    заголовка). Каждая часть начинается с заголовка теста, чтобы модель
+    видела общий контекст.
+
+    Короткий тест или текст без распознанных вопросов возвращается одной
+    частью без изменений, так что ключи кэша для него не меняются.
+
+    Returns:
+        list: [(текст части, [номера вопросов в части]), ...]
+    """
+    header, questions = split_questions(text)
+    if len(text) <= max_chars or len(questions) < 2:
+        return [(text, [number for number, _ in questions])]
+
+    groups = []
+    current = []
+    size = 0
+    for number, block in questions:
+        if current and size + len(block) > max_chars:
+            groups.append(current)
+            current = []
+            size = 0
+        current.append((number, block))
+        size += len(block) + 1
+    if current:
+        groups.append(current)
+
+    chunks = []
+    for group in groups:
+        body = "\n".join(block for _, block in group)
+        chunks.append((f"{header}\n{body}" if header else body, [number for number, _ in group]))
+    return chunks
+
+
+def remaining_questions(text, after_number):
+    """
+    Текст теста без вопросов с номерами до after_number включительно -
+    для дозапроса после обрезанного ответа модели. Заголовок сохраняется.
+
+    Returns:
+        tuple: (текст, [номера оставшихся вопросов]) или None, если
+        оставшихся вопросов нет
+    """
+    header, questions = split_questions(text)
+    rest = [(number, block) for number, block in questions if number > after_number]
+    if not rest:
+        return None
+    body = "\n".join(block for _, block in rest)
+    return (f"{header}\n{body}" if header else body), [number for number, _ in rest]
+
+
+def continuation_steps(response, chunk_text, max_continuations=MAX_CONTINUATIONS):
+    """
+    Разбор ответа на часть теста с дозапросами после обрезанных ответов.
+
+    Генератор выдаёт текст дозапроса (заголовок и вопросы после последнего
+    закрытого) и ждёт ответ через send(); результат - в StopIteration.value.
+    Вопросы дозапроса, если их не больше запрошенных, получают номера
+    запрошенных по порядку (как в merge_chunk_results); вопросы с номером
+    не больше уже принятого отбрасываются. Часть неполна (None), если
+    обрезанный ответ не добавил ни одного закрытого вопроса, ответ на
+    дозапрос пуст или не объект, дозапросы исчерпаны или в итоге вопросов
+    меньше, чем найдено в части.
+    """
+    data, complete = salvage_json(response)
+    if complete:
+        return data
+    expected = [number for number, _ in split_questions(chunk_text)[1]]
+    continuations = 0
+    while not complete:
+        numbers = [q.get("number") for q in data["questions"] if isinstance(q.get("number"), int)]
+        if not numbers:
+            logger.error(f"Truncated GPT response without a single complete question:\n{response}")
+            return None
+        last = max(numbers)
+        rest = remaining_questions(chunk_text, last)
+        if rest is None:
+            break
+        if continuations == max_continuations:
+            logger.error(f"Response still truncated after {continuations} follow-up requests")
+            return None
+        continuations += 1
+        follow_up_text, pending = rest
+        logger.warning(f"Truncated GPT response: kept questions up to {last}, "
+                       f"requesting {len(pending)} remaining ({pending[0]}-{pending[-1]})")
+        response = yield follow_up_text
+        if not response:
+            return None
+        latest, complete = salvage_json(response)
+        if not isinstance(latest, dict) or not isinstance(latest.get("questions"), list):
+            logger.error("Follow-up response is not a test object")
+            return None
+
+        returned = [q for q in latest["questions"] if isinstance(q, dict)]
+        if len(returned) <= len(pending):
+            for question, number in zip(returned, pending):
+                if question.get("number") != number:
+                    logger.warning(f"Follow-up question number {question.get('number')} renumbered to {number}")
+                    question["number"] = number
+        added = [q for q in returned if not isinstance(q.get("number"), int) or q["number"] > last]
+        if len(added) < len(returned):
+            logger.warning(f"Dropped {len(returned) - len(added)} follow-up questions already received")
+        if not added and not complete:
+            logger.error("Truncated follow-up response added no complete question")
+            return None
+        data["questions"].extend(added)
+
+    if len(data["questions"]) < len(expected):
+        logger.error(f"Expected {len(expected)} questions ({expected[0]}-{expected[-1]}), "
+                     f"got {len(data['questions'])} after follow-up requests")
+        return None
+    return data
+
+
+def complete_response(response, chunk_text, send, max_continuations=MAX_CONTINUATIONS):
+    """
+    continuation_steps с синхронной отправкой дозапросов: send(текст) -> ответ.
+    Возвращает данные части или None, если часть не получена целиком.
+    """
+    steps = continuation_steps(response, chunk_text, max_continuations)
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(send(request))
+    except StopIteration as stop:
+        return stop.value
+
+
+async def complete_response_async(response, chunk_text, send, max_continuations=MAX_CONTINUATIONS):
+    """Асинхронный вариант complete_response: send(текст) возвращает корутину"""
+    steps = continuation_steps(response, chunk_text, max_continuations)
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(await send(request))
+    except StopIteration as stop:
+        return stop.value
+
+
+def merge_chunk_results(results, chunks):
+    """
+    Объединяет ответы модели по частям в один тест.
+
+    Название берётся из первой части, вопросы склеиваются по порядку.
+    Если модель вернула столько же вопросов, сколько найдено в части,
+    номера сверяются с исходными и при расхождении исправляются.
+    Часть, ответ на которую не объект, без вопросов или с меньшим
+    числом вопросов, чем найдено в ней, делает весь тест неполным:
+    возвращается None, чтобы файл не был сохранён как успешный.
+    """
+    title = ""
+    questions = []
+    for index, (data, (_, expected)) in enumerate(zip(results, chunks)):
+        if not isinstance(data, dict):
+            logger.error(f"Chunk {index + 1}: response is {type(data).__name__}, not a test object")
+            return None
+        if not title:
+            title = data.get("title", "")
+        returned = data.get("questions")
+        if not isinstance(returned, list) or not returned:
+            logger.error(f"Chunk {index + 1}: no questions in response")
+            return None
+
+        if expected and len(returned) < len(expected):
+            logger.error(
+                f"Chunk {index + 1}: expected {len(expected)} questions "
+                f"({expected[0]}-{expected[-1]}), got {len(returned)}"
+            )
+            return None
+        if expected and len(returned) == len(expected):
+            for question, number in zip(returned, expected):
+                if isinstance(question, dict) and question.get("number") != number:
+                    logger.warning(
+                        f"Chunk {index + 1}: question number {question.get('number')} renumbered to {number}"
+                    )
+                    question["number"] = number
+        elif expected:
+            logger.warning(
+                f"Chunk {index + 1}: expected {len(expected)} questions "
+                f"({expected[0]}-{expected[-1]}), got {len(returned)}"
+            )
+        questions.extend(returned)
+
+    numbers = [q.get("number") for q in questions if isinstance(q, dict)]
+    if len(set(numbers)) != len(numbers):
+        logger.warning(f"Duplicate question numbers after merge: {numbers}")
+    return {"title": title, "questions": questions}
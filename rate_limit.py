@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+import re
+import time
+import asyncio
+import logging
+from openai import RateLimitError
+from stream_json import OffSchemaError
+from retry_policy import TransientError
+from token_budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_request_tokens(messages, max_tokens):
+    """Сколько токенов запрос спишет с лимита TPM: промпт плюс max_tokens"""
+    # Та же оценка, что у token_budget при расчёте max_tokens, и те же
+    # ~4 служебных токена на сообщение
+    prompt_tokens = sum(count_tokens(m.get("content") or "") + 4 for m in messages)
+    return prompt_tokens + max_tokens
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """Разбирает длительности вида '1s', '6m0s', '120ms' из заголовков x-ratelimit-reset-*"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_retry_after(headers):
+    """Возвращает задержку в секундах из retry-after-ms / retry-after или None"""
+    if not headers:
+        return None
+    retry_ms = headers.get("retry-after-ms")
+    if retry_ms:
+        try:
+            return float(retry_ms) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+class TokenBucket:
+    """
+    Корзина токенов с пополнением на rate_per_minute единиц в минуту.
+
+    Ёмкость равна минутной квоте, поэтому после простоя допускается
+    всплеск не больше одной минуты квоты.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.refill_per_second = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Сколько секунд ждать, пока в корзине наберётся amount"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount):
+        """Возвращает в корзину неиспользованный резерв"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def drain(self):
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimiter:
+    """
+    Ограничитель запросов к API с отдельными корзинами RPM и TPM.
+
+    Запросы обслуживаются по очереди (FIFO). При ответе 429 или
+    исчерпании квоты по заголовкам x-ratelimit-* все запросы
+    приостанавливаются до указанного сервером момента, так что
+    пропускная способность определяется квотой, а не задержкой ответа.
+    """
+
+    def __init__(self, rpm, tpm, default_backoff=5.0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.default_backoff = default_backoff
+        self.paused_until = 0.0
+        self.rate_limited = 0
+        self._lock = asyncio.Lock()
+
+    def pause_for(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, token_count):
+        """Ждёт, пока запрос на token_count токенов уложится в обе квоты"""
+        async with self._lock:
+            while True:
+                delay = max(
+                    self.paused_until - time.monotonic(),
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(token_count),
+                )
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self.requests.take(1)
+            self.tokens.take(token_count)
+
+    def settle(self, reserved, used):
+        """Возвращает разницу между зарезервированными и реально потраченными токенами"""
+        if used is not None and used < reserved:
+            self.tokens.refund(reserved - used)
+
+    def on_rate_limited(self, headers, attempt):
+        """Обрабатывает ответ 429: пауза по Retry-After или экспоненциальная"""
+        self.rate_limited += 1
+        delay = parse_retry_after(headers)
+        if delay is None:
+            delay = self.default_backoff * (2 ** (attempt - 1))
+        self.requests.drain()
+        self.tokens.drain()
+        self.pause_for(delay)
+        logger.warning(f"Rate limited (429), pausing all requests for {delay:.1f}s")
+        return delay
+
+    def on_response(self, headers):
+        """Учитывает заголовки x-ratelimit-remaining-*/x-ratelimit-reset-* сервера"""
+        if not headers:
+            return
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if remaining is None or reset is None:
+                continue
+            try:
+                if int(float(remaining)) <= 0:
+                    self.pause_for(reset)
+            except ValueError:
+                continue
+
+    async def chat_completion(self, client, model, messages, temperature, max_tokens, max_retries=5,
+                              parser=None):
+        """
+        Выполняет запрос через AsyncOpenAI с учётом квот и повторами при 429.
+
+        Клиент должен быть создан с max_retries=0, иначе встроенные
+        повторы SDK скроют ответы 429 от ограничителя. Если передан parser
+        (stream_json.QuestionStreamParser), ответ запрашивается потоком.
+        """
+        reserved = estimate_request_tokens(messages, max_tokens)
+        for attempt in range(1, max_retries + 1):
+            await self.acquire(reserved)
+            try:
+                extra = {"stream": True, "stream_options": {"include_usage": True}} if parser else {}
+                raw = await client.chat.completions.with_raw_response.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    **extra,
+                )
+            except RateLimitError as e:
+                headers = e.response.headers if e.response is not None else None
+                self.on_rate_limited(headers, attempt)
+                continue
+
+            self.on_response(raw.headers)
+            if parser:
+                return await self._read_stream(raw.parse(), parser, reserved)
+            response = raw.parse()
+            usage = getattr(response, "usage", None)
+            self.settle(reserved, usage.total_tokens if usage else None)
+            return response.choices[0].message.content
+
+        raise TransientError(f"Rate limit retries exhausted after {max_retries} attempts")
+
+    async def _read_stream(self, stream, parser, reserved):
+        used = None
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    used = chunk.usage.total_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parser.feed(chunk.choices[0].delta.content)
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    parser.finish_reason = chunk.choices[0].finish_reason
+        except OffSchemaError:
+            # Закрытие соединения останавливает генерацию на сервере
+            await stream.close()
+            logger.warning(f"Aborted off-schema generation after {len(parser.text)} characters")
+            raise
+        finally:
+            self.settle(reserved, used)
+        return parser.text
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import os
+import re
+import time
+import sqlite3
+import logging
+import argparse
+from pathlib import PurePath
+from json_validator import QUESTION_FIELDS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_PATH = "results_store.sqlite"
+
+# "W-8-032-T-kg" -> код теста W-8-032, класс 8, язык kg
+TEST_NAME_RE = re.compile(r"^([A-Za-z]+-(\d+)-\d+)(?:-T)?(?:-(kg|ru))?$", re.IGNORECASE)
+# "Алгебра 8-класс", "Геометрия 10 класс"
+SUBJECT_DIR_RE = re.compile(r"^(.+?)\s+(\d+)\s*-?\s*класс", re.IGNORECASE)
+# "Кыргызча версия" / "Кырг версия" / "Русская версия"
+LANGUAGE_DIRS = (("кырг", "kg"), ("русск", "ru"))
+
+FLAG_FIELDS = ("empty_question", "empty_options", "empty_answer", "has_formula", "has_image")
+
+
+def parse_test_path(path):
+    """
+    Предмет, класс, язык и код теста по пути к JSON файлу вида
+    .../Алгебра 8-класс/Кыргызча версия/W-8-032/W-8-032-T-kg.json.
+    Неизвестные части возвращаются как None.
+    """
+    parts = PurePath(path).parts
+    subject = grade = language = code = None
+
+    match = TEST_NAME_RE.match(PurePath(path).stem)
+    if match:
+        code = match.group(1).upper()
+        grade = int(match.group(2))
+        language = match.group(3).lower() if match.group(3) else None
+
+    for part in parts[:-1]:
+        subject_match = SUBJECT_DIR_RE.match(part)
+        if subject_match:
+            subject = subject_match.group(1).strip()
+            grade = int(subject_match.group(2))
+        elif language is None:
+            lowered = part.lower()
+            for prefix, lang in LANGUAGE_DIRS:
+                if lowered.startswith(prefix):
+                    language = lang
+    return {"subject": subject, "grade": grade, "language": language, "code": code}
+
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+class ResultsStore:
+    """
+    Столбцовое хранилище результатов проверки JSON (SQLite).
+
+    Таблица files - одна строка на файл, questions - одна строка на
+    вопрос с предметом, классом и языком из пути, числом вариантов,
+    длиной ответа и флагами. Каждый прогон json_validator заменяет
+    строки проверенных файлов, поэтому выборки вроде "пустые ответы в
+    Геометрии 10 kg" выполняются по индексам без чтения JSON.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Встроенные LIKE и lower() SQLite переводят в нижний регистр только
+        # ASCII, а названия предметов кириллические: "геометрия" не нашла бы
+        # "Геометрия". Предмет сравнивается через str.casefold
+        self._conn.create_function("casefold", 1, _casefold, deterministic=True)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " file TEXT PRIMARY KEY,"
+            " subject TEXT,"
+            " grade INTEGER,"
+            " language TEXT,"
+            " code TEXT,"
+            " file_size INTEGER,"
+            " structure_valid INTEGER NOT NULL,"
+            " error TEXT,"
+            " num_questions INTEGER,"
+            " has_title INTEGER,"
+            " validated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS questions ("
+            " file TEXT NOT NULL,"
+            " subject TEXT,"
+            " grade INTEGER,"
+            " language TEXT,"
+            " idx INTEGER NOT NULL,"
+            " number INTEGER,"
+            " num_options INTEGER,"
+            " question_length INTEGER,"
+            " answer_length INTEGER,"
+            " empty_question INTEGER,"
+            " empty_options INTEGER,"
+            " empty_answer INTEGER,"
+            " has_formula INTEGER,"
+            " has_image INTEGER,"
+            " PRIMARY KEY (file, idx))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_questions_group ON questions(subject, grade, language)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_group ON files(subject, grade, language)")
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        """Создаёт хранилище по переменной окружения RESULTS_STORE_PATH"""
+        return cls(os.environ.get("RESULTS_STORE_PATH", DEFAULT_STORE_PATH))
+
+    def write(self, results):
+        """Заменяет строки файлов из results (записи json_validator.validate_file)"""
+        now = time.time()
+        file_rows = []
+        question_rows = []
+        for result in results:
+            file = os.path.abspath(result["path"])
+            meta = parse_test_path(file)
+            group = (meta["subject"], meta["grade"], meta["language"])
+            file_rows.append((
+                file, *group, meta["code"], result["file_size"], result["structure_valid"],
+                result["error"], result["num_questions"], result["has_title"], now,
+            ))
+            question_rows.extend((file, *group, *stats) for stats in result["questions"])
+
+        columns = ", ".join(("file", "subject", "grade", "language") + QUESTION_FIELDS)
+        placeholders = ", ".join("?" * (4 + len(QUESTION_FIELDS)))
+        with self._conn:
+            self._conn.executemany("DELETE FROM questions WHERE file = ?", ((row[0],) for row in file_rows))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", file_rows
+            )
+            self._conn.executemany(
+                f"INSERT INTO questions({columns}) VALUES ({placeholders})", question_rows
+            )
+        logger.info(f"Results store {self.path}: {len(file_rows)} files, {len(question_rows)} questions")
+
+    def query(self, subject=None, grade=None, language=None, flags=(), count=False):
+        """
+        Выбирает вопросы по предмету (по началу названия без учёта
+        регистра), классу, языку и флагам (все должны быть установлены).
+        """
+        where = []
+        params = []
+        if subject:
+            where.append("substr(casefold(subject), 1, ?) = ?")
+            prefix = subject.casefold()
+            params.extend((len(prefix), prefix))
+        if grade is not None:
+            where.append("grade = ?")
+            params.append(grade)
+        if language:
+            where.append("language = ?")
+            params.append(language)
+        for flag in flags:
+            if flag not in FLAG_FIELDS:
+                raise ValueError(f"Unknown flag: {flag}")
+            where.append(f"{flag} = 1")
+
+        select = "COUNT(*)" if count else "file, idx, number, num_options, answer_length"
+        query = f"SELECT {select} FROM questions"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        if count:
+            return self._conn.execute(query, params).fetchone()[0]
+        return self._conn.execute(query + " ORDER BY file, idx", params).fetchall()
+
+    def close(self):
+        self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Выборки из хранилища результатов проверки JSON")
+    parser.add_argument("--path", default=os.environ.get("RESULTS_STORE_PATH", DEFAULT_STORE_PATH))
+    parser.add_argument("--subject", default=None, help="предмет (начало названия), например Геометрия")
+    parser.add_argument("--grade", type=int, default=None)
+    parser.add_argument("--language", choices=("kg", "ru"), default=None)
+    parser.add_argument("--flag", action="append", default=[], choices=FLAG_FIELDS,
+                        help="флаг вопроса; можно указать несколько раз")
+    parser.add_argument("--count", action="store_true", help="вывести только число вопросов")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.path)
+    if args.count:
+        print(store.query(args.subject, args.grade, args.language, args.flag, count=True))
+    else:
+        for file, idx, number, num_options, answer_length in store.query(
+                args.subject, args.grade, args.language, args.flag):
+            print(f"{file}\t{idx}\tnumber={number}\toptions={num_options}\tanswer_length={answer_length}")
+    store.close()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+import os
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import argparse
+import threading
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_PATH = "retry_queue.sqlite"
+
+# Коды ответа, после которых запрос имеет смысл повторить; остальные 4xx
+# (неверный запрос, слишком длинный контекст, фильтр содержимого) - нет
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class TransientError(Exception):
+    """Повторы исчерпаны, но ошибка временная: файл стоит обработать позже"""
+
+
+def is_transient(exc):
+    """Таймауты, обрывы соединения, 429 и 5xx - временные ошибки"""
+    if isinstance(exc, (APITimeoutError, APIConnectionError, RateLimitError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code in RETRYABLE_STATUS or exc.status_code >= 500
+    return isinstance(exc, (TimeoutError, ConnectionError))
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Экспоненциальная задержка с полным джиттером: повторы не идут волной"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    Общий предохранитель для всех запросов запуска.
+
+    После threshold временных ошибок подряд цепь размыкается: все
+    запросы ждут cooldown секунд, а не расходуют очередь файлов во время
+    сбоя API. После паузы запросы снова идут; первая же ошибка размыкает
+    цепь заново с удвоенной паузой (до max_cooldown), успех замыкает её.
+    """
+
+    def __init__(self, threshold=5, cooldown=30.0, max_cooldown=600.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0
+        self.trips = 0       # размыкания подряд, задают длину паузы
+        self.opened = 0      # всего размыканий за запуск
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait_time(self):
+        return max(0.0, self.open_until - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.trips = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures < self.threshold or self.wait_time() > 0:
+                return
+            self.trips += 1
+            self.opened += 1
+            pause = min(self.max_cooldown, self.cooldown * 2 ** (self.trips - 1))
+            self.open_until = time.monotonic() + pause
+        logger.warning(f"Circuit open after {self.failures} transient errors, pausing all requests for {pause:.0f}s")
+
+
+class RetryPolicy:
+    """
+    Повторы временных ошибок с экспоненциальной задержкой и общим
+    предохранителем. Ошибки содержимого пробрасываются сразу; после
+    max_attempts временных ошибок выбрасывается TransientError.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0, breaker=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = 0
+
+    @classmethod
+    def from_env(cls):
+        """RETRY_MAX_ATTEMPTS, RETRY_BREAKER_THRESHOLD, RETRY_BREAKER_COOLDOWN"""
+        return cls(
+            max_attempts=int(os.environ.get("RETRY_MAX_ATTEMPTS", 5)),
+            breaker=CircuitBreaker(
+                threshold=int(os.environ.get("RETRY_BREAKER_THRESHOLD", 5)),
+                cooldown=float(os.environ.get("RETRY_BREAKER_COOLDOWN", 30)),
+            ),
+        )
+
+    def _failed(self, exc, attempt):
+        """Задержка перед следующей попыткой; исключение, если повторять нельзя"""
+        if not is_transient(exc):
+            raise exc
+        self.breaker.record_failure()
+        if attempt >= self.max_attempts:
+            raise TransientError(f"{type(exc).__name__} after {attempt} attempts: {exc}") from exc
+        self.retries += 1
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        logger.warning(f"Transient error ({type(exc).__name__}: {exc}), retry {attempt} in {delay:.1f}s")
+        return delay
+
+    def call(self, fn):
+        for attempt in range(1, self.max_attempts + 1):
+            time.sleep(self.breaker.wait_time())
+            try:
+                result = fn()
+            except Exception as e:
+                time.sleep(self._failed(e, attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, fn):
+        """fn - функция без аргументов, возвращающая корутину"""
+        for attempt in range(1, self.max_attempts + 1):
+            await asyncio.sleep(self.breaker.wait_time())
+            try:
+                result = await fn()
+            except Exception as e:
+                await asyncio.sleep(self._failed(e, attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+
+class RetryQueue:
+    """
+    Очередь файлов с временными ошибками (SQLite), переживающая запуск.
+
+    Файл попадает в очередь с задержкой, растущей с числом попыток;
+    запуск дообрабатывает очередь в конце, а файлы, оставшиеся в ней,
+    следующий запуск подхватит по манифесту. Успешная обработка убирает
+    файл из очереди.
+    """
+
+    def __init__(self, stage, path=DEFAULT_QUEUE_PATH, max_attempts=5, base_delay=60.0):
+        self.stage = stage
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue ("
+            " stage TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL,"
+            " last_error TEXT,"
+            " next_attempt_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (stage, source))"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls, stage):
+        """RETRY_QUEUE_PATH, RETRY_QUEUE_MAX_ATTEMPTS, RETRY_QUEUE_DELAY (секунды до первого повтора)"""
+        return cls(
+            stage,
+            path=os.environ.get("RETRY_QUEUE_PATH", DEFAULT_QUEUE_PATH),
+            max_attempts=int(os.environ.get("RETRY_QUEUE_MAX_ATTEMPTS", 5)),
+            base_delay=float(os.environ.get("RETRY_QUEUE_DELAY", 60)),
+        )
+
+    def push(self, source, error):
+        """Ставит файл в очередь; возвращает число попыток"""
+        source = os.path.abspath(source)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT attempts FROM queue WHERE stage = ? AND source = ?", (self.stage, source)
+            ).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            delay = self.base_delay * 2 ** (attempts - 1)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO queue VALUES (?, ?, ?, ?, ?, ?)",
+                (self.stage, source, attempts, str(error), now + delay, now),
+            )
+            self._conn.commit()
+        return attempts
+
+    def remove(self, source):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM queue WHERE stage = ? AND source = ?", (self.stage, os.path.abspath(source))
+            )
+            self._conn.commit()
+
+    def pending(self, root=None):
+        """
+        [(source, attempts, next_attempt_at)] файлов, которые ещё можно
+        повторить; root - только файлы внутри этой папки
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, attempts, next_attempt_at FROM queue "
+                "WHERE stage = ? AND attempts < ? ORDER BY next_attempt_at",
+                (self.stage, self.max_attempts),
+            ).fetchall()
+        if root is not None:
+            prefix = os.path.join(os.path.abspath(root), "")
+            rows = [row for row in rows if row[0].startswith(prefix)]
+        return rows
+
+    def due(self, root=None):
+        """Файлы, время повтора которых наступило"""
+        now = time.time()
+        return [source for source, _, next_attempt_at in self.pending(root) if next_attempt_at <= now]
+
+    def next_due_in(self, root=None):
+        """Секунд до ближайшего повтора или None, если очередь пуста"""
+        pending = self.pending(root)
+        if not pending:
+            return None
+        return max(0.0, pending[0][2] - time.time())
+
+    def close(self):
+        self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Просмотр очереди повторов")
+    parser.add_argument("--path", default=os.environ.get("RETRY_QUEUE_PATH", DEFAULT_QUEUE_PATH))
+    parser.add_argument("--stage", default=None, help="показать только этот этап")
+    parser.add_argument("--clear", action="store_true", help="очистить очередь (этапа)")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.path)
+    where, params = (" WHERE stage = ?", (args.stage,)) if args.stage else ("", ())
+    if args.clear:
+        conn.execute("DELETE FROM queue" + where, params)
+        conn.commit()
+        print("Queue cleared")
+    else:
+        for stage, source, attempts, last_error in conn.execute(
+            "SELECT stage, source, attempts, last_error FROM queue" + where + " ORDER BY stage, source", params
+        ):
+            print(f"[{stage}] {attempts} attempt(s): {source}\n    {last_error}")
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MANIFEST_PATH = "run_manifest.sqlite"
+
+STATUS_OK = "ok"
+STATUS_EMPTY = "empty"
+STATUS_FAILED = "failed"
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prompt_version(*parts):
+    """Короткий хэш текста промптов: изменение промпта меняет версию"""
+    payload = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def json_has_questions(path):
+    """True, если JSON теста содержит хотя бы один вопрос"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return isinstance(data, dict) and bool(data.get("questions"))
+
+
+class RunManifest:
+    """
+    Манифест обработки для одного этапа конвейера (SQLite).
+
+    Для каждого входного файла хранятся хэш содержимого, mtime и размер,
+    версия промпта, модель и итог обработки. Файл обрабатывается повторно,
+    только если он изменился, прошлая попытка завершилась ошибкой или
+    пустым результатом, выход пропал, либо сменились промпт или модель.
+    Хэш пересчитывается только при изменении mtime или размера, поэтому
+    проход по неизменному корпусу сводится к stat() и чтению из базы.
+    """
+
+    def __init__(self, stage, path=DEFAULT_MANIFEST_PATH, force=False):
+        self.stage = stage
+        self.path = path
+        self.force = force
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " stage TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " source_hash TEXT,"
+            " mtime REAL,"
+            " size INTEGER,"
+            " prompt_version TEXT,"
+            " model TEXT,"
+            " status TEXT NOT NULL,"
+            " output TEXT,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (stage, source))"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls, stage):
+        """
+        Создаёт манифест этапа stage по переменным окружения:
+        RUN_MANIFEST_PATH, RUN_MANIFEST_FORCE=1 (обработать всё заново).
+        """
+        return cls(
+            stage,
+            path=os.environ.get("RUN_MANIFEST_PATH", DEFAULT_MANIFEST_PATH),
+            force=os.environ.get("RUN_MANIFEST_FORCE", "") not in ("", "0"),
+        )
+
+    def _get(self, source):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT source_hash, mtime, size, prompt_version, model, status, output "
+                "FROM entries WHERE stage = ? AND source = ?",
+                (self.stage, os.path.abspath(source)),
+            ).fetchone()
+
+    def _source_hash(self, source, stat, row):
+        # Хэш из манифеста верен, пока mtime и размер файла не изменились
+        if row and row[1] == stat.st_mtime and row[2] == stat.st_size:
+            return row[0]
+        return file_sha256(source)
+
+    def check(self, source, output=None, prompt_version=None, model=None, output_ok=None):
+        """
+        Решает, нужно ли обрабатывать source.
+
+        output_ok(output) - необязательная проверка содержимого готового
+        выхода (например, что JSON не пустой).
+
+        Returns:
+            tuple: (нужна ли обработка, причина)
+        """
+        if self.force:
+            return True, "forced"
+        row = self._get(source)
+        output_exists = output is None or os.path.exists(output)
+
+        if row is None:
+            # Выход, созданный до появления манифеста: принимаем его, если он годный
+            if output is not None and output_exists and (output_ok is None or output_ok(output)):
+                self.record(source, STATUS_OK, output, prompt_version, model)
+                return False, "adopted existing output"
+            return True, "new"
+
+        _, _, _, old_prompt, old_model, status, _ = row
+        if status != STATUS_OK:
+            return True, f"previous status: {status}"
+        if not output_exists:
+            return True, "output missing"
+        if prompt_version is not None and old_prompt != prompt_version:
+            return True, "prompt changed"
+        if model is not None and old_model != model:
+            return True, "model changed"
+
+        stat = os.stat(source)
+        if row[1] == stat.st_mtime and row[2] == stat.st_size:
+            return False, "unchanged"
+        source_hash = file_sha256(source)
+        if source_hash != row[0]:
+            return True, "source changed"
+        # Содержимое прежнее (например, файл скопирован заново) - обновляем mtime
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET mtime = ?, size = ? WHERE stage = ? AND source = ?",
+                (stat.st_mtime, stat.st_size, self.stage, os.path.abspath(source)),
+            )
+            self._conn.commit()
+        return False, "unchanged"
+
+    def record(self, source, status, output=None, prompt_version=None, model=None):
+        """Сохраняет итог обработки source"""
+        source_hash = mtime = size = None
+        if os.path.exists(source):
+            stat = os.stat(source)
+            source_hash = self._source_hash(source, stat, self._get(source))
+            mtime, size = stat.st_mtime, stat.st_size
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries(stage, source, source_hash, mtime, size, "
+                "prompt_version, model, status, output, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.stage, os.path.abspath(source), source_hash, mtime, size,
+                 prompt_version, model, status,
+                 os.path.abspath(output) if output else None, time.time()),
+            )
+            self._conn.commit()
+
+    def summary(self):
+        """Число записей этапа по статусам"""
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM entries WHERE stage = ? GROUP BY status",
+                (self.stage,),
+            ))
+
+    def close(self):
+        self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Просмотр манифеста обработки")
+    parser.add_argument("--path", default=os.environ.get("RUN_MANIFEST_PATH", DEFAULT_MANIFEST_PATH))
+    parser.add_argument("--stage", default=None, help="показать только этот этап")
+    parser.add_argument("--failed", action="store_true", help="перечислить файлы с неуспешным статусом")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.path)
+    query = "SELECT stage, status, COUNT(*) FROM entries"
+    params = ()
+    if args.stage:
+        query += " WHERE stage = ?"
+        params = (args.stage,)
+    for stage, status, count in conn.execute(query + " GROUP BY stage, status ORDER BY stage", params):
+        print(f"{stage}: {status} {count}")
+
+    if args.failed:
+        query = "SELECT stage, status, source FROM entries WHERE status != ?"
+        params = (STATUS_OK,)
+        if args.stage:
+            query += " AND stage = ?"
+            params += (args.stage,)
+        for stage, status, source in conn.execute(query + " ORDER BY stage, source", params):
+            print(f"[{stage}] {status}: {source}")
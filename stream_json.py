@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+import re
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+TITLE_RE = re.compile(r'"title"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+class OffSchemaError(ValueError):
+    """Поток ответа явно не соответствует схеме теста - генерацию можно прервать"""
+
+
+class QuestionStreamParser:
+    """
+    Инкрементальный разбор JSON теста по мере поступления токенов.
+
+    Ожидается объект {"title": ..., "questions": [{...}, ...]}, возможно
+    обёрнутый в ```json. Каждый вопрос выдаётся, как только закрывается
+    его объект. OffSchemaError выбрасывается сразу, если перед "{" идёт
+    текст, элемент questions не объект, вопрос не разбирается или номер
+    вопроса повторяется.
+    """
+
+    def __init__(self, on_question=None):
+        self.on_question = on_question
+        self.questions = []
+        self.started_at = time.perf_counter()
+        self.time_to_first_question = None
+        self.finish_reason = None  # выставляет читатель потока
+        self._pos = 0            # сколько символов уже просмотрено
+        self._text = ""
+        self._started = False    # встретилась открывающая "{" корня
+        self._finished = False   # корневой объект закрыт
+        self._stack = []         # открытые "{"/"[" от корня
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_key = None    # последний строковый ключ на уровне корня
+        self._questions_depth = None
+        self._object_start = None
+        self._numbers = set()
+
+    def feed(self, text):
+        """Добавляет фрагмент ответа и возвращает вопросы, закрывшиеся в нём"""
+        self._text += text
+        emitted = []
+        text = self._text
+        i = self._pos
+        while i < len(text):
+            ch = text[i]
+            if not self._started:
+                if ch.isspace():
+                    i += 1
+                    continue
+                if ch == "{":
+                    self._started = True
+                    self._stack.append("{")
+                    i += 1
+                    continue
+                rest = text[i:]
+                if ch == "`" and (rest.startswith("```") or "```".startswith(rest)):
+                    # Маркер ```json пропускается до конца строки
+                    newline = text.find("\n", i)
+                    if newline == -1:
+                        break  # ждём конец строки
+                    i = newline + 1
+                    continue
+                raise OffSchemaError(f"Unexpected text before JSON: {rest[:40]!r}")
+
+            if self._finished:
+                break
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1 and self._object_start is None:
+                        self._last_key = text[self._string_start + 1:i]
+                i += 1
+                continue
+
+            if (self._questions_depth is not None and len(self._stack) == self._questions_depth
+                    and not ch.isspace() and ch not in ",{]"):
+                raise OffSchemaError("Question is not a JSON object")
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                if self._questions_depth is not None and len(self._stack) == self._questions_depth:
+                    self._object_start = i
+                self._stack.append(ch)
+                if ch == "[" and len(self._stack) == 2 and self._last_key == "questions":
+                    self._questions_depth = 2
+            elif ch in "}]":
+                if not self._stack:
+                    raise OffSchemaError("Unbalanced JSON")
+                self._stack.pop()
+                if (ch == "}" and self._object_start is not None
+                        and len(self._stack) == self._questions_depth):
+                    emitted.append(self._emit(text[self._object_start:i + 1]))
+                    self._object_start = None
+                elif ch == "]" and self._questions_depth is not None and len(self._stack) == 1:
+                    self._questions_depth = None
+                if not self._stack:
+                    self._finished = True
+            i += 1
+        self._pos = i
+        return emitted
+
+    def _emit(self, raw):
+        try:
+            question = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise OffSchemaError(f"Malformed question object: {e}")
+        number = question.get("number")
+        if number is not None:
+            if number in self._numbers:
+                raise OffSchemaError(f"Repeated question number {number}")
+            self._numbers.add(number)
+        if self.time_to_first_question is None:
+            self.time_to_first_question = time.perf_counter() - self.started_at
+        self.questions.append(question)
+        if self.on_question:
+            self.on_question(question)
+        return question
+
+    @property
+    def finished(self):
+        return self._finished
+
+    @property
+    def text(self):
+        return self._text
+
+
+def salvage_json(text):
+    """
+    Разбирает ответ модели, в том числе обрезанный по max_tokens.
+
+    Целый JSON возвращается как есть. Из обрезанного сохраняются
+    название (если строка закрыта) и все вопросы, объекты которых успели
+    закрыться, - тем же разбором, что и при потоковом чтении.
+
+    Returns:
+        tuple: (данные, True - ответ целый / False - восстановлен частично)
+    """
+    stripped = text.strip()
+    if stripped.startswith("```"):
+        stripped = stripped.split("```json")[-1].split("```")[0].strip()
+    try:
+        return json.loads(stripped), True
+    except json.JSONDecodeError:
+        pass
+
+    parser = QuestionStreamParser()
+    try:
+        parser.feed(text)
+    except OffSchemaError as e:
+        logger.warning(f"Salvage stopped at malformed output: {e}")
+    title = ""
+    match = TITLE_RE.search(text)
+    if match:
+        try:
+            title = json.loads(match.group(1))
+        except json.JSONDecodeError:
+            pass
+    return {"title": title, "questions": parser.questions}, False
+
+
+def stream_chat_completion(client, model, messages, temperature, max_tokens, parser):
+    """
+    Запрашивает ответ потоком и передаёт фрагменты в parser.
+
+    При OffSchemaError поток закрывается, чтобы сервер прекратил
+    генерацию, и исключение пробрасывается дальше.
+    """
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+    )
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parser.feed(delta)
+            if chunk.choices[0].finish_reason:
+                parser.finish_reason = chunk.choices[0].finish_reason
+            if chunk.choices[0].finish_reason == "length":
+                logger.warning("Streamed response was truncated (finish_reason=length)")
+    except OffSchemaError:
+        stream.close()
+        logger.warning(f"Aborted off-schema generation after {len(parser.text)} characters")
+        raise
+    if parser.time_to_first_question is not None:
+        logger.info(
+            f"Time to first question: {parser.time_to_first_question:.2f}s, "
+            f"questions streamed: {len(parser.questions)}"
+        )
+    return parser.text
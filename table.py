@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 import os
+import re
+import mmap
 import logging
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # Настройка логирования: вывод в консоль и запись в файл
 logging.basicConfig(
@@ -13,15 +16,100 @@ logging.basicConfig(
     ]
 )
 
-def check_empty_files(directory):
+# Пробельные байты ASCII; содержимое не декодируется
+WHITESPACE_BYTES = b" \t\n\r\x0b\x0c"
+UTF8_BOM = b"\xef\xbb\xbf"
+CHUNK_SIZE = 64 * 1024
+# JSON без содержимого: {"title": "", "questions": []} и подобные объекты,
+# все значения которых - пустые строки, списки, объекты или null
+EMPTY_JSON_RE = re.compile(
+    rb'\s*(?:\xef\xbb\xbf)?\s*\{\s*(?:"[^"\\]*"\s*:\s*(?:""|\[\s*\]|\{\s*\}|null)\s*,?\s*)*\}\s*'
+)
+# Структурно пустой JSON не бывает длиннее (если не раздут пробелами)
+EMPTY_JSON_MAX_BYTES = 4096
+DEFAULT_WORKERS = 16
+
+
+def iter_files(directory):
+    """Рекурсивно выдаёт DirEntry всех файлов через os.scandir"""
+    stack = [str(directory)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        yield entry
+        except OSError as e:
+            logging.error(f"Ошибка при чтении директории {current}: {e}")
+
+
+def _only_whitespace(path):
+    """Читает файл кусками и останавливается на первом непробельном байте"""
+    with open(path, "rb") as f:
+        chunk = f.read(CHUNK_SIZE)
+        if chunk.startswith(UTF8_BOM):
+            chunk = chunk[len(UTF8_BOM):]
+        while chunk:
+            if chunk.strip(WHITESPACE_BYTES):
+                return False
+            chunk = f.read(CHUNK_SIZE)
+    return True
+
+
+def _empty_json(path, size):
+    if size > EMPTY_JSON_MAX_BYTES:
+        return False
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return EMPTY_JSON_RE.fullmatch(data) is not None
+
+
+def classify_file(entry):
+    """
+    Возвращает причину, по которой файл считается пустым, или None:
+    "zero" - 0 байт, "whitespace" - только пробельные символы,
+    "empty_json" - JSON без содержимого.
+    """
+    size = entry.stat().st_size
+    if size == 0:
+        return "zero"
+    if _only_whitespace(entry.path):
+        return "whitespace"
+    if entry.name.endswith(".json") and _empty_json(entry.path, size):
+        return "empty_json"
+    return None
+
+
+EMPTY_MESSAGES = {
+    "zero": "Пустой файл (0 байт)",
+    "whitespace": "Файл содержит только пробелы",
+    "empty_json": "JSON без содержимого",
+}
+
+
+def _check_entry(entry):
+    try:
+        return entry, classify_file(entry)
+    except Exception as e:
+        logging.error(f"Ошибка при проверке файла {entry.path}: {e}")
+        return entry, None
+
+
+def check_empty_files(directory, workers=DEFAULT_WORKERS):
     """
     Рекурсивно проходит по директории и ищет пустые файлы.
     
-    Файл считается пустым, если его размер равен 0 байт
-    или если после удаления пробельных символов он оказывается пустым.
+    Файл считается пустым, если его размер равен 0 байт, если в нём
+    только пробельные символы или если это JSON без содержимого вроде
+    {"title": "", "questions": []}. Содержимое читается кусками до
+    первого непробельного байта и не декодируется, поэтому бинарные
+    файлы не дают ошибок. stat() и чтение идут в пуле потоков.
     
     Args:
         directory (str или Path): Путь к директории для проверки.
+        workers (int): Число потоков.
         
     Returns:
         list: Список путей пустых файлов.
@@ -30,22 +118,12 @@ def check_empty_files(directory):
     directory = Path(directory)
     
     logging.info(f"Начинаем проверку файлов в директории: {directory}")
-    for file_path in directory.rglob("*"):
-        if file_path.is_file():
-            try:
-                # Если размер файла 0 байт
-                if file_path.stat().st_size == 0:
-                    logging.info(f"Пустой файл (0 байт): {file_path}")
-                    empty_files.append(file_path)
-                else:
-                    # Если файл содержит только пробельные символы
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        content = f.read()
-                        if not content.strip():
-                            logging.info(f"Файл содержит только пробелы: {file_path}")
-                            empty_files.append(file_path)
-            except Exception as e:
-                logging.error(f"Ошибка при проверке файла {file_path}: {e}")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for entry, reason in executor.map(_check_entry, iter_files(directory)):
+            if reason:
+                file_path = Path(entry.path)
+                logging.info(f"{EMPTY_MESSAGES[reason]}: {file_path}")
+                empty_files.append(file_path)
     
     logging.info(f"Проверка завершена. Найдено пустых файлов: {len(empty_files)}")
     return empty_files
@@ -2,16 +2,21 @@
 
 import os
 import shutil
-from docx import Document
 from pathlib import Path
+from docx_probe import DocxProbeIndex
+
+# Признаки документов (таблицы и т.д.) берутся из общего индекса docx_probe
+probe_index = DocxProbeIndex.from_env()
 
 def check_for_tables(source_path):
     """
     Проверяет, содержит ли .docx файл таблицы.
     """
     try:
-        doc = Document(source_path)
-        has_tables = len(doc.tables) > 0
+        features = probe_index.get(source_path)
+        if features["error"]:
+            raise ValueError(features["error"])
+        has_tables = features["tables"] > 0
         print(f"Checked {source_path}: {'Has tables' if has_tables else 'No tables'}")
         return has_tables
     except Exception as e:
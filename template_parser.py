@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import re
+
+from question_chunker import MARKER_RE, NUMBERED_RE, OPTIONS_RE, ANSWER_RE, split_questions
+
+# Вариант ответа: "а) 5", "б. 2", "A) ...": кириллические и латинские буквы
+OPTION_RE = re.compile(r"^\s*([а-еa-eА-ЕA-E])\s*[).]\s*(.*)$")
+# "Туура жообу: а" / "Правильный ответ: б)"
+ANSWER_VALUE_RE = re.compile(
+    r"^\s*(?:Туура\s+жоо[пб]у?|Правильный\s+ответ|Ответ)\s*[:\-–—]?\s*([а-еa-eА-ЕA-E])\s*[).]?\s*$",
+    re.IGNORECASE,
+)
+# Строки заголовка, которые не входят в title
+SKIP_HEADER_RE = re.compile(r"^\s*(?:Тест|Test)\s*[:.]?\s*$", re.IGNORECASE)
+
+MIN_OPTIONS = 2
+
+
+class TemplateMismatch(ValueError):
+    """Текст не укладывается в шаблон с достаточной уверенностью"""
+
+
+def _marker_rest(line):
+    """Текст вопроса, записанный в той же строке, что и маркер"""
+    match = MARKER_RE.match(line)
+    if match:
+        rest = line[match.end():]
+    else:
+        # NUMBERED_RE захватывает первый символ текста
+        rest = line[NUMBERED_RE.match(line).end() - 1:]
+    return rest.lstrip(" .:)-–—").strip()
+
+
+def _parse_question(number, block):
+    lines = [line.strip() for line in block.splitlines() if line.strip()]
+    first_line = _marker_rest(lines[0])
+    question_lines = [first_line] if first_line else []
+    options = []
+    letters = []
+    answer = None
+    state = "question"
+
+    for line in lines[1:]:
+        if answer is not None:
+            raise TemplateMismatch(f"question {number}: text after the answer line")
+        answer_match = ANSWER_VALUE_RE.match(line)
+        if answer_match:
+            answer = answer_match.group(1).lower()
+            continue
+        if ANSWER_RE.match(line):
+            raise TemplateMismatch(f"question {number}: answer is not a single letter")
+        if OPTIONS_RE.match(line):
+            if state == "options":
+                raise TemplateMismatch(f"question {number}: repeated options header")
+            state = "options"
+            continue
+        option_match = OPTION_RE.match(line)
+        if option_match and option_match.group(2):
+            state = "options"
+            options.append(line)
+            letters.append(option_match.group(1).lower())
+            continue
+        if state == "options":
+            raise TemplateMismatch(f"question {number}: unexpected line among options: {line[:40]!r}")
+        question_lines.append(line)
+
+    if not question_lines:
+        raise TemplateMismatch(f"question {number}: empty question text")
+    if len(options) < MIN_OPTIONS:
+        raise TemplateMismatch(f"question {number}: {len(options)} options")
+    if len(set(letters)) != len(letters):
+        raise TemplateMismatch(f"question {number}: repeated option letters")
+    if answer is None or answer not in letters:
+        raise TemplateMismatch(f"question {number}: answer missing or not among options")
+
+    return {
+        "number": number,
+        "question": "\n".join(question_lines),
+        "options": options,
+        "answer": answer,
+    }
+
+
+def parse_test(text):
+    """
+    Разбирает тест стандартного вида без обращения к модели.
+
+    Шаблон: строки заголовка (предмет, класс, тема), затем вопросы
+    "N-суроо"/"Вопрос N", варианты "а) ..." (возможно после
+    "Жооптордун варианттары:") и строка "Туура жообу: а". Результат
+    имеет ту же структуру title/questions, что и ответ модели.
+
+    Разбор строгий: номера вопросов должны идти подряд с 1, у каждого
+    вопроса - текст, не меньше двух вариантов и ответ из их числа.
+    Иначе выбрасывается TemplateMismatch и файл уходит в модель.
+    """
+    header, blocks = split_questions(text)
+    if not blocks:
+        raise TemplateMismatch("no question markers")
+
+    numbers = [number for number, _ in blocks]
+    if numbers != list(range(1, len(numbers) + 1)):
+        raise TemplateMismatch(f"question numbers are not consecutive: {numbers}")
+
+    title_lines = [line.strip() for line in header.splitlines()
+                   if line.strip() and not SKIP_HEADER_RE.match(line)]
+    if not title_lines:
+        raise TemplateMismatch("no title")
+
+    return {
+        "title": ". ".join(line.rstrip(".") for line in title_lines),
+        "questions": [_parse_question(number, block) for number, block in blocks],
+    }
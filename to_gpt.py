@@ -1,88 +1,102 @@
 import os
 from openai import OpenAI
-from docx import Document
+from docx_text import extract_text_from_docx as stream_text_from_docx
 import json
+import time
+from llm_cache import LLMCache, CacheMissError, cached_chat_completion
+from run_manifest import RunManifest, STATUS_OK, STATUS_EMPTY, STATUS_FAILED, prompt_version, json_has_questions
+from token_budget import TokenBudget
+from retry_policy import RetryPolicy, RetryQueue, TransientError
 
-# Initialize the OpenAI client
-client = OpenAI(api_key='')
+# Initialize the OpenAI client; retries are done by retry_policy, not the SDK
+client = OpenAI(api_key='', max_retries=0)
+
+# Persistent cache of model responses (see llm_cache.LLMCache.from_env)
+cache = LLMCache.from_env()
+
+# Calibrated token estimates for max_tokens (see token_budget.TokenBudget.from_env)
+budget = TokenBudget.from_env()
+
+# Retries of transient API errors with a shared circuit breaker, and a durable
+# queue of files that still failed (see retry_policy)
+retry = RetryPolicy.from_env()
+retry_queue = RetryQueue.from_env("docx_to_json")
+# The queue is drained at the end of a run if the next retry is not further away
+MAX_RETRY_WAIT = 15 * 60
+
+SYSTEM_PROMPT = (
+    "Ты помощник, который преобразует текст тестов в JSON строгой структуры. "
+    "Не изменяй исходное содержимое текста."
+)
+
+PROMPT_TEXT = (
+    "Преобразуй следующий текст теста в JSON, не изменяя его содержимое (сохраняй все пробелы, знаки препинания и форматирование).\n\n"
+    "Используй следующую структуру:\n"
+    "```\n"
+    "{\n"
+    "    \"title\": \"Название теста\",\n"
+    "    \"questions\": [\n"
+    "        {\n"
+    "            \"number\": номер вопроса,\n"
+    "            \"question\": \"текст вопроса\",\n"
+    "            \"options\": [\"вариант 1\", \"вариант 2\", ...],\n"
+    "            \"answer\": \"правильный ответ(ы)\"\n"
+    "        },\n"
+    "        ...\n"
+    "    ]\n"
+    "}\n"
+    "```\n\n"
+    "Инструкции:\n"
+    "1. Извлеки из текста название теста и помести его в поле \"title\".\n"
+    "2. Каждый вопрос должен содержать порядковый номер, полный текст вопроса, массив вариантов ответа (если они присутствуют) и поле для правильного ответа.\n"
+    "3. Если в вопросе присутствует раздел с ответами, начинающийся с \"Ответы:\" или \"Запишите ответ:\", извлеки его целиком и помести в поле \"answer\".\n"
+    "4. Если вариантов ответа нет, оставь поле \"options\" пустым массивом [].\n"
+    "5. Если правильный ответ не указан, оставь поле \"answer\" пустым.\n\n"
+    "----------------------------------------\n"
+    "Вот текст для преобразования:"
+)
+
+TEMPERATURE = 0.7
+DEFAULT_MODEL = "gpt-4o-mini-2024-07-18"
+
+# Manifest of processed files (see run_manifest.RunManifest.from_env)
+manifest = RunManifest.from_env("docx_to_json")
+PROMPT_VERSION = prompt_version(SYSTEM_PROMPT, PROMPT_TEXT, TEMPERATURE)
 
 # Function to extract text from a .docx file
 def extract_text_from_docx(file_path):
     """
     Извлекает текст из документа Word, включая текст из параграфов, таблиц и других элементов.
     """
-    doc = Document(file_path)
-    full_text = []
-
-    # Извлечение текста из параграфов
-    for paragraph in doc.paragraphs:
-        if paragraph.text.strip():  # Пропускаем пустые строки
-            full_text.append(paragraph.text)
-
-    # Извлечение текста из таблиц
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    if paragraph.text.strip():  # Пропускаем пустые строки
-                        full_text.append(paragraph.text)
-
-    # Возвращаем текст, соединённый через перенос строки
-    return '\n'.join(full_text)
+    # Параграфы и ячейки таблиц читаются потоково в порядке документа
+    return stream_text_from_docx(file_path)
 
 # Function to send content to GPT-4 for JSON generation
-def send_to_gpt4_for_json(content, model="gpt-4o-mini-2024-07-18", max_tokens=3000):
+def send_to_gpt4_for_json(content, model=DEFAULT_MODEL, max_tokens=None, refresh=False):
+    if max_tokens is None:
+        max_tokens = budget.max_tokens_for(content)
     try:
-        prompt_text = (
-            "Преобразуй следующий текст теста в JSON, не изменяя его содержимое (сохраняй все пробелы, знаки препинания и форматирование).\n\n"
-            "Используй следующую структуру:\n"
-            "```\n"
-            "{\n"
-            "    \"title\": \"Название теста\",\n"
-            "    \"questions\": [\n"
-            "        {\n"
-            "            \"number\": номер вопроса,\n"
-            "            \"question\": \"текст вопроса\",\n"
-            "            \"options\": [\"вариант 1\", \"вариант 2\", ...],\n"
-            "            \"answer\": \"правильный ответ(ы)\"\n"
-            "        },\n"
-            "        ...\n"
-            "    ]\n"
-            "}\n"
-            "```\n\n"
-            "Инструкции:\n"
-            "1. Извлеки из текста название теста и помести его в поле \"title\".\n"
-            "2. Каждый вопрос должен содержать порядковый номер, полный текст вопроса, массив вариантов ответа (если они присутствуют) и поле для правильного ответа.\n"
-            "3. Если в вопросе присутствует раздел с ответами, начинающийся с \"Ответы:\" или \"Запишите ответ:\", извлеки его целиком и помести в поле \"answer\".\n"
-            "4. Если вариантов ответа нет, оставь поле \"options\" пустым массивом [].\n"
-            "5. Если правильный ответ не указан, оставь поле \"answer\" пустым.\n\n"
-            "----------------------------------------\n"
-            "Вот текст для преобразования:"
-        )
-        
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Ты помощник, который преобразует текст тестов в JSON строгой структуры. "
-                        "Не изменяй исходное содержимое текста."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": prompt_text
-                },
-                {
-                    "role": "user",
-                    "content": content
-                }
-            ],
-            max_tokens=max_tokens,
-            temperature=0.7
-        )
-        return response.choices[0].message.content
+        messages = [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": PROMPT_TEXT
+            },
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+        return retry.call(lambda: cached_chat_completion(
+            cache, client, model, messages,
+            SYSTEM_PROMPT, PROMPT_TEXT, content,
+            temperature=TEMPERATURE, max_tokens=max_tokens, refresh=refresh
+        ))
+    except (CacheMissError, TransientError):
+        raise
     except Exception as e:
         print(f"Error contacting GPT-4 API: {e}")
         return ""
@@ -132,10 +146,15 @@ def process_file(file_path):
     
         json_file_path = file_path.replace(".docx", ".json")
 
-        # Check if the JSON file already exists
-        if os.path.exists(json_file_path):
-            print(f"JSON file already exists for {file_path}, skipping.")
+        # Skip files that are unchanged since a successful run with the same prompt
+        process, reason = manifest.check(
+            file_path, json_file_path, PROMPT_VERSION, DEFAULT_MODEL, output_ok=json_has_questions
+        )
+        if not process:
+            print(f"JSON file is up to date for {file_path} ({reason}), skipping.")
             return  # Skip processing this file
+        if reason != "new":
+            print(f"Reprocessing {file_path}: {reason}")
             
         print(f"Processing file: {file_path}")
         
@@ -143,10 +162,18 @@ def process_file(file_path):
         content = extract_text_from_docx(file_path)
         
         # Ask GPT-4 to generate JSON
-        gpt_response = send_to_gpt4_for_json(content)
+        # A failed or empty previous result must not be served from the cache again
+        gpt_response = send_to_gpt4_for_json(content, refresh=reason.startswith("previous status"))
         
         # Log raw response for debugging
         print(f"GPT-4 Response for {file_path}:\n{gpt_response}")
+
+        # No response (content error): do not overwrite the JSON with an empty test
+        if not gpt_response:
+            print(f"No response from GPT-4 for {file_path}")
+            manifest.record(file_path, STATUS_FAILED, json_file_path, PROMPT_VERSION, DEFAULT_MODEL)
+            retry_queue.remove(file_path)
+            return
         
         # Parse GPT-4 response into JSON
         try:
@@ -171,9 +198,32 @@ def process_file(file_path):
         # Save to JSON file in the same directory
         json_file_path = file_path.replace(".docx", ".json")
         save_parsed_data_to_json(validated_data, json_file_path)
+        status = STATUS_OK if validated_data["questions"] else STATUS_EMPTY
+        manifest.record(file_path, status, json_file_path, PROMPT_VERSION, DEFAULT_MODEL)
+        retry_queue.remove(file_path)
     
+    except TransientError as e:
+        attempts = retry_queue.push(file_path, e)
+        print(f"Transient failure, queued for retry (attempt {attempts}): {file_path}: {e}")
+        manifest.record(file_path, STATUS_FAILED, None, PROMPT_VERSION, DEFAULT_MODEL)
     except Exception as e:
         print(f"Error processing file {file_path}: {e}")
+        manifest.record(file_path, STATUS_FAILED, None, PROMPT_VERSION, DEFAULT_MODEL)
+        retry_queue.remove(file_path)
+
+# Retry files that failed with transient errors during this run
+def drain_retry_queue(directory):
+    while True:
+        wait = retry_queue.next_due_in(directory)
+        if wait is None:
+            break
+        if wait > MAX_RETRY_WAIT:
+            print(f"Next retry in {wait:.0f}s, {len(retry_queue.pending(directory))} queued files left for the next run")
+            break
+        time.sleep(wait)
+        for file_path in retry_queue.due(directory):
+            print(f"Retrying queued file: {file_path}")
+            process_file(file_path)
 
 # Main processing logic
 if __name__ == "__main__":
@@ -189,6 +239,10 @@ if __name__ == "__main__":
                 file_path = os.path.join(root, file)
                 print(f"Processing file: {file_path}")
                 process_file(file_path)
+    drain_retry_queue(directory_to_process)
     print("Processing complete.")
+    print(f"Transient error retries: {retry.retries}, circuit breaker opened: {retry.breaker.opened}")
+    stats = cache.stats()
+    print(f"LLM cache: hits {stats['session_hits']}, misses {stats['session_misses']}")
 
 #
@@ -1,8 +1,21 @@
 import os
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import json
+import asyncio
 import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from llm_cache import LLMCache, CacheMissError, cached_chat_completion, cached_chat_completion_async
+from rate_limit import RateLimiter
+from llm_batch import BatchWriter, load_id_map, iter_batch_results
+from stream_json import QuestionStreamParser, OffSchemaError
+from question_chunker import make_chunks, merge_chunk_results, complete_response, complete_response_async
+from template_parser import parse_test, TemplateMismatch
+from run_manifest import RunManifest, STATUS_OK, STATUS_EMPTY, STATUS_FAILED, prompt_version, json_has_questions
+from token_budget import TokenBudget, plan_requests, log_plan
+from prompt_placeholders import encode_markers, restore_markers
+from retry_policy import RetryPolicy, RetryQueue, TransientError
 
 # Set up logging
 log_filename = f'conversion_log_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log'
@@ -16,10 +29,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize the OpenAI client
-client = OpenAI(api_key='')
+# Initialize the OpenAI client; retries are done by retry_policy, not the SDK
+client = OpenAI(api_key='', max_retries=0)
 logger.info("OpenAI client initialized")
 
+# Persistent cache of model responses (see llm_cache.LLMCache.from_env)
+cache = LLMCache.from_env()
+
+# Manifest of processed files (see run_manifest.RunManifest.from_env)
+manifest = RunManifest.from_env("txt_to_json")
+
+# Calibrated token estimates for max_tokens (see token_budget.TokenBudget.from_env)
+budget = TokenBudget.from_env()
+
+# Retries of transient API errors with a shared circuit breaker, and a durable
+# queue of files that still failed (see retry_policy)
+retry = RetryPolicy.from_env()
+retry_queue = RetryQueue.from_env("txt_to_json")
+# Очередь дообрабатывается в конце запуска, если ближайший повтор не дальше
+MAX_RETRY_WAIT = 15 * 60
+
 def read_text_from_file(file_path):
     try:
         logger.info(f"Attempting to read file: {file_path}")
@@ -31,15 +60,31 @@ def read_text_from_file(file_path):
         logger.error(f"Error reading file {file_path}: {e}")
         return ""
 
-def send_to_gpt4_for_json(content, model="gpt-4o-mini-2024-07-18", max_tokens=3000):
-    try:
-        logger.info(f"Sending content to GPT-4")
-        print("\nInput Text:")
-        print("="*50)
-        print(content)
-        print("="*50)
-        
-        prompt = """Преобразуй текст теста в JSON формат.
+DEFAULT_MODEL = "gpt-4o-mini-2024-07-18"
+TEMPERATURE = 0.3  # Уменьшил temperature для более точных ответов
+INPUT_BASE_DIR = "/mnt/ks/Works/3nd_tests/extracted_text"
+# Длинные тесты делятся по вопросам на части примерно такого размера,
+# чтобы ответ модели не обрезался по max_tokens
+CHUNK_CHARS = 3000
+CHUNK_WORKERS = 4
+
+# --stream: ответы читаются потоком, вопросы разбираются по мере
+# поступления, а генерация не по схеме прерывается досрочно
+stream_responses = False
+time_to_first_question = []
+
+# Тесты стандартного вида разбираются локально (template_parser) и не
+# отправляются в модель; --no-fast-path отключает это
+use_fast_path = True
+conversion_counts = {"fast_path": 0, "llm": 0, "placeholder_mismatch": 0, "continuations": 0}
+
+# Маркеры формул и изображений с длинными путями заменяются в запросе
+# метками ⟦F1⟧/⟦I1⟧ (prompt_placeholders); --no-placeholders отключает это
+use_placeholders = True
+
+SYSTEM_PROMPT = "Ты помощник, который преобразует тексты тестов в JSON формат точно по заданному шаблону."
+
+USER_PROMPT = """Преобразуй текст теста в JSON формат.
 
 Пример входного текста:
 ```
@@ -85,25 +130,62 @@ def send_to_gpt4_for_json(content, model="gpt-4o-mini-2024-07-18", max_tokens=30
 
 Теперь преобразуй следующий текст:"""
 
-        messages = [
-            {"role": "system", "content": "Ты помощник, который преобразует тексты тестов в JSON формат точно по заданному шаблону."},
-            {"role": "user", "content": prompt + "\n\n" + content}
-        ]
+PROMPT_VERSION = prompt_version(SYSTEM_PROMPT, USER_PROMPT, TEMPERATURE)
 
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=0.3  # Уменьшил temperature для более точных ответов
-        )
-        
-        result = response.choices[0].message.content
+def make_stream_parser():
+    if not stream_responses:
+        return None
+    return QuestionStreamParser(
+        on_question=lambda q: logger.debug(f"Streamed question {q.get('number')}")
+    )
+
+def record_stream_timing(parser):
+    if parser and parser.time_to_first_question is not None:
+        time_to_first_question.append(parser.time_to_first_question)
+
+def build_messages(content):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": USER_PROMPT + "\n\n" + content}
+    ]
+
+def send_to_gpt4_for_json(content, model=DEFAULT_MODEL, max_tokens=None, refresh=False):
+    # max_tokens по умолчанию рассчитывается по размеру текста и числу вопросов
+    if max_tokens is None:
+        max_tokens = budget.max_tokens_for(content)
+    try:
+        logger.info(f"Sending content to GPT-4")
+        print("\nInput Text:")
+        print("="*50)
+        print(content)
+        print("="*50)
+
+        # Каждой попытке свой парсер: оборванный поток не должен
+        # смешиваться с ответом следующей попытки
+        parsers = []
+        def attempt():
+            parsers.append(make_stream_parser())
+            return cached_chat_completion(
+                cache, client, model, build_messages(content),
+                SYSTEM_PROMPT, USER_PROMPT, content,
+                temperature=TEMPERATURE,
+                max_tokens=max_tokens,
+                refresh=refresh,
+                parser=parsers[-1]
+            )
+        result = retry.call(attempt)
+        record_stream_timing(parsers[-1])
         logger.debug(f"GPT response:\n{result}")
         print("\nGPT Response:")
         print("="*50)
         print(result)
         print("="*50)
         return result
+    except (CacheMissError, TransientError):
+        raise
+    except OffSchemaError as e:
+        logger.error(f"Aborted off-schema GPT response: {e}")
+        return ""
     except Exception as e:
         logger.error(f"Error contacting GPT-4 API: {e}")
         return ""
@@ -145,91 +227,564 @@ def validate_and_fix_json(json_data):
             "questions": []
         }
 
-def process_file(file_path, output_base_dir):
+def get_json_path(file_path, output_base_dir, input_base_dir=INPUT_BASE_DIR):
+    rel_path = os.path.relpath(file_path, input_base_dir)
+    return os.path.join(output_base_dir, rel_path.replace(".txt", ".json"))
+
+def parse_gpt_response(gpt_response):
+    try:
+        # Remove any markdown code block syntax
+        stripped_response = gpt_response.strip()
+        if stripped_response.startswith("```"):
+            logger.debug("Removing code block markers")
+            stripped_response = stripped_response.split("```json")[-1].split("```")[0].strip()
+        
+        logger.debug(f"Parsing JSON response:\n{stripped_response}")
+        parsed_data = json.loads(stripped_response)
+        
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON decode error: {e}")
+        logger.error(f"Failed JSON string: {stripped_response}")
+        parsed_data = {"title": "", "questions": []}
+    return parsed_data
+
+def save_json_output(parsed_data, json_file_path):
+    validated_data = validate_and_fix_json(parsed_data)
+    
+    # Create output directory if it doesn't exist
+    os.makedirs(os.path.dirname(json_file_path), exist_ok=True)
+    
+    with open(json_file_path, 'w', encoding='utf-8') as f:
+        json.dump(validated_data, f, ensure_ascii=False, indent=4)
+        logger.info(f"Saved JSON to: {json_file_path}")
+    
+    # Тест без вопросов считается неудачным и будет переобработан
+    return STATUS_OK if validated_data["questions"] else STATUS_EMPTY
+
+def save_gpt_response(gpt_response, json_file_path):
+    return save_json_output(parse_gpt_response(gpt_response), json_file_path)
+
+def parse_locally(content):
+    """Возвращает тест, разобранный по шаблону, или None, если нужна модель"""
+    if not use_fast_path:
+        conversion_counts["llm"] += 1
+        return None
+    try:
+        data = parse_test(content)
+    except TemplateMismatch as e:
+        logger.debug(f"Template parser declined: {e}")
+        conversion_counts["llm"] += 1
+        return None
+    logger.info(f"Parsed locally without GPT: {len(data['questions'])} questions")
+    conversion_counts["fast_path"] += 1
+    return data
+
+def log_conversion_counts():
+    total = conversion_counts["fast_path"] + conversion_counts["llm"]
+    if total:
+        logger.info(
+            f"Fast path: {conversion_counts['fast_path']} of {total} converted files "
+            f"({conversion_counts['fast_path'] / total:.0%}), sent to GPT: {conversion_counts['llm']}"
+        )
+    if conversion_counts["continuations"]:
+        logger.info(f"Follow-up requests for truncated responses: {conversion_counts['continuations']}")
+    if conversion_counts["placeholder_mismatch"]:
+        logger.warning(f"Files failed for lost or unknown placeholders: {conversion_counts['placeholder_mismatch']}")
+
+def encode_for_prompt(content):
+    """Текст для модели и соответствие меток маркерам (пустое без --placeholders)"""
+    if not use_placeholders:
+        return content, {}
+    encoded, mapping = encode_markers(content)
+    if mapping:
+        logger.info(f"Placeholders: {len(mapping)} markers, {len(content)} -> {len(encoded)} characters")
+    return encoded, mapping
+
+def decode_from_response(parsed_data, mapping):
+    # A test that lost or gained a placeholder would silently miss a
+    # formula or image reference: it is not saved and the file is
+    # recorded as failed, so the next run requests it again
+    parsed_data, complete = restore_markers(parsed_data, mapping)
+    if not complete:
+        conversion_counts["placeholder_mismatch"] += 1
+        logger.error("Placeholder round trip failed, response rejected")
+        return None
+    return parsed_data
+
+def parse_with_continuation(gpt_response, chunk_text, refresh=False):
+    """
+    Ответ на часть теста; после обрезанного ответа закрытые вопросы
+    сохраняются, а остальные дозапрашиваются (question_chunker.complete_response).
+    Возвращает None, если часть так и не удалось получить целиком.
+    """
+    def send(remaining):
+        conversion_counts["continuations"] += 1
+        return send_to_gpt4_for_json(remaining, refresh=refresh)
+    return complete_response(gpt_response, chunk_text, send)
+
+def convert_content(content, refresh=False):
+    """
+    Преобразует текст теста в JSON. Тест стандартного вида разбирается
+    локально; остальные отправляются в модель, причём длинный тест
+    делится на части по вопросам, части отправляются параллельно и
+    объединяются по порядку.
+    Маркеры формул и изображений уходят в модель короткими метками и
+    восстанавливаются в разобранном ответе. Обрезанный ответ части
+    дополняется дозапросом оставшихся вопросов.
+    Возвращает словарь теста или None, если хотя бы одна часть не получила ответа.
+    """
+    parsed_data = parse_locally(content)
+    if parsed_data is not None:
+        return parsed_data
+
+    content, mapping = encode_for_prompt(content)
+    chunks = make_chunks(content, CHUNK_CHARS)
+    if len(chunks) == 1:
+        gpt_response = send_to_gpt4_for_json(content, refresh=refresh)
+        if not gpt_response:
+            return None
+        return decode_from_response(parse_with_continuation(gpt_response, content, refresh), mapping)
+
+    logger.info(f"Long test split into {len(chunks)} chunks")
+    with ThreadPoolExecutor(max_workers=min(CHUNK_WORKERS, len(chunks))) as executor:
+        responses = list(executor.map(
+            lambda chunk: send_to_gpt4_for_json(chunk[0], refresh=refresh), chunks
+        ))
+    if not all(responses):
+        return None
+    parsed_chunks = [parse_with_continuation(r, chunk_text, refresh) for r, (chunk_text, _) in zip(responses, chunks)]
+    if not all(parsed_chunks):
+        return None
+    return decode_from_response(merge_chunk_results(parsed_chunks, chunks), mapping)
+
+def needs_processing(file_path, json_file_path, model=DEFAULT_MODEL):
+    """
+    Возвращает (нужна ли обработка, refresh). refresh выставляется, если
+    прошлая попытка завершилась ошибкой или пустым результатом: тогда
+    ответ из кэша использовать нельзя.
+    """
+    process, reason = manifest.check(
+        file_path, json_file_path, PROMPT_VERSION, model, output_ok=json_has_questions
+    )
+    if not process:
+        logger.info(f"Up to date ({reason}): {json_file_path}")
+    elif reason != "new":
+        logger.info(f"Reprocessing ({reason}): {file_path}")
+    return process, reason.startswith("previous status")
+
+def record_result(file_path, status, json_file_path):
+    """Итог файла в манифест; файл с окончательным итогом уходит из очереди повторов"""
+    manifest.record(file_path, status, json_file_path, PROMPT_VERSION, DEFAULT_MODEL)
+    retry_queue.remove(file_path)
+
+def queue_for_retry(file_path, json_file_path, error):
+    # Пустой JSON не пишется: файл останется неуспешным в манифесте и в очереди
+    attempts = retry_queue.push(file_path, error)
+    logger.error(f"Transient failure, queued for retry (attempt {attempts}): {file_path}: {error}")
+    manifest.record(file_path, STATUS_FAILED, json_file_path, PROMPT_VERSION, DEFAULT_MODEL)
+
+def process_file(file_path, output_base_dir, input_base_dir=INPUT_BASE_DIR):
     try:
         logger.info(f"\n{'='*50}\nProcessing file: {file_path}")
         
-        rel_path = os.path.relpath(file_path, "/mnt/ks/Works/3nd_tests/extracted_text")
-        json_file_path = os.path.join(output_base_dir, rel_path.replace(".txt", ".json"))
+        json_file_path = get_json_path(file_path, output_base_dir, input_base_dir)
         
-        if os.path.exists(json_file_path):
-            logger.info(f"JSON file already exists: {json_file_path}")
+        process, refresh = needs_processing(file_path, json_file_path)
+        if not process:
             return
             
         content = read_text_from_file(file_path)
         if not content:
             logger.error("No content read from file")
+            record_result(file_path, STATUS_FAILED, json_file_path)
             return
         
-        gpt_response = send_to_gpt4_for_json(content)
-        if not gpt_response:
-            logger.error("No response from GPT-4")
+        parsed_data = convert_content(content, refresh=refresh)
+        if parsed_data is None:
+            logger.error("No complete response from GPT-4")
+            record_result(file_path, STATUS_FAILED, json_file_path)
             return
         
-        try:
-            # Remove any markdown code block syntax
-            stripped_response = gpt_response.strip()
-            if stripped_response.startswith("```"):
-                logger.debug("Removing code block markers")
-                stripped_response = stripped_response.split("```json")[-1].split("```")[0].strip()
-            
-            logger.debug(f"Parsing JSON response:\n{stripped_response}")
-            parsed_data = json.loads(stripped_response)
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}")
-            logger.error(f"Failed JSON string: {stripped_response}")
-            parsed_data = {"title": "", "questions": []}
-        
-        validated_data = validate_and_fix_json(parsed_data)
-        
-        # Create output directory if it doesn't exist
-        os.makedirs(os.path.dirname(json_file_path), exist_ok=True)
-        
-        with open(json_file_path, 'w', encoding='utf-8') as f:
-            json.dump(validated_data, f, ensure_ascii=False, indent=4)
-            logger.info(f"Saved JSON to: {json_file_path}")
-        
+        status = save_json_output(parsed_data, json_file_path)
+        record_result(file_path, status, json_file_path)
         return True
     
+    except TransientError as e:
+        queue_for_retry(file_path, json_file_path, e)
+        return False
     except Exception as e:
         logger.error(f"Error processing file: {e}", exc_info=True)
+        record_result(file_path, STATUS_FAILED, None)
         return False
 
+async def send_to_gpt4_for_json_async(content, limiter, async_client, model=DEFAULT_MODEL,
+                                      max_tokens=None, refresh=False):
+    # В отличие от синхронной версии текст и ответ не печатаются целиком:
+    # при параллельной обработке вывод разных файлов перемешивался бы
+    if max_tokens is None:
+        max_tokens = budget.max_tokens_for(content)
+    try:
+        # Каждой попытке свой парсер (см. send_to_gpt4_for_json)
+        parsers = []
+        def attempt():
+            parsers.append(make_stream_parser())
+            return cached_chat_completion_async(
+                cache, limiter, async_client, model, build_messages(content),
+                SYSTEM_PROMPT, USER_PROMPT, content,
+                temperature=TEMPERATURE,
+                max_tokens=max_tokens,
+                refresh=refresh,
+                parser=parsers[-1]
+            )
+        result = await retry.call_async(attempt)
+        record_stream_timing(parsers[-1])
+        logger.debug(f"GPT response:\n{result}")
+        return result
+    except (CacheMissError, TransientError):
+        raise
+    except OffSchemaError as e:
+        logger.error(f"Aborted off-schema GPT response: {e}")
+        return ""
+    except Exception as e:
+        logger.error(f"Error contacting GPT-4 API: {e}")
+        return ""
+
+async def parse_with_continuation_async(gpt_response, chunk_text, limiter, async_client, refresh=False):
+    """Асинхронный вариант parse_with_continuation"""
+    def send(remaining):
+        conversion_counts["continuations"] += 1
+        return send_to_gpt4_for_json_async(remaining, limiter, async_client, refresh=refresh)
+    return await complete_response_async(gpt_response, chunk_text, send)
+
+async def convert_content_async(content, limiter, async_client, refresh=False):
+    """Асинхронный вариант convert_content: части теста отправляются одновременно"""
+    parsed_data = parse_locally(content)
+    if parsed_data is not None:
+        return parsed_data
+
+    content, mapping = encode_for_prompt(content)
+    chunks = make_chunks(content, CHUNK_CHARS)
+    if len(chunks) > 1:
+        logger.info(f"Long test split into {len(chunks)} chunks")
+    responses = await asyncio.gather(*(
+        send_to_gpt4_for_json_async(chunk_text, limiter, async_client, refresh=refresh)
+        for chunk_text, _ in chunks
+    ))
+    if not all(responses):
+        return None
+    parsed_chunks = await asyncio.gather(*(
+        parse_with_continuation_async(r, chunk_text, limiter, async_client, refresh)
+        for r, (chunk_text, _) in zip(responses, chunks)
+    ))
+    if not all(parsed_chunks):
+        return None
+    if len(chunks) == 1:
+        return decode_from_response(parsed_chunks[0], mapping)
+    return decode_from_response(merge_chunk_results(parsed_chunks, chunks), mapping)
+
+async def process_file_async(file_path, output_base_dir, limiter, async_client, semaphore,
+                             input_base_dir=INPUT_BASE_DIR):
+    async with semaphore:
+        try:
+            logger.info(f"Processing file: {file_path}")
+            json_file_path = get_json_path(file_path, output_base_dir, input_base_dir)
+
+            process, refresh = needs_processing(file_path, json_file_path)
+            if not process:
+                return None
+
+            content = read_text_from_file(file_path)
+            if not content:
+                logger.error(f"No content read from file: {file_path}")
+                record_result(file_path, STATUS_FAILED, json_file_path)
+                return False
+
+            parsed_data = await convert_content_async(content, limiter, async_client, refresh=refresh)
+            if parsed_data is None:
+                logger.error(f"No complete response from GPT-4 for: {file_path}")
+                record_result(file_path, STATUS_FAILED, json_file_path)
+                return False
+
+            status = save_json_output(parsed_data, json_file_path)
+            record_result(file_path, status, json_file_path)
+            return True
+
+        except CacheMissError:
+            raise
+        except TransientError as e:
+            queue_for_retry(file_path, json_file_path, e)
+            return False
+        except Exception as e:
+            logger.error(f"Error processing file {file_path}: {e}", exc_info=True)
+            record_result(file_path, STATUS_FAILED, None)
+            return False
+
+async def drain_retry_queue(output_base_dir, limiter, async_client, semaphore, input_base_dir):
+    """
+    Повторяет файлы из очереди (в пределах input_base_dir), пока она не
+    опустеет или у файлов не кончатся попытки. Если ближайший повтор
+    дальше MAX_RETRY_WAIT, файлы остаются следующему запуску.
+
+    Returns:
+        dict: путь -> итог последней попытки
+    """
+    results = {}
+    while True:
+        wait = retry_queue.next_due_in(input_base_dir)
+        if wait is None:
+            break
+        if wait > MAX_RETRY_WAIT:
+            logger.warning(f"Next retry in {wait:.0f}s, {len(retry_queue.pending(input_base_dir))} "
+                           f"queued files left for the next run")
+            break
+        await asyncio.sleep(wait)
+        due = retry_queue.due(input_base_dir)
+        logger.info(f"Retrying {len(due)} queued files")
+        outcomes = await asyncio.gather(*(
+            process_file_async(file_path, output_base_dir, limiter, async_client, semaphore, input_base_dir)
+            for file_path in due
+        ))
+        results.update(zip(due, outcomes))
+    return results
+
+def log_stream_timing():
+    if time_to_first_question:
+        samples = sorted(time_to_first_question)
+        logger.info(
+            f"Time to first question: median {samples[len(samples) // 2]:.2f}s, "
+            f"max {samples[-1]:.2f}s over {len(samples)} streamed responses"
+        )
+
+async def process_directory_async(input_directory, output_base_dir, concurrency, rpm, tpm, base_url=None):
+    """
+    Обрабатывает все .txt файлы параллельно: не больше concurrency
+    файлов одновременно (части длинного теста идут параллельно внутри
+    файла), скорость ограничена квотами RPM/TPM.
+
+    base_url позволяет направить запросы на локальный
+    OpenAI-совместимый сервер вместо api.openai.com.
+    """
+    # Повторы при 429 выполняет RateLimiter, встроенные повторы SDK отключены
+    async_client = AsyncOpenAI(api_key=client.api_key, base_url=base_url, max_retries=0)
+    limiter = RateLimiter(rpm, tpm)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    txt_files = []
+    files_skipped = 0
+    for root, _, files in os.walk(input_directory):
+        for file in files:
+            if file.endswith(".txt"):
+                txt_files.append(os.path.join(root, file))
+            else:
+                files_skipped += 1
+    logger.info(f"Found {len(txt_files)} txt files")
+
+    start = asyncio.get_running_loop().time()
+    tasks = [
+        process_file_async(file_path, output_base_dir, limiter, async_client, semaphore, input_directory)
+        for file_path in txt_files
+    ]
+    try:
+        results = await asyncio.gather(*tasks)
+        # Файлы с временными ошибками повторяются в том же запуске
+        retried = await drain_retry_queue(output_base_dir, limiter, async_client, semaphore, input_directory)
+    finally:
+        await async_client.close()
+    elapsed = asyncio.get_running_loop().time() - start
+    outcomes = dict(zip(map(os.path.abspath, txt_files), results))
+    outcomes.update(retried)
+    results = list(outcomes.values())
+
+    files_processed = sum(1 for r in results if r is True)
+    files_failed = sum(1 for r in results if r is False)
+    logger.info(f"\nProcessing complete in {elapsed:.1f}s:")
+    logger.info(f"Processed: {files_processed}")
+    logger.info(f"Failed: {files_failed}")
+    logger.info(f"Up to date: {len(results) - files_processed - files_failed}")
+    logger.info(f"Skipped: {files_skipped}")
+    logger.info(f"Rate limited responses (429): {limiter.rate_limited}")
+    logger.info(f"Transient error retries: {retry.retries}, circuit breaker opened: {retry.breaker.opened}, "
+                f"files still queued: {len(retry_queue.pending(input_directory))}")
+    log_stream_timing()
+    log_conversion_counts()
+    cache.log_stats()
+
+def prepare_batch(input_directory, output_base_dir, batch_dir, model=DEFAULT_MODEL,
+                  max_tokens=None):
+    """
+    Записывает запросы для всех файлов без готового JSON в шарды Batch API.
+
+    custom_id выводится из пути относительно input_directory, так что
+    повторная подготовка для тех же файлов даёт те же идентификаторы.
+    Тесты, которые разбирает template_parser, сохраняются сразу.
+    """
+    writer = BatchWriter(batch_dir)
+    pending = 0
+    existing = 0
+    for root, _, files in os.walk(input_directory):
+        for file in files:
+            if not file.endswith(".txt"):
+                continue
+            file_path = os.path.join(root, file)
+            json_file_path = get_json_path(file_path, output_base_dir, input_directory)
+            if not needs_processing(file_path, json_file_path, model)[0]:
+                existing += 1
+                continue
+            content = read_text_from_file(file_path)
+            if not content:
+                logger.error(f"No content read from file: {file_path}")
+                continue
+            parsed_data = parse_locally(content)
+            if parsed_data is not None:
+                status = save_json_output(parsed_data, json_file_path)
+                manifest.record(file_path, status, json_file_path, PROMPT_VERSION, model)
+                continue
+            # Метки восстанавливаются при разборе результатов: кодирование
+            # того же текста даёт те же метки
+            content, _ = encode_for_prompt(content)
+            rel_path = os.path.relpath(file_path, input_directory)
+            writer.add(rel_path, model, build_messages(content), TEMPERATURE,
+                       max_tokens or budget.max_tokens_for(content))
+            pending += 1
+
+    shards = writer.close()
+    log_conversion_counts()
+    logger.info(f"Batch requests written: {pending} in {len(shards)} shard(s), up to date: {existing}")
+    for shard in shards:
+        logger.info(f"  {shard}")
+    return shards
+
+def plan_run(input_directory, output_base_dir, concurrency, rpm, tpm, model=DEFAULT_MODEL):
+    """
+    Прогноз запуска без обращения к API: для файлов, которые нужно
+    обработать, считаются запросы (с разбиением на части, как в
+    convert_content), токены, стоимость и время при заданных квотах.
+    """
+    requests = []
+    files = 0
+    for root, _, names in os.walk(input_directory):
+        for file in names:
+            if not file.endswith(".txt"):
+                continue
+            file_path = os.path.join(root, file)
+            json_file_path = get_json_path(file_path, output_base_dir, input_directory)
+            if not needs_processing(file_path, json_file_path, model)[0]:
+                continue
+            content = read_text_from_file(file_path)
+            if not content or parse_locally(content) is not None:
+                continue
+            content, _ = encode_for_prompt(content)
+            files += 1
+            for chunk_text, _ in make_chunks(content, CHUNK_CHARS):
+                requests.append(budget.estimate_request(build_messages(chunk_text), chunk_text))
+
+    plan = plan_requests(requests, model, concurrency, rpm, tpm)
+    logger.info(f"Pending files for GPT: {files}")
+    log_conversion_counts()
+    log_plan(plan)
+    return plan
+
+def ingest_batch_results(result_files, output_base_dir, batch_dir, input_directory=INPUT_BASE_DIR,
+                         model=DEFAULT_MODEL):
+    """
+    Разбирает скачанные файлы результатов Batch API и сохраняет JSON
+    так же, как process_file. Работает без обращения к сети.
+    """
+    id_map = load_id_map(batch_dir)
+    saved = 0
+    failed = 0
+    for result_path in result_files:
+        logger.info(f"Ingesting batch results: {result_path}")
+        for custom_id, gpt_response, error in iter_batch_results(result_path):
+            rel_path = id_map.get(custom_id)
+            if rel_path is None:
+                logger.error(f"Unknown custom_id {custom_id} in {result_path}")
+                failed += 1
+                continue
+            source_path = os.path.join(input_directory, rel_path)
+            json_file_path = os.path.join(output_base_dir, rel_path.replace(".txt", ".json"))
+            if error or not gpt_response:
+                logger.error(f"No response for {rel_path}: {error}")
+                manifest.record(source_path, STATUS_FAILED, json_file_path, PROMPT_VERSION, model)
+                failed += 1
+                continue
+            try:
+                _, mapping = encode_for_prompt(read_text_from_file(source_path))
+                parsed_data = decode_from_response(parse_gpt_response(gpt_response), mapping)
+                if parsed_data is None:
+                    manifest.record(source_path, STATUS_FAILED, json_file_path, PROMPT_VERSION, model)
+                    failed += 1
+                    continue
+                status = save_json_output(parsed_data, json_file_path)
+                manifest.record(source_path, status, json_file_path, PROMPT_VERSION, model)
+                saved += 1
+            except Exception as e:
+                logger.error(f"Error saving {json_file_path}: {e}", exc_info=True)
+                manifest.record(source_path, STATUS_FAILED, json_file_path, PROMPT_VERSION, model)
+                failed += 1
+
+    logger.info(f"Batch ingestion complete: saved {saved}, failed {failed}")
+    return saved, failed
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert test .txt files to JSON with GPT")
+    parser.add_argument("input_directory", nargs="?", default=INPUT_BASE_DIR)
+    parser.add_argument("output_base_dir", nargs="?", default="/mnt/ks/Works/3nd_tests/json_output")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="maximum number of files processed simultaneously (default: 8)")
+    parser.add_argument("--rpm", type=float, default=500,
+                        help="requests-per-minute quota (default: 500)")
+    parser.add_argument("--tpm", type=float, default=200000,
+                        help="tokens-per-minute quota (default: 200000)")
+    parser.add_argument("--base-url", default=os.environ.get("OPENAI_BASE_URL"),
+                        help="OpenAI-compatible endpoint, e.g. a local stand-in server")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream responses, parse questions incrementally and abort off-schema output early")
+    parser.add_argument("--no-fast-path", action="store_true",
+                        help="send every file to GPT, even if the template parser can handle it")
+    parser.add_argument("--no-placeholders", action="store_true",
+                        help="send formula/image markers with full paths instead of short placeholders")
+    parser.add_argument("--force", action="store_true",
+                        help="ignore the run manifest and reprocess every file")
+    parser.add_argument("--batch-prepare", action="store_true",
+                        help="write pending conversions as Batch API JSONL shards into --batch-dir")
+    parser.add_argument("--batch-ingest", nargs="+", metavar="RESULT_FILE",
+                        help="save JSON from downloaded Batch API result files (offline)")
+    parser.add_argument("--batch-dir", default="batch_requests",
+                        help="directory for batch shards and the custom_id map (default: batch_requests)")
+    parser.add_argument("--plan", action="store_true",
+                        help="dry run: print projected tokens, cost and wall time for pending files")
+    args = parser.parse_args()
+    manifest.force = manifest.force or args.force
+    stream_responses = args.stream
+    use_fast_path = not args.no_fast_path
+    use_placeholders = not args.no_placeholders
+
     try:
+        if args.batch_ingest:
+            ingest_batch_results(args.batch_ingest, args.output_base_dir, args.batch_dir,
+                                 args.input_directory)
+            exit(0)
+
         logger.info("Starting conversion process")
         
-        input_directory = "/mnt/ks/Works/3nd_tests/extracted_text"
-        output_base_dir = "/mnt/ks/Works/3nd_tests/json_output"
-        
-        if not os.path.exists(input_directory):
-            logger.error(f"Input directory not found: {input_directory}")
+        if not os.path.exists(args.input_directory):
+            logger.error(f"Input directory not found: {args.input_directory}")
             exit(1)
             
-        os.makedirs(output_base_dir, exist_ok=True)
-        
-        files_processed = 0
-        files_skipped = 0
-        files_failed = 0
-        
-        for root, _, files in os.walk(input_directory):
-            for file in files:
-                if file.endswith(".txt"):
-                    file_path = os.path.join(root, file)
-                    logger.info(f"Found txt file: {file_path}")
-                    
-                    if process_file(file_path, output_base_dir):
-                        files_processed += 1
-                    else:
-                        files_failed += 1
-                else:
-                    files_skipped += 1
+        os.makedirs(args.output_base_dir, exist_ok=True)
         
-        logger.info(f"\nProcessing complete:")
-        logger.info(f"Processed: {files_processed}")
-        logger.info(f"Failed: {files_failed}")
-        logger.info(f"Skipped: {files_skipped}")
+        if args.plan:
+            plan_run(args.input_directory, args.output_base_dir,
+                     concurrency=max(1, args.concurrency), rpm=args.rpm, tpm=args.tpm)
+        elif args.batch_prepare:
+            prepare_batch(args.input_directory, args.output_base_dir, args.batch_dir)
+        else:
+            asyncio.run(process_directory_async(
+                args.input_directory, args.output_base_dir,
+                concurrency=max(1, args.concurrency), rpm=args.rpm, tpm=args.tpm,
+                base_url=args.base_url
+            ))
         
     except Exception as e:
         logger.error(f"Fatal error: {e}", exc_info=True)
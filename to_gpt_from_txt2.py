@@ -3,7 +3,12 @@ from openai import OpenAI
 import json
 import logging
 from datetime import datetime
-import re
+from concurrent.futures import ThreadPoolExecutor
+from llm_cache import LLMCache, CacheMissError, cached_chat_completion
+from question_chunker import make_chunks, merge_chunk_results, complete_response
+from token_budget import TokenBudget
+from prompt_placeholders import encode_markers, restore_markers
+from retry_policy import RetryPolicy
 
 # Set up logging
 log_filename = f'conversion_log_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log'
@@ -17,53 +22,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize the OpenAI client
-client = OpenAI(api_key='')
+# Initialize the OpenAI client; retries are done by retry_policy, not the SDK
+client = OpenAI(api_key='', max_retries=0)
 logger.info("OpenAI client initialized")
 
-def fix_formula_paths(text):
-    """Исправляет обрезанные пути к формулам"""
-    try:
-        pattern = r'\[Формула заменена: [^\]]*(?:\]|$)'
-        paths = re.finditer(pattern, text)
-        fixed_text = text
-        
-        for path in paths:
-            if not path.group().endswith(']'):
-                # Если путь обрезан, пытаемся его восстановить
-                original_path = path.group()
-                fixed_path = original_path + ']'
-                fixed_text = fixed_text.replace(original_path, fixed_path)
-        
-        return fixed_text
-    except Exception as e:
-        logger.error(f"Error fixing formula paths: {e}")
-        return text
+# Persistent cache of model responses (see llm_cache.LLMCache.from_env)
+cache = LLMCache.from_env()
+
+# Calibrated token estimates for max_tokens (see token_budget.TokenBudget.from_env)
+budget = TokenBudget.from_env()
+
+# Retries of transient API errors with a shared circuit breaker (see retry_policy)
+retry = RetryPolicy.from_env()
+
+# Длинные тесты делятся по вопросам, чтобы ответ не обрезался по max_tokens
+CHUNK_CHARS = 3000
+CHUNK_WORKERS = 4
 
 def validate_json_response(text):
-    """Проверяет и исправляет JSON-ответ"""
+    """
+    Проверяет JSON-ответ. Обрезанный JSON не достраивается скобками:
+    закрытые вопросы сохраняет parse_gpt_response, остальные дозапрашиваются
+    """
     try:
-        # Проверяем, есть ли незакрытые строки с формулами
-        if '[Формула заменена:' in text and not text.endswith('}'):
-            text = fix_formula_paths(text)
-        
-        # Пытаемся загрузить JSON
-        try:
-            data = json.loads(text)
-            return text
-        except json.JSONDecodeError as e:
-            logger.error(f"Invalid JSON: {e}")
-            
-            # Если это похоже на обрезанный JSON, попробуем его восстановить
-            if text.count('{') > text.count('}'):
-                text = text.rstrip() + '}'
-            if '"questions": [' in text and not '"]}' in text:
-                text = text.rstrip() + ']}}'
-                
-            return text
-    except Exception as e:
-        logger.error(f"Error validating JSON: {e}")
-        return text
+        json.loads(text)
+    except json.JSONDecodeError as e:
+        logger.warning(f"Invalid JSON: {e}")
+    return text
 
 def read_text_from_file(file_path):
     try:
@@ -76,7 +61,9 @@ def read_text_from_file(file_path):
         logger.error(f"Error reading file {file_path}: {e}")
         return ""
 
-def send_to_gpt4_for_json(content, model="gpt-4o-mini-2024-07-18", max_tokens=4000):
+def send_to_gpt4_for_json(content, model="gpt-4o-mini-2024-07-18", max_tokens=None):
+    if max_tokens is None:
+        max_tokens = budget.max_tokens_for(content)
     try:
         logger.info(f"Sending content to GPT-4")
         print("\nInput Text:")
@@ -116,29 +103,35 @@ def send_to_gpt4_for_json(content, model="gpt-4o-mini-2024-07-18", max_tokens=40
             {"role": "user", "content": user_prompt + "\n\n" + content}
         ]
 
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=0.1
-        )
-        
-        result = response.choices[0].message.content
+        result = retry.call(lambda: cached_chat_completion(
+            cache, client, model, messages,
+            system_prompt, user_prompt, content,
+            temperature=0.1, max_tokens=max_tokens
+        ))
         logger.debug(f"Raw GPT response:\n{result}")
         
-        # Проверяем и исправляем JSON
-        fixed_result = validate_json_response(result)
-        logger.debug(f"Fixed JSON response:\n{fixed_result}")
+        # Проверяем JSON
+        result = validate_json_response(result)
         
         print("\nGPT Response:")
         print("="*50)
-        print(fixed_result)
+        print(result)
         print("="*50)
-        return fixed_result
+        return result
+    except CacheMissError:
+        raise
     except Exception as e:
         logger.error(f"Error contacting GPT-4 API: {e}")
         return ""
 
+def parse_gpt_response(gpt_response, chunk_text):
+    """
+    Разбирает ответ на часть теста. Если ответ обрезан, сохраняет все
+    закрытые вопросы и дозапрашивает остальные (question_chunker.complete_response).
+    Возвращает None, если часть так и не удалось получить целиком.
+    """
+    return complete_response(gpt_response, chunk_text, send_to_gpt4_for_json)
+
 def process_file(file_path, output_base_dir):
     try:
         logger.info(f"\n{'='*50}\nProcessing file: {file_path}")
@@ -155,25 +148,34 @@ def process_file(file_path, output_base_dir):
             logger.error("No content read from file")
             return
         
-        gpt_response = send_to_gpt4_for_json(content)
-        if not gpt_response:
+        # Пути формул и изображений уходят в модель метками ⟦F1⟧/⟦I1⟧ и
+        # восстанавливаются после разбора, поэтому обрезаться им негде
+        content, mapping = encode_markers(content)
+        chunks = make_chunks(content, CHUNK_CHARS)
+        if len(chunks) > 1:
+            logger.info(f"Long test split into {len(chunks)} chunks")
+        with ThreadPoolExecutor(max_workers=min(CHUNK_WORKERS, len(chunks))) as executor:
+            responses = list(executor.map(lambda chunk: send_to_gpt4_for_json(chunk[0]), chunks))
+        if not all(responses):
             logger.error("No response from GPT-4")
             return
         
-        try:
-            # Remove any markdown code block syntax
-            stripped_response = gpt_response.strip()
-            if stripped_response.startswith("```"):
-                logger.debug("Removing code block markers")
-                stripped_response = stripped_response.split("```json")[-1].split("```")[0].strip()
-            
-            logger.debug(f"Parsing JSON response:\n{stripped_response}")
-            parsed_data = json.loads(stripped_response)
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}")
-            logger.error(f"Failed JSON string: {stripped_response}")
-            parsed_data = {"title": "", "questions": []}
+        parsed_chunks = [parse_gpt_response(r, chunk_text) for r, (chunk_text, _) in zip(responses, chunks)]
+        if not all(parsed_chunks):
+            logger.error("Incomplete response from GPT-4")
+            return False
+        if len(chunks) == 1:
+            parsed_data = parsed_chunks[0]
+        else:
+            parsed_data = merge_chunk_results(parsed_chunks, chunks)
+            if parsed_data is None:
+                logger.error("Incomplete response from GPT-4")
+                return False
+        parsed_data, complete = restore_markers(parsed_data, mapping)
+        if not complete:
+            # Потерянная метка - потерянная ссылка на формулу или изображение
+            logger.error("Placeholder round trip failed, response rejected")
+            return False
         
         # Create output directory if it doesn't exist
         os.makedirs(os.path.dirname(json_file_path), exist_ok=True)
@@ -222,6 +224,7 @@ if __name__ == "__main__":
         logger.info(f"Processed: {files_processed}")
         logger.info(f"Failed: {files_failed}")
         logger.info(f"Skipped: {files_skipped}")
+        cache.log_stats()
         
     except Exception as e:
         logger.error(f"Fatal error: {e}", exc_info=True)
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+import os
+import re
+import json
+import math
+import logging
+import argparse
+from question_chunker import split_questions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET_PATH = "token_budget.json"
+
+# Границы max_tokens: выход gpt-4o-mini ограничен 16 384 токенами.
+# Значение округляется вверх до MAX_TOKENS_STEP: лимит получает запас,
+# а близкие по размеру тексты - одинаковый max_tokens
+MIN_MAX_TOKENS = 512
+MAX_OUTPUT_TOKENS = 16384
+MAX_TOKENS_STEP = 256
+
+# Коэффициенты до калибровки: ответ почти дословно повторяет текст теста
+# плюс ключи JSON и нумерация
+DEFAULTS = {
+    "input_scale": 1.0,
+    "output_scale": 1.0,
+    "output_per_input": 1.1,
+    "tokens_per_question": 25.0,
+    "margin": 1.25,
+    "samples": 0,
+}
+
+# Цена за 1M токенов (вход, выход), USD; Batch API - вдвое дешевле
+PRICES = {
+    "gpt-4o-mini-2024-07-18": (0.15, 0.60),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+BATCH_DISCOUNT = 0.5
+# Конец инструкции в промптах to_gpt*.py, после него идёт текст теста
+PROMPT_END = "Теперь преобразуй следующий текст:"
+# Оценка задержки одного запроса: постоянная часть плюс скорость генерации
+REQUEST_OVERHEAD_SECONDS = 1.0
+OUTPUT_TOKENS_PER_SECOND = 60.0
+
+# Куски текста, которые токенизатор обычно кодирует вместе
+_PIECE_RE = re.compile(r"[А-Яа-яЁёҢңӨөҮү]+|[A-Za-z]+|\d+|\s*\n\s*|\s+|.", re.DOTALL)
+
+
+def count_tokens(text):
+    """
+    Оценка числа токенов без токенизатора.
+
+    Кириллическое слово - примерно токен на 3 символа (буквы ң, ө, ү
+    встречаются реже и делятся мельче, это покрывает калибровка),
+    латиница - на 4, числа - на 3 цифры, каждый знак препинания - токен,
+    перевод строки с отступом - токен; одиночные пробелы входят в слова.
+    """
+    tokens = 0
+    for piece in _PIECE_RE.findall(text):
+        first = piece[0]
+        if first.isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        elif first.isalpha():
+            tokens += math.ceil(len(piece) / (4 if first.isascii() else 3))
+        elif not piece.isspace() or "\n" in piece:
+            tokens += 1
+    return tokens
+
+
+def _quantile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class TokenBudget:
+    """
+    Калиброванная оценка токенов запроса и ответа модели.
+
+    Ожидаемый ответ = output_per_input * токены текста +
+    tokens_per_question * число вопросов (по question_chunker);
+    max_tokens - ожидаемый ответ с запасом margin (95-й перцентиль
+    отношения реального ответа к оценке на записанных ответах).
+    Коэффициенты хранятся в JSON (TOKEN_BUDGET_PATH) и обновляются
+    командой calibrate.
+    """
+
+    def __init__(self, path=DEFAULT_BUDGET_PATH):
+        self.path = path
+        self.params = dict(DEFAULTS)
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.params.update(json.load(f))
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ.get("TOKEN_BUDGET_PATH", DEFAULT_BUDGET_PATH))
+
+    def input_tokens(self, text):
+        return int(count_tokens(text) * self.params["input_scale"]) + 1
+
+    def prompt_tokens(self, messages):
+        # ~4 служебных токена на сообщение
+        return sum(self.input_tokens(m.get("content") or "") + 4 for m in messages)
+
+    def expected_output(self, content):
+        questions = len(split_questions(content)[1])
+        return int(self.params["output_per_input"] * self.input_tokens(content)
+                   + self.params["tokens_per_question"] * questions) + 1
+
+    def max_tokens_for(self, content):
+        """max_tokens для текста теста (или его части)"""
+        limit = self.expected_output(content) * self.params["margin"]
+        limit = math.ceil(limit / MAX_TOKENS_STEP) * MAX_TOKENS_STEP
+        return max(MIN_MAX_TOKENS, min(MAX_OUTPUT_TOKENS, limit))
+
+    def estimate_request(self, messages, content):
+        """(токены промпта, ожидаемый ответ, max_tokens) для запроса"""
+        return self.prompt_tokens(messages), self.expected_output(content), self.max_tokens_for(content)
+
+    def calibrate(self, samples):
+        """
+        Подбирает коэффициенты по записанным ответам.
+
+        samples - кортежи (текст теста, текст ответа, полный текст промпта,
+        токены промпта, токены ответа, число вопросов в ответе); промпт и
+        счётчики usage известны только для Batch API, иначе None. Точные
+        счётчики задают масштаб оценки count_tokens; без них ответ
+        оценивается той же функцией.
+        """
+        samples = [s for s in samples if s[0] and s[1]]
+        if not samples:
+            raise ValueError("No samples to calibrate on")
+
+        with_usage = [s for s in samples if s[2] and s[3] and s[4]]
+        if with_usage:
+            self.params["input_scale"] = (sum(s[3] for s in with_usage)
+                                          / sum(count_tokens(s[2]) for s in with_usage))
+            self.params["output_scale"] = (sum(s[4] for s in with_usage)
+                                           / sum(count_tokens(s[1]) for s in with_usage))
+
+        # Наименьшие квадраты без свободного члена: y = a * x + b * q
+        rows = []
+        for content, response, _, _, completion_tokens, questions in samples:
+            y = completion_tokens or count_tokens(response) * self.params["output_scale"]
+            rows.append((self.input_tokens(content), questions, y))
+        sxx = sum(x * x for x, _, _ in rows)
+        sxq = sum(x * q for x, q, _ in rows)
+        sqq = sum(q * q for _, q, _ in rows)
+        sxy = sum(x * y for x, _, y in rows)
+        sqy = sum(q * y for _, q, y in rows)
+        det = sxx * sqq - sxq * sxq
+        if det > 0:
+            a = (sxy * sqq - sqy * sxq) / det
+            b = (sqy * sxx - sxy * sxq) / det
+            if a > 0 and b >= 0:
+                self.params["output_per_input"] = a
+                self.params["tokens_per_question"] = b
+            else:
+                logger.warning(f"Fit rejected (a={a:.3f}, b={b:.1f}), keeping ratios")
+        else:
+            self.params["output_per_input"] = sum(y for _, _, y in rows) / max(1, sum(x for x, _, _ in rows))
+            self.params["tokens_per_question"] = 0.0
+
+        ratios = []
+        for x, q, y in rows:
+            predicted = self.params["output_per_input"] * x + self.params["tokens_per_question"] * q
+            if predicted > 0:
+                ratios.append(y / predicted)
+        self.params["margin"] = max(1.05, _quantile(ratios, 0.95)) if ratios else DEFAULTS["margin"]
+        self.params["samples"] = len(samples)
+        return self.params
+
+    def save(self, path=None):
+        path = path or self.path
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.params, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+def _response_questions(response):
+    text = response.strip()
+    if text.startswith("```"):
+        text = text.split("```json")[-1].split("```")[0]
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    questions = data.get("questions") if isinstance(data, dict) else None
+    return len(questions) if isinstance(questions, list) else None
+
+
+def samples_from_outputs(input_dir, json_dir):
+    """
+    Пары (текст теста, сохранённый JSON) корпуса: input_dir/X.txt ->
+    json_dir/X.json. Точных счётчиков токенов у них нет.
+    """
+    samples = []
+    for root, _, files in os.walk(input_dir):
+        for name in files:
+            if not name.endswith(".txt"):
+                continue
+            txt_path = os.path.join(root, name)
+            json_path = os.path.join(json_dir, os.path.relpath(txt_path, input_dir)[:-4] + ".json")
+            try:
+                with open(txt_path, "r", encoding="utf-8") as f:
+                    content = f.read()
+                with open(json_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not isinstance(data, dict) or not data.get("questions"):
+                continue
+            response = json.dumps(data, ensure_ascii=False, indent=4)
+            samples.append((content, response, None, None, None, len(data["questions"])))
+    return samples
+
+
+def samples_from_batch(batch_dir, result_files):
+    """
+    Запросы из шардов batch_dir и ответы Batch API с точными usage.
+    Текст теста - последнее сообщение пользователя после PROMPT_END.
+    """
+    requests = {}
+    for name in sorted(os.listdir(batch_dir)):
+        if not (name.startswith("batch_") and name.endswith(".jsonl")):
+            continue
+        with open(os.path.join(batch_dir, name), "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    requests[record["custom_id"]] = record["body"]["messages"]
+
+    samples = []
+    for result_path in result_files:
+        with open(result_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                messages = requests.get(record.get("custom_id"))
+                body = (record.get("response") or {}).get("body") or {}
+                if messages is None or not body.get("choices"):
+                    continue
+                choice = body["choices"][0]
+                if choice.get("finish_reason") == "length":
+                    continue  # обрезанный ответ занизил бы оценку
+                response = choice["message"]["content"] or ""
+                questions = _response_questions(response)
+                usage = body.get("usage") or {}
+                if questions is None:
+                    continue
+                # Промпт целиком сравнивается с usage.prompt_tokens
+                prompt = "\n".join(m.get("content") or "" for m in messages)
+                content = messages[-1].get("content") or ""
+                content = content.rsplit(PROMPT_END, 1)[-1].strip()
+                samples.append((content, response, prompt, usage.get("prompt_tokens"),
+                                usage.get("completion_tokens"), questions))
+    return samples
+
+
+def plan_requests(requests, model, concurrency, rpm, tpm):
+    """
+    Прогноз запуска по списку запросов (токены промпта, ожидаемый ответ,
+    max_tokens): токены, стоимость и время с учётом квот RPM/TPM и числа
+    одновременных запросов.
+    """
+    prompt_total = sum(r[0] for r in requests)
+    output_total = sum(r[1] for r in requests)
+    reserved_total = sum(r[0] + r[2] for r in requests)
+    input_price, output_price = PRICES.get(model, PRICES["gpt-4o-mini"])
+    cost = (prompt_total * input_price + output_total * output_price) / 1_000_000
+    latency = sum(REQUEST_OVERHEAD_SECONDS + r[1] / OUTPUT_TOKENS_PER_SECOND for r in requests)
+    seconds = max(
+        len(requests) / rpm * 60 if rpm else 0,
+        (prompt_total + output_total) / tpm * 60 if tpm else 0,
+        latency / max(1, concurrency),
+    )
+    return {
+        "requests": len(requests),
+        "prompt_tokens": prompt_total,
+        "output_tokens": output_total,
+        "reserved_tokens": reserved_total,
+        "cost_usd": cost,
+        "batch_cost_usd": cost * BATCH_DISCOUNT,
+        "wall_seconds": seconds,
+    }
+
+
+def log_plan(plan):
+    logger.info(f"Planned requests: {plan['requests']}")
+    logger.info(f"Tokens: prompt {plan['prompt_tokens']}, expected output {plan['output_tokens']}, "
+                f"reserved max {plan['reserved_tokens']}")
+    logger.info(f"Cost: ${plan['cost_usd']:.2f} (Batch API: ${plan['batch_cost_usd']:.2f})")
+    logger.info(f"Wall time: {plan['wall_seconds'] / 60:.1f} min")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Калибровка оценки токенов для запросов к модели")
+    parser.add_argument("command", choices=["calibrate", "show", "estimate"])
+    parser.add_argument("paths", nargs="*",
+                        help="estimate: .txt files; calibrate: input_dir json_dir (optional)")
+    parser.add_argument("--path", default=os.environ.get("TOKEN_BUDGET_PATH", DEFAULT_BUDGET_PATH))
+    parser.add_argument("--batch-dir", default=None, help="directory with batch shards")
+    parser.add_argument("--batch-results", nargs="*", default=[], help="downloaded Batch API result files")
+    args = parser.parse_args()
+
+    budget = TokenBudget(args.path)
+    if args.command == "calibrate":
+        samples = []
+        if len(args.paths) == 2:
+            samples += samples_from_outputs(*args.paths)
+        if args.batch_dir and args.batch_results:
+            samples += samples_from_batch(args.batch_dir, args.batch_results)
+        for name, value in budget.calibrate(samples).items():
+            print(f"{name}: {value}")
+        budget.save()
+        print(f"Saved to {args.path}")
+    elif args.command == "show":
+        for name, value in budget.params.items():
+            print(f"{name}: {value}")
+    else:
+        for file_path in args.paths:
+            with open(file_path, "r", encoding="utf-8") as f:
+                content = f.read()
+            print(f"{file_path}: input {budget.input_tokens(content)}, "
+                  f"expected output {budget.expected_output(content)}, max_tokens {budget.max_tokens_for(content)}")